@@ -30,15 +30,27 @@ This file deterministically generates strings from a JSGF Grammar, whether there
         ``python DeterministicGenerator.py IdeasNonRecursive.gram``
 
 This will generate all strings defined by the public rules of IdeasNonRecursive.gram.\
-        It is important that the grammar used by the generator is not recursive (rules \
-        should not directly or indirectly reference themselves), so that the generator\
-        terminates. Otherwise, you may get a maximum recursion depth exceeded error or \
-        a segmentation fault. 
+        A recursive grammar (with rules that directly or indirectly reference \
+        themselves) defines infinitely many strings, so it needs a bound: \
+        ``--max-depth`` limits how deeply rules are nested in a derivation and \
+        ``--max-length`` the number of tokens of a string (see \
+        :func:`iterBoundedExpansions`). ``--order breadth`` or ``--order length`` \
+        yields shallower or shorter strings first:
+
+        ``python DeterministicGenerator.py Ideas.gram --max-depth 6 --order length``
+
+Strings are streamed as they are generated (see :func:`iterExpansions`), so \
+        output starts right away and memory does not grow with the number of \
+        strings. Pass ``--materialize`` to build each rule's full list first.
 """
 
-import sys, itertools
+import os, sys, itertools, argparse, collections, concurrent.futures, weakref, heapq, tempfile, threading
 import JSGFParser as parser
 import JSGFGrammar as gram
+import JSGFCache as cache
+import JSGFCompiler as compiler
+import JSGFAutomaton as fsa
+import JSGFAsync
 
 
 def combineSets(listOfSets):
@@ -57,21 +69,818 @@ def combineSets(listOfSets):
         totalCrossProduct = currentProduct
     return totalCrossProduct
 
+#: Default memory budget of the expansion cache in bytes
+DEFAULT_EXPANSION_CACHE_SIZE = 64 * 1024 * 1024
+
+class ExpansionCache():
+    """
+    Keeps the expansions of nonterminals, so that a rule referenced from many
+    places is expanded once. Expansions are stored as tuples of strings,
+    keyed by rule name, and the least recently used ones are evicted when
+    their estimated size goes over the memory budget.
+
+    Each entry remembers the rules it was expanded from. When a rule of the
+    grammar is redefined (see JSGFGrammar.Grammar.replaceRule), the entries
+    that used it are dropped; a different grammar empties the cache.
+
+    The cache can be shared by threads: two threads missing the same rule
+    both expand it, and the first result is kept.
+    """
+
+    def __init__(self, maxSize=DEFAULT_EXPANSION_CACHE_SIZE):
+        self.maxSize = maxSize
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.grammarRef = None
+        self.generation = None
+        self.lock = threading.Lock()
+        # rules used by the expansions in progress in each thread, innermost
+        # last, in the dependencies attribute
+        self.local = threading.local()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def statistics(self):
+        """
+        :returns: dictionary of the hit, miss, eviction and invalidation \
+                counts, and of the number and estimated size of the entries
+        """
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'invalidations': self.invalidations, 'entries': len(self.entries), 'size': self.size}
+
+    def _check(self, grammar):
+        # called with the lock held
+        if self.grammarRef is None or self.grammarRef() is not grammar:
+            self.entries.clear()
+            self.size = 0
+            self.grammarRef = weakref.ref(grammar)
+            self.generation = grammar.generation
+        elif self.generation != grammar.generation:
+            ruleIndex = grammar.ruleIndex
+            for name, (expansions, rules, size) in list(self.entries.items()):
+                if any(ruleIndex.get(ruleName) is not rule for ruleName, rule in rules.items()):
+                    del self.entries[name]
+                    self.size -= size
+                    self.invalidations += 1
+            self.generation = grammar.generation
+
+    def expand(self, nt, grammar, expandRHS):
+        """
+        Returns the expansions of a nonterminal from the cache, or expands
+        its rule and stores the result
+
+        :param nt: NonTerminal
+        :param grammar: grammar defining the rules
+        :param expandRHS: function returning the list of strings of an \
+                expression, which expands nonterminals through this cache \
+                so that dependencies are recorded (processRHS does, for \
+                its generator's cache)
+        :returns: tuple of strings
+        """
+        dependencies = getattr(self.local, 'dependencies', None)
+        if dependencies is None:
+            dependencies = self.local.dependencies = []
+        with self.lock:
+            self._check(grammar)
+            generation = self.generation
+            entry = self.entries.get(nt.name)
+            if entry is not None:
+                self.hits += 1
+                self.entries.move_to_end(nt.name)
+            else:
+                self.misses += 1
+        if entry is not None:
+            if dependencies:
+                dependencies[-1].update(entry[1])
+            return entry[0]
+
+        rules = {nt.name: grammar.ruleIndex.get(nt.name)}
+        dependencies.append(rules)
+        try:
+            expansions = tuple(expandRHS(grammar.getRHS(nt)))
+        finally:
+            dependencies.pop()
+        if dependencies:
+            dependencies[-1].update(rules)
+
+        size = sys.getsizeof(expansions) + sum(map(sys.getsizeof, expansions))
+        if size <= self.maxSize:
+            with self.lock:
+                # a rule redefined meanwhile may have been expanded the old way
+                if self.generation == generation and nt.name not in self.entries:
+                    self.entries[nt.name] = (expansions, rules, size)
+                    self.size += size
+                    while self.size > self.maxSize:
+                        name, (_, _, evictedSize) = self.entries.popitem(last=False)
+                        self.size -= evictedSize
+                        self.evictions += 1
+        return expansions
+
+#: Cache used by the module level functions, None to expand rules every time
+expansionCache = ExpansionCache()
+
+#: Recursion limit while strings are generated. The generators recurse a few
+#: times per nesting level of the grammar, so deep non-recursive grammars
+#: need more than the interpreter default. It is restored afterwards.
+RECURSION_LIMIT = 100000
+
+#: Subexpressions with at most this many expansions are expanded once by
+#: iterExpansions and kept in memory while it runs
+SMALL_EXPANSION_LIMIT = 1000
+
+def joinExpansions(head, tail):
+    """
+    Concatenates two expansions, either of which may be empty
+    """
+    if head and tail:
+        return head + ' ' + tail
+    return head or tail
+
+#: Count of the strings of an expression that uses a recursive rule
+INFINITY = float('inf')
+
+#: Orders in which iterBoundedExpansions can yield strings
+ORDERS = ('canonical', 'breadth', 'length')
+
+#: Number of strings a worker process generates per task with --workers
+WORKER_CHUNK_SIZE = 20000
+
+class DeterministicGenerator():
+    """
+    DeterministicGenerator class, generates the strings of a grammar. It owns
+    the grammar, an expansion cache and the number of strings of each rule
+    found so far, which are kept until the grammar is modified with
+    JSGFGrammar.Grammar.replaceRule. A generator can be shared by threads;
+    the strings of a call do not depend on the calls made by other threads.
+
+    :param grammar: JSGFGrammar object
+    :param cacheSize: memory budget of the expansion cache of processRHS in \
+            bytes, 0 for no cache
+    """
+
+    def __init__(self, grammar, cacheSize=DEFAULT_EXPANSION_CACHE_SIZE):
+        self.grammar = grammar
+        #: ExpansionCache of processRHS, or None
+        self.expansionCache = ExpansionCache(cacheSize) if cacheSize else None
+        self.lock = threading.Lock()
+        self.generation = grammar.generation
+        # rule name -> number of strings, for the rules counted so far
+        self.ruleCounts = {}
+        self.lengths = None
+
+    def _checkGeneration(self):
+        # called with the lock held
+        if self.generation != self.grammar.generation:
+            self.ruleCounts = {}
+            self.lengths = None
+            self.generation = self.grammar.generation
+
+    def processRHS(self, rhs):
+        """
+        Returns the strings of an expression, expanding each nonterminal
+        through the expansion cache
+
+        :param rhs: portion of JSGF rule
+        :type rhs: either a JSGF Expression, list, or string
+        :returns: list of strings
+        """
+        with parser.recursionLimit(RECURSION_LIMIT):
+            return self._processRHS(rhs)
+
+    def _processRHS(self, rhs):
+        if type(rhs) is list:
+            return self._processSequence(rhs)
+        elif isinstance(rhs, gram.Disjunction):
+            return self._processDisjunction(rhs)
+        elif isinstance(rhs, gram.Optional):
+            return self._processOptional(rhs)
+        elif isinstance(rhs, gram.NonTerminal):
+            return self._processNonTerminal(rhs)
+        elif isinstance(rhs, str):
+            return [rhs]
+
+    def _processSequence(self, seq):
+        # the cross product of the strings of the components
+        componentSets = []
+        for component in seq:
+            componentSets.append(self._processRHS(component))
+        return combineSets(componentSets)
+
+    def _processNonTerminal(self, nt):
+        if self.expansionCache is None:
+            return self._processRHS(self.grammar.getRHS(nt))
+        return list(self.expansionCache.expand(nt, self.grammar, self._processRHS))
+
+    def _processDisjunction(self, disj):
+        # the strings of each alternative, one after the other
+        disjunctExpansions = []
+        if type(disj.disjuncts[0]) is tuple:
+            disjuncts = map(lambda x : x[0], disj.disjuncts)
+        else:
+            disjuncts = disj.disjuncts
+        for disjunct in disjuncts:
+            disjunctExpansions.extend(self._processRHS(disjunct))
+        return disjunctExpansions
+
+    def _processOptional(self, opt):
+        # the empty string, then the strings of the option
+        optional = ['']
+        optional.extend(self._processRHS(opt.option))
+        return optional
+
+    def iterExpansions(self, rhs, smallExpansions=None):
+        """
+        Yields the same strings as processRHS, in the same order, one at a
+        time. Sequences are enumerated as nested lazy products, so the memory
+        used depends on the depth of the grammar rather than on the number of
+        strings. Subexpressions and sequence suffixes with at most
+        SMALL_EXPANSION_LIMIT expansions are expanded once and reused from
+        memory, which keeps the inner loops as fast as processRHS.
+
+        :param rhs: portion of JSGF rule
+        :param smallExpansions: dictionary of the small expansions found so \
+                far, shared by the recursive calls
+        :returns: generator of strings; the recursion limit is raised to \
+                RECURSION_LIMIT until it is exhausted or closed
+        """
+        with parser.recursionLimit(RECURSION_LIMIT):
+            yield from self._iterExpansions(rhs, {} if smallExpansions is None else smallExpansions)
+
+    def _iterExpansions(self, rhs, smallExpansions):
+        expansions = self._smallExpansions(rhs, smallExpansions)
+        if expansions is not None:
+            yield from expansions
+        elif type(rhs) is list:
+            yield from self._iterSequence(rhs, 0, smallExpansions)
+        elif isinstance(rhs, gram.Disjunction):
+            for disjunct in rhs.disjuncts:
+                if type(disjunct) is tuple:
+                    disjunct = disjunct[0]
+                yield from self._iterExpansions(disjunct, smallExpansions)
+        elif isinstance(rhs, gram.Optional):
+            yield ''
+            yield from self._iterExpansions(rhs.option, smallExpansions)
+        elif isinstance(rhs, gram.NonTerminal):
+            yield from self._iterExpansions(self.grammar.getRHS(rhs), smallExpansions)
+        elif isinstance(rhs, tuple):
+            yield from self._iterExpansions(rhs[0], smallExpansions)
+        elif isinstance(rhs, str):
+            yield rhs
+
+    def _smallExpansions(self, rhs, smallExpansions):
+        """
+        :returns: list of the expansions of rhs if there are at most \
+                SMALL_EXPANSION_LIMIT of them, None otherwise
+        """
+        if isinstance(rhs, str):
+            return [rhs]
+        key = id(rhs)
+        if key not in smallExpansions:
+            # marks rhs as being expanded, so the attempt below goes lazy
+            smallExpansions[key] = None
+            expansions = list(itertools.islice(self._iterExpansions(rhs, smallExpansions),
+                                               SMALL_EXPANSION_LIMIT + 1))
+            if len(expansions) <= SMALL_EXPANSION_LIMIT:
+                smallExpansions[key] = expansions
+        return smallExpansions[key]
+
+    def _smallSuffix(self, seq, start, smallExpansions):
+        """
+        :returns: list of the expansions of seq[start:] if there are at most \
+                SMALL_EXPANSION_LIMIT of them, None otherwise
+        """
+        if start == len(seq):
+            return ['']
+        key = (id(seq), start)
+        if key not in smallExpansions:
+            head = self._smallExpansions(seq[start], smallExpansions)
+            tail = self._smallSuffix(seq, start + 1, smallExpansions)
+            suffix = None
+            if head is not None and tail is not None and len(head) * len(tail) <= SMALL_EXPANSION_LIMIT:
+                suffix = [joinExpansions(h, t) for h in head for t in tail]
+            smallExpansions[key] = suffix
+        return smallExpansions[key]
+
+    def _iterSequence(self, seq, start, smallExpansions):
+        """
+        Yields the expansions of seq[start:], the first element varying slowest
+        """
+        tail = self._smallSuffix(seq, start + 1, smallExpansions)
+        for head in self._iterExpansions(seq[start], smallExpansions):
+            if tail is not None:
+                for expansion in tail:
+                    yield joinExpansions(head, expansion)
+            else:
+                for expansion in self._iterSequence(seq, start + 1, smallExpansions):
+                    yield joinExpansions(head, expansion)
+
+    def _newCounts(self):
+        # a dictionary of counts for one call, holding the rules counted so far
+        with self.lock:
+            self._checkGeneration()
+            return dict(self.ruleCounts), self.generation
+
+    def _keepCounts(self, counts, generation):
+        # keeps the rules a call counted for the next calls
+        names = {key: count for key, count in counts.items() if type(key) is str and count is not None}
+        if len(names) > len(self.ruleCounts):
+            with self.lock:
+                if self.generation == generation:
+                    self.ruleCounts.update(names)
+
+    def countExpansions(self, rhs, counts=None):
+        """
+        Counts the strings processRHS would return for an expression, without
+        generating them. Each node is counted once, bottom-up: a disjunction
+        adds the counts of its alternatives, a sequence multiplies the counts
+        of its elements and an optional adds one to the count of its option.
+        Counts are exact Python integers, however large.
+
+        :param rhs: portion of JSGF rule
+        :param counts: dictionary of the counts found so far, shared by the \
+                recursive calls; nonterminals are keyed by name, other nodes \
+                by id. If None, the counts of the rules are kept by the \
+                generator for later calls.
+        :returns: number of strings, or INFINITY if rhs uses a recursive rule
+        """
+        if isinstance(rhs, str):
+            return 1
+        with parser.recursionLimit(RECURSION_LIMIT):
+            if counts is not None:
+                return self._countExpansions(rhs, counts)
+            counts, generation = self._newCounts()
+            count = self._countExpansions(rhs, counts)
+            self._keepCounts(counts, generation)
+            return count
+
+    def _countExpansions(self, rhs, counts):
+        if isinstance(rhs, str):
+            return 1
+        if isinstance(rhs, gram.NonTerminal):
+            if rhs.name in counts:
+                count = counts[rhs.name]
+                # None marks a rule being counted, so rhs refers to itself
+                return INFINITY if count is None else count
+            counts[rhs.name] = None
+            count = counts[rhs.name] = self._countExpansions(self.grammar.getRHS(rhs), counts)
+            return count
+        key = id(rhs)
+        if key in counts:
+            return counts[key]
+        if type(rhs) is list:
+            count = 1
+            for component in rhs:
+                componentCount = self._countExpansions(component, counts)
+                if componentCount == INFINITY or count == INFINITY:
+                    count = INFINITY
+                else:
+                    count *= componentCount
+        elif isinstance(rhs, gram.Disjunction):
+            count = 0
+            for disjunct in rhs.disjuncts:
+                if type(disjunct) is tuple:
+                    disjunct = disjunct[0]
+                disjunctCount = self._countExpansions(disjunct, counts)
+                count = INFINITY if INFINITY in (count, disjunctCount) else count + disjunctCount
+        elif isinstance(rhs, gram.Optional):
+            count = self._countExpansions(rhs.option, counts)
+            if count != INFINITY:
+                count += 1
+        elif isinstance(rhs, tuple):
+            count = self._countExpansions(rhs[0], counts)
+        counts[key] = count
+        return count
+
+    def countDistinct(self, rhs):
+        """
+        Counts the different strings of an expression. Different derivations
+        can produce the same string, so unlike countExpansions this has to
+        generate the strings; it only keeps the distinct ones in memory.
+
+        :returns: number of distinct strings, or INFINITY if rhs uses a recursive rule
+        """
+        if self.countExpansions(rhs) == INFINITY:
+            return INFINITY
+        return len(set(self.iterExpansions(rhs)))
+
+    def countRules(self, rules=None, counts=None):
+        """
+        Counts the strings of several rules, sharing the counts of the rules
+        they have in common
+
+        :param rules: list of Rule objects, such as grammar.rules or \
+                grammar.publicRules; the public rules if None
+        :returns: dictionary from rule name to number of strings
+        """
+        if rules is None:
+            rules = self.grammar.publicRules
+        if counts is None:
+            counts, generation = self._newCounts()
+            result = self.countRules(rules, counts)
+            self._keepCounts(counts, generation)
+            return result
+        return {gram.ruleName(rule.lhs): self.countExpansions(rule.rhs, counts) for rule in rules}
+
+    def _countSuffix(self, seq, start, counts):
+        """
+        :returns: number of strings of seq[start:]
+        """
+        key = (id(seq), start)
+        if key not in counts:
+            count = 1
+            for component in seq[start:]:
+                componentCount = self._countExpansions(component, counts)
+                count = INFINITY if INFINITY in (count, componentCount) else count * componentCount
+            counts[key] = count
+        return counts[key]
+
+    def _checkIndex(self, rhs, index, counts):
+        count = self.countExpansions(rhs, counts)
+        if count == INFINITY:
+            raise ValueError('Expansions of recursive rules cannot be indexed')
+        if not 0 <= index < count:
+            raise IndexError('Expansion index out of range: ' + str(index))
+
+    def expansionAt(self, rhs, index, counts=None):
+        """
+        Returns the string at a position of the list processRHS would return,
+        without generating the strings before it. The index is decoded in
+        mixed radix: a sequence splits it into one digit per element, the
+        first element being the most significant, and a disjunction or
+        optional subtracts the counts of the alternatives before the one it
+        falls in. The cost depends on the size of the grammar, not on the
+        index.
+
+        :param rhs: portion of JSGF rule
+        :param index: position of the string, from 0
+        :param counts: dictionary shared with countExpansions
+        :returns: string
+        :raises IndexError: if index is not less than the number of strings
+        :raises ValueError: if rhs uses a recursive rule
+        """
+        if counts is None:
+            counts, generation = self._newCounts()
+            self._checkIndex(rhs, index, counts)
+            self._keepCounts(counts, generation)
+        else:
+            self._checkIndex(rhs, index, counts)
+        tokens = []
+        with parser.recursionLimit(RECURSION_LIMIT):
+            self._appendExpansionAt(rhs, index, counts, tokens)
+        return ' '.join(tokens)
+
+    def _appendExpansionAt(self, rhs, index, counts, tokens):
+        while True:
+            if isinstance(rhs, str):
+                if rhs:
+                    tokens.append(rhs)
+                return
+            elif type(rhs) is list:
+                digits = []
+                for component in reversed(rhs):
+                    index, digit = divmod(index, self._countExpansions(component, counts))
+                    digits.append(digit)
+                for component, digit in zip(rhs, reversed(digits)):
+                    self._appendExpansionAt(component, digit, counts, tokens)
+                return
+            elif isinstance(rhs, gram.Disjunction):
+                for disjunct in rhs.disjuncts:
+                    if type(disjunct) is tuple:
+                        disjunct = disjunct[0]
+                    count = self._countExpansions(disjunct, counts)
+                    if index < count:
+                        break
+                    index -= count
+                rhs = disjunct
+            elif isinstance(rhs, gram.Optional):
+                if index == 0:
+                    return
+                rhs, index = rhs.option, index - 1
+            elif isinstance(rhs, gram.NonTerminal):
+                rhs = self.grammar.getRHS(rhs)
+            elif isinstance(rhs, tuple):
+                rhs = rhs[0]
+
+    def iterExpansionsFrom(self, rhs, start, counts=None, smallExpansions=None):
+        """
+        Yields the strings of iterExpansions from a position on, without
+        generating the strings before it, so that an interrupted enumeration
+        can be resumed or a slice of it taken
+
+        :param rhs: portion of JSGF rule
+        :param start: position of the first string, from 0
+        :param counts: dictionary shared with countExpansions
+        :param smallExpansions: dictionary shared with iterExpansions
+        :returns: generator of strings, empty if start is past the last string
+        :raises ValueError: if rhs uses a recursive rule
+        """
+        if counts is None:
+            counts = self._newCounts()[0]
+        if smallExpansions is None:
+            smallExpansions = {}
+        try:
+            self._checkIndex(rhs, start, counts)
+        except IndexError:
+            return
+        with parser.recursionLimit(RECURSION_LIMIT):
+            yield from self._iterExpansionsFrom(rhs, start, counts, smallExpansions)
+
+    def _iterExpansionsFrom(self, rhs, start, counts, smallExpansions):
+        if start == 0:
+            yield from self._iterExpansions(rhs, smallExpansions)
+        elif type(rhs) is list:
+            yield from self._iterSequenceFrom(rhs, 0, start, counts, smallExpansions)
+        elif isinstance(rhs, gram.Disjunction):
+            for disjunct in rhs.disjuncts:
+                if type(disjunct) is tuple:
+                    disjunct = disjunct[0]
+                count = self._countExpansions(disjunct, counts)
+                if start >= count:
+                    start -= count
+                    continue
+                yield from self._iterExpansionsFrom(disjunct, start, counts, smallExpansions)
+                start = 0
+        elif isinstance(rhs, gram.Optional):
+            yield from self._iterExpansionsFrom(rhs.option, start - 1, counts, smallExpansions)
+        elif isinstance(rhs, gram.NonTerminal):
+            yield from self._iterExpansionsFrom(self.grammar.getRHS(rhs), start, counts, smallExpansions)
+        elif isinstance(rhs, tuple):
+            yield from self._iterExpansionsFrom(rhs[0], start, counts, smallExpansions)
+
+    def _iterSequenceFrom(self, seq, position, start, counts, smallExpansions):
+        """
+        Yields the expansions of seq[position:] from the start-th on
+        """
+        if position + 1 == len(seq):
+            yield from self._iterExpansionsFrom(seq[position], start, counts, smallExpansions)
+            return
+        head, start = divmod(start, self._countSuffix(seq, position + 1, counts))
+        for expansion in self._iterExpansionsFrom(seq[position], head, counts, smallExpansions):
+            if start:
+                tail = self._iterSequenceFrom(seq, position + 1, start, counts, smallExpansions)
+                start = 0
+            else:
+                tail = self._smallSuffix(seq, position + 1, smallExpansions)
+                if tail is None:
+                    tail = self._iterSequence(seq, position + 1, smallExpansions)
+            for suffix in tail:
+                yield joinExpansions(expansion, suffix)
+
+    def minimumLengths(self):
+        """
+        Computes the smallest number of tokens each rule of the grammar can
+        produce, by iterating to a fixed point so that recursive rules are
+        handled. The result is kept until the grammar is modified.
+
+        :returns: dictionary from rule name to number of tokens, INFINITY for \
+                rules that never finish expanding
+        """
+        with self.lock:
+            self._checkGeneration()
+            if self.lengths is None:
+                lengths = dict.fromkeys(self.grammar.ruleIndex, INFINITY)
+                changed = True
+                while changed:
+                    changed = False
+                    for name, rule in self.grammar.ruleIndex.items():
+                        length = _minimumLength(rule.rhs, lengths)
+                        if length < lengths[name]:
+                            lengths[name] = length
+                            changed = True
+                self.lengths = lengths
+            return dict(self.lengths)
+
+    def iterBoundedExpansions(self, rhs, maxDepth=None, maxLength=None, order='canonical'):
+        """
+        Yields the strings of an expression that can be derived within
+        bounds, which also works for recursive rules. The derivations are
+        explored with an explicit stack or priority queue, so neither the
+        grammar nor the bounds are limited by the interpreter recursion limit.
+
+        The depth of a derivation is the largest number of nested
+        nonterminals expanded in it; the expression itself is at depth 0. The
+        length of a string is its number of tokens. Branches that cannot fit
+        in maxLength, given the shortest strings of the rules left to expand,
+        are cut early. With maxLength alone, a rule that can reach itself
+        without producing a token derives some strings in infinitely many
+        ways; give maxDepth too.
+
+        :param rhs: portion of JSGF rule
+        :param maxDepth: largest derivation depth, unbounded if None
+        :param maxLength: largest number of tokens, unbounded if None
+        :param order: 'canonical' for the order of processRHS (depth first), \
+                'breadth' for strings of shallower derivations first, \
+                'length' for shorter strings first. The last two keep every \
+                partial derivation of the current depth or length in memory.
+        :returns: generator of strings, one per derivation
+        :raises ValueError: if neither bound is given, as the strings of a \
+                recursive rule never end
+        """
+        if maxDepth is None and maxLength is None:
+            raise ValueError('A maximum derivation depth or sentence length is needed')
+        if order not in ORDERS:
+            raise ValueError('Unknown order: ' + str(order))
+        for tokens in self._iterDerivations(rhs, maxDepth, maxLength, self.minimumLengths(), order):
+            yield ' '.join(tokens)
+
+    def _iterDerivations(self, rhs, maxDepth, maxLength, lengths, order):
+        """
+        Explores the leftmost derivations of rhs. A state holds the linked
+        list of (expression, depth, minimum length, next) still to expand and
+        the tokens produced so far, as a reversed linked list. States are
+        taken from a stack for the canonical order, otherwise from a heap
+        keyed by depth reached or by smallest final length; both keys never
+        decrease as a derivation goes on, so complete derivations come out in
+        key order.
+
+        :returns: generator of lists of tokens
+        """
+        getRHS = self.grammar.getRHS
+        minimumLength = {}
+        def pending(expr, depth, rest):
+            key = id(expr)
+            if key not in minimumLength:
+                minimumLength[key] = _minimumLength(expr, lengths)
+            return (expr, depth, minimumLength[key], rest)
+
+        if maxLength is None:
+            maxLength = INFINITY
+        if maxDepth is None:
+            maxDepth = INFINITY
+        # (pending expressions, tokens, number of tokens, minimum number of
+        # tokens still to come, depth reached)
+        first = pending(rhs, 0, None)
+        states = [(first, None, 0, first[2], 0)]
+        heap = []
+        counter = itertools.count()
+        while states or heap:
+            if states:
+                rest, tokens, numTokens, minimumRest, reached = states.pop()
+            else:
+                rest, tokens, numTokens, minimumRest, reached = heapq.heappop(heap)[2]
+            if rest is None:
+                sentence = []
+                while tokens is not None:
+                    token, tokens = tokens
+                    sentence.append(token)
+                sentence.reverse()
+                yield sentence
+                continue
+
+            expr, depth, exprLength, rest = rest
+            minimumRest -= exprLength
+            successors = []
+            if isinstance(expr, str):
+                if expr:
+                    successors.append((rest, (expr, tokens), numTokens + 1, minimumRest, reached))
+                else:
+                    successors.append((rest, tokens, numTokens, minimumRest, reached))
+            elif type(expr) is list:
+                for component in reversed(expr):
+                    rest = pending(component, depth, rest)
+                    minimumRest += rest[2]
+                successors.append((rest, tokens, numTokens, minimumRest, reached))
+            elif isinstance(expr, gram.Disjunction):
+                for disjunct in expr.disjuncts:
+                    state = pending(disjunct, depth, rest)
+                    successors.append((state, tokens, numTokens, minimumRest + state[2], reached))
+            elif isinstance(expr, gram.Optional):
+                successors.append((rest, tokens, numTokens, minimumRest, reached))
+                state = pending(expr.option, depth, rest)
+                successors.append((state, tokens, numTokens, minimumRest + state[2], reached))
+            elif isinstance(expr, gram.NonTerminal):
+                if depth < maxDepth:
+                    state = pending(getRHS(expr), depth + 1, rest)
+                    successors.append((state, tokens, numTokens, minimumRest + state[2],
+                                       max(reached, depth + 1)))
+            elif isinstance(expr, tuple):
+                state = pending(expr[0], depth, rest)
+                successors.append((state, tokens, numTokens, minimumRest + state[2], reached))
+
+            successors = [state for state in successors if state[2] + state[3] <= maxLength]
+            if order == 'canonical':
+                states.extend(reversed(successors))
+            elif order == 'breadth':
+                for state in successors:
+                    heapq.heappush(heap, (state[4], next(counter), state))
+            else:
+                for state in successors:
+                    heapq.heappush(heap, (state[2] + state[3], next(counter), state))
+
+    def splitExpansions(self, rules, offset=0, limit=None, chunkSize=WORKER_CHUNK_SIZE, counts=None):
+        """
+        Splits the strings of several rules, taken one rule after the other,
+        into contiguous ranges of at most chunkSize strings
+
+        :param rules: list of Rule objects
+        :param offset: number of strings to skip at the beginning
+        :param limit: number of strings to cover, all of them if None
+        :returns: generator of (rule position, start, stop) tuples, in order
+        :raises ValueError: if one of the ranges falls in a recursive rule
+        """
+        if counts is None:
+            counts = self._newCounts()[0]
+        for position, rule in enumerate(rules):
+            if limit == 0:
+                return
+            count = self.countExpansions(rule.rhs, counts)
+            if count == INFINITY:
+                raise ValueError('Expansions of recursive rules cannot be split: ' + str(gram.ruleName(rule.lhs)))
+            if offset >= count:
+                offset -= count
+                continue
+            stop = count if limit is None else min(count, offset + limit)
+            for start in range(offset, stop, chunkSize):
+                yield position, start, min(start + chunkSize, stop)
+            if limit is not None:
+                limit -= stop - offset
+            offset = 0
+
+    def iterParallelExpansions(self, workers, offset=0, limit=None, chunkSize=WORKER_CHUNK_SIZE):
+        """
+        Generates the strings of the public rules of the grammar in a pool of
+        worker processes, each enumerating a contiguous range of them with
+        iterExpansionsFrom. The text of the ranges comes back in order, so
+        the output is the same as with a single process; only a few ranges
+        per worker are in flight at any time.
+
+        :param workers: number of worker processes
+        :param offset: number of strings to skip at the beginning
+        :param limit: number of strings to generate, all of them if None
+        :returns: generator of blocks of text, one string per line
+        """
+        tasks = self.splitExpansions(self.grammar.publicRules, offset, limit, chunkSize)
+        with concurrent.futures.ProcessPoolExecutor(workers, initializer=_initWorker,
+                                                    initargs=(self.grammar,)) as pool:
+            pending = collections.deque()
+            for task in tasks:
+                pending.append(pool.submit(_expandRange, task))
+                if len(pending) >= 4 * workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def aiterExpansions(self, rhs, blockSize=JSGFAsync.DEFAULT_BLOCK_SIZE, executor=None):
+        """
+        Streams the strings of iterExpansions to an asyncio consumer. They
+        are generated in blocks in a thread, so the event loop is not
+        blocked.
+
+        :param rhs: portion of JSGF rule
+        :param blockSize: number of strings generated per step
+        :param executor: concurrent.futures executor generating the blocks, \
+                the default executor of the loop if None
+        :returns: asynchronous generator of strings, see JSGFAsync.iterateAsync
+        """
+        return JSGFAsync.iterateAsync(self.iterExpansions(rhs), blockSize, executor)
+
+def _minimumLength(rhs, lengths):
+    if isinstance(rhs, str):
+        return 1 if rhs else 0
+    elif type(rhs) is list:
+        return sum(_minimumLength(component, lengths) for component in rhs)
+    elif isinstance(rhs, gram.Disjunction):
+        return min(_minimumLength(disjunct, lengths) for disjunct in rhs.disjuncts)
+    elif isinstance(rhs, gram.Optional):
+        return 0
+    elif isinstance(rhs, gram.NonTerminal):
+        return lengths.get(rhs.name, INFINITY)
+    elif isinstance(rhs, tuple):
+        return _minimumLength(rhs[0], lengths)
+
+# generator of the module level functions, which are kept for existing
+# callers; it is rebuilt when grammar or expansionCache is reassigned
+_moduleGenerator = None
+
+def _generator():
+    global _moduleGenerator
+    generator = _moduleGenerator
+    if generator is None or generator.grammar is not grammar or generator.expansionCache is not expansionCache:
+        generator = DeterministicGenerator(grammar, 0)
+        generator.expansionCache = expansionCache
+        _moduleGenerator = generator
+    return generator
+
 def processSequence(seq):
     """
     Combines adjacent elements in a sequence
     """
-    componentSets = []
-    for component in seq:
-        componentSets.append(processRHS(component))
-    return combineSets(componentSets)
-
+    return _generator().processRHS(seq)
 
 def processNonTerminal(nt):
     """
     Finds the rule expansion for a nonterminal and returns its expansion.
+    The expansions are taken from expansionCache when possible.
     """
-    return processRHS(grammar.getRHS(nt))
+    return _generator().processRHS(nt)
 
 def processDisjunction(disj):
     """
@@ -79,14 +888,7 @@ def processDisjunction(disj):
 
     :returns: list of strings, where each string is each alternative
     """
-    disjunctExpansions = []
-    if type(disj.disjuncts[0]) is tuple:
-        disjuncts = map(lambda x : x[0], disj.disjuncts)
-    else:
-        disjuncts = disj.disjuncts
-    for disjunct in disjuncts:
-        disjunctExpansions.extend(processRHS(disjunct))
-    return disjunctExpansions
+    return _generator().processRHS(disj)
 
 def processOptional(opt):
     """
@@ -95,49 +897,381 @@ def processOptional(opt):
     :type opt: JSGFOptional
     :returns: list of strings, including an empty string
     """
-    optional = ['']
-    optional.extend(processRHS(opt.option))
-    return optional
+    return _generator().processRHS(opt)
 
 def processRHS(rhs):
     """
-    Depending on the type of the argument, calls the corresponding
-    function to deal with that type.
+    :meth:`DeterministicGenerator.processRHS` for the module grammar, with
+    expansionCache
+    """
+    return _generator().processRHS(rhs)
 
-    :param rhs: portion of JSGF rule
-    :type rhs: either a JSGF Expression, list, or string
-    :returns: list of strings
+def iterExpansions(rhs, smallExpansions=None):
     """
-    if type(rhs) is list:
-        return processSequence(rhs)
-    elif isinstance(rhs, gram.Disjunction):
-        return processDisjunction(rhs)
-    elif isinstance(rhs, gram.Optional):
-        return processOptional(rhs)
-    elif isinstance(rhs, gram.NonTerminal):
-        return processNonTerminal(rhs)
-    elif isinstance(rhs, str):
-        return [rhs]
+    :meth:`DeterministicGenerator.iterExpansions` for the module grammar
+    """
+    return _generator().iterExpansions(rhs, smallExpansions)
+
+def countExpansions(rhs, counts=None):
+    """
+    :meth:`DeterministicGenerator.countExpansions` for the module grammar
+    """
+    return _generator().countExpansions(rhs, counts)
+
+def countDistinct(rhs):
+    """
+    :meth:`DeterministicGenerator.countDistinct` for the module grammar
+    """
+    return _generator().countDistinct(rhs)
+
+def countRules(rules, counts=None):
+    """
+    :meth:`DeterministicGenerator.countRules` for the module grammar
+    """
+    return _generator().countRules(rules, counts)
+
+def expansionAt(rhs, index, counts=None):
+    """
+    :meth:`DeterministicGenerator.expansionAt` for the module grammar
+    """
+    return _generator().expansionAt(rhs, index, counts)
+
+def iterExpansionsFrom(rhs, start, counts=None, smallExpansions=None):
+    """
+    :meth:`DeterministicGenerator.iterExpansionsFrom` for the module grammar
+    """
+    return _generator().iterExpansionsFrom(rhs, start, counts, smallExpansions)
+
+def minimumLengths():
+    """
+    :meth:`DeterministicGenerator.minimumLengths` for the module grammar
+    """
+    return _generator().minimumLengths()
+
+def iterBoundedExpansions(rhs, maxDepth=None, maxLength=None, order='canonical'):
+    """
+    :meth:`DeterministicGenerator.iterBoundedExpansions` for the module grammar
+    """
+    return _generator().iterBoundedExpansions(rhs, maxDepth, maxLength, order)
+
+def splitExpansions(rules, offset=0, limit=None, chunkSize=WORKER_CHUNK_SIZE, counts=None):
+    """
+    :meth:`DeterministicGenerator.splitExpansions` for the module grammar
+    """
+    return _generator().splitExpansions(rules, offset, limit, chunkSize, counts)
+
+def _initWorker(workerGrammar):
+    global workerGenerator, workerCounts, workerSmallExpansions
+    workerGenerator = DeterministicGenerator(workerGrammar, 0)
+    workerCounts = {}
+    workerSmallExpansions = {}
+
+def _expandRange(task):
+    position, start, stop = task
+    rhs = workerGenerator.grammar.publicRules[position].rhs
+    expansions = workerGenerator.iterExpansionsFrom(rhs, start, workerCounts, workerSmallExpansions)
+    return ''.join([expansion + '\n' for expansion in itertools.islice(expansions, stop - start)])
+
+def iterParallelExpansions(workers, offset=0, limit=None, chunkSize=WORKER_CHUNK_SIZE):
+    """
+    :meth:`DeterministicGenerator.iterParallelExpansions` for the module grammar
+    """
+    return _generator().iterParallelExpansions(workers, offset, limit, chunkSize)
+
+def writeLines(lines, fileStream=None, blockSize=10000):
+    """
+    Writes strings one per line, in blocks of blockSize lines; one write per
+    line costs more than generating the line
+    """
+    write = (fileStream or sys.stdout).write
+    lines = iter(lines)
+    while True:
+        block = ''.join([line + '\n' for line in itertools.islice(lines, blockSize)])
+        if not block:
+            return
+        write(block)
+
+#: Default memory budget of iterUnique in bytes
+DEFAULT_UNIQUE_MEMORY = 512 * 1024 * 1024
+#: Estimated bytes a set uses per string, besides the string itself
+SET_ENTRY_SIZE = 40
+#: Largest number of runs iterUnique merges at once
+MAX_MERGE_RUNS = 64
+
+def iterUnique(lines, maxMemory=DEFAULT_UNIQUE_MEMORY, tempDir=None, statistics=None):
+    """
+    Yields each distinct string once, in fixed memory. Strings are kept in a
+    set and yielded as they first appear until the set reaches maxMemory.
+    From then on, each time the set fills up it is written as a sorted run
+    to a temporary file and emptied. Once the input is exhausted the runs are
+    merged, several at a time if there are more than MAX_MERGE_RUNS, and the
+    strings not yielded yet come out in sorted order.
+
+    :param lines: iterable of strings without newlines
+    :param maxMemory: estimated bytes the set of strings may use
+    :param tempDir: directory for the runs, the system default if None
+    :param statistics: dictionary filled with the numbers of strings read \
+            ('strings'), distinct strings yielded ('unique'), duplicates \
+            dropped ('duplicates') and runs written ('runs'). The counts \
+            are kept up to date, so they are right if the consumer stops \
+            early, except that duplicates spread over several runs are only \
+            found by the merge.
+    :returns: generator of strings
+    :raises ValueError: if maxMemory is not positive
+    """
+    if maxMemory <= 0:
+        raise ValueError('The memory budget must be positive')
+    if statistics is None:
+        statistics = {}
+    statistics.update(strings=0, unique=0, duplicates=0, runs=0)
+    lines = iter(lines)
+    seen = set()
+    size = 0
+    for line in lines:
+        statistics['strings'] += 1
+        if line in seen:
+            statistics['duplicates'] += 1
+            continue
+        seen.add(line)
+        statistics['unique'] += 1
+        yield line
+        size += sys.getsizeof(line) + SET_ENTRY_SIZE
+        if size > maxMemory:
+            break
+    else:
+        return
+
+    with tempfile.TemporaryDirectory(prefix='jsgf-unique-', dir=tempDir) as runDir:
+        # the strings already yielded
+        yieldedRun = _writeRun(runDir, seen, statistics)
+        runs = []
+        seen = set()
+        size = 0
+        for line in lines:
+            statistics['strings'] += 1
+            if line in seen:
+                statistics['duplicates'] += 1
+                continue
+            seen.add(line)
+            size += sys.getsizeof(line) + SET_ENTRY_SIZE
+            if size > maxMemory:
+                runs.append(_writeRun(runDir, seen, statistics))
+                seen = set()
+                size = 0
+        if seen:
+            runs.append(_writeRun(runDir, seen, statistics))
+        del seen
+
+        # the final merge also reads the run of yielded strings
+        fanIn = max(MAX_MERGE_RUNS - 1, 2)
+        while len(runs) > fanIn:
+            merged = _mergeRuns(runs[:fanIn], statistics)
+            runs = runs[fanIn:] + [_writeRun(runDir, (line for line, yielded in merged), statistics)]
+
+        for line, yielded in _mergeRuns([yieldedRun] + runs, statistics, yieldedRuns=1):
+            if not yielded:
+                statistics['unique'] += 1
+                yield line
+
+def _writeRun(runDir, lines, statistics):
+    """
+    Writes strings in sorted order to a new file of runDir
+
+    :returns: path of the file
+    """
+    fd, path = tempfile.mkstemp(dir=runDir, suffix='.run')
+    with open(fd, 'w', encoding='utf-8') as runFile:
+        if isinstance(lines, set):
+            lines = sorted(lines)
+        writeLines(lines, runFile)
+    statistics['runs'] += 1
+    return path
+
+def _readRun(path, tag):
+    """
+    :returns: generator of (string, tag) for the strings of a run
+    """
+    with open(path, 'r', encoding='utf-8') as runFile:
+        for line in runFile:
+            yield line[:-1], tag
+
+def _mergeRuns(paths, statistics, yieldedRuns=0):
+    """
+    Merges sorted runs, dropping and counting the strings found in more
+    than one
+
+    :param yieldedRuns: number of runs, at the start of paths, whose \
+            strings were already yielded
+    :returns: generator of (string, whether a yielded run holds it)
+    """
+    runs = [_readRun(path, position >= yieldedRuns) for position, path in enumerate(paths)]
+    previous = None
+    # among equal strings, those of yielded runs sort first
+    for line, notYielded in heapq.merge(*runs):
+        if line != previous:
+            previous = line
+            yield line, not notYielded
+        else:
+            statistics['duplicates'] += 1
+
+
+def _iterOutputLines(args, generator, program, offset, limit):
+    """
+    Yields the lines main prints for the public rules of the grammar of a
+    DeterministicGenerator, before duplicates are removed. program is the
+    compiled grammar, needed only with --ids or --materialize.
+    """
+    if args.maxDepth is not None or args.maxLength is not None:
+        expansions = itertools.chain.from_iterable(
+            generator.iterBoundedExpansions(rule.rhs, args.maxDepth, args.maxLength, args.order)
+            for rule in generator.grammar.publicRules)
+        stop = None if limit is None else offset + limit
+        yield from itertools.islice(expansions, offset, stop)
+        return
+    if args.workers > 1:
+        for text in generator.iterParallelExpansions(args.workers, offset, limit):
+            yield from text.splitlines()
+        return
+
+    counts = {}
+    roots = program.publicRoots if program is not None else itertools.repeat(None)
+    for rule, root in zip(generator.grammar.publicRules, roots):
+        if limit == 0:
+            break
+        count = generator.countExpansions(rule.rhs, counts)
+        if offset >= count:
+            offset -= count
+            continue
+        if args.ids:
+            expandIds = program.expandIds if args.materialize else program.iterExpandIds
+            expansions = (' '.join(map(str, tokenIds)) for tokenIds in expandIds(root))
+            # the compiled program cannot seek; skipping generates
+            expansions = itertools.islice(expansions, offset, None)
+        elif args.materialize:
+            expansions = itertools.islice(program.expand(root), offset, None)
+        else:
+            expansions = generator.iterExpansionsFrom(rule.rhs, offset, counts)
+        if limit is not None:
+            expansions = itertools.islice(expansions, limit)
+            if count != INFINITY:
+                limit -= min(limit, count - offset)
+        offset = 0
+        yield from expansions
 
 
 def main():
     """Main function for command line usage"""
-    global grammar
+    argParser = argparse.ArgumentParser(description='Generate all strings from a JSGF grammar; recursive grammars need '
+                                                    '--max-depth or --max-length')
+    argParser.add_argument('grammarFile', help='Path to the JSGF grammar file')
+    argParser.add_argument('--no-cache', dest='noCache', action='store_true',
+                           help='Parse the grammar file even if a cached copy exists')
+    argParser.add_argument('--ids', action='store_true',
+                           help='Print sentences as token numbers instead of text')
+    argParser.add_argument('--vocabulary', metavar='FILE',
+                           help='Write the tokens to FILE, one per line, in token number order')
+    argParser.add_argument('--materialize', action='store_true',
+                           help='Build the whole list of strings of a rule before printing it, '
+                                'which is faster but uses memory proportional to the output')
+    argParser.add_argument('--offset', type=int, default=0,
+                           help='Skip this many strings, without generating them')
+    argParser.add_argument('--limit', type=int,
+                           help='Print at most this many strings')
+    argParser.add_argument('--workers', type=int, default=1,
+                           help='Generate the strings in this many processes; the output is unchanged')
+    argParser.add_argument('--max-depth', dest='maxDepth', type=int,
+                           help='Only generate strings whose derivation nests rules at most this deeply; '
+                                'needed for recursive grammars unless --max-length is given')
+    argParser.add_argument('--max-length', dest='maxLength', type=int,
+                           help='Only generate strings of at most this many tokens')
+    argParser.add_argument('--order', choices=ORDERS, default='canonical',
+                           help='With --max-depth or --max-length, generate strings depth first (canonical), '
+                                'shallowest derivations first (breadth) or shortest first (length)')
+    argParser.add_argument('--unique', action='store_true',
+                           help='Print each distinct string once; statistics go to stderr')
+    argParser.add_argument('--unique-memory', dest='uniqueMemory', type=int,
+                           default=DEFAULT_UNIQUE_MEMORY // (1024 * 1024), metavar='MB',
+                           help='With --unique, memory for distinct strings before they are '
+                                'spilled to temporary files, in megabytes')
+    argParser.add_argument('--automaton', metavar='FILE',
+                           help='Write the distinct strings as a minimal automaton to FILE '
+                                'instead of printing them (see JSGFAutomaton)')
+    argParser.add_argument('--count', action='store_true',
+                           help='Print the number of strings of each public rule instead of the strings')
+    argParser.add_argument('--distinct', action='store_true',
+                           help='With --count, count distinct strings; this generates them')
 
-    if len(sys.argv) != 2:
-        print("Usage: python DeterministicGenerator.py <grammarFile>")
-        sys.exit(1)
+    args = argParser.parse_args()
+    if args.uniqueMemory <= 0:
+        argParser.error('--unique-memory must be positive')
+    if args.workers > 1 and (args.ids or args.materialize):
+        argParser.error('--workers cannot be combined with --ids or --materialize')
+    bounded = args.maxDepth is not None or args.maxLength is not None
+    if bounded and (args.ids or args.materialize or args.workers > 1):
+        argParser.error('--max-depth and --max-length cannot be combined with --ids, --materialize or --workers')
+    if not bounded and args.order != 'canonical':
+        argParser.error('--order needs --max-depth or --max-length')
+    if args.automaton and (bounded or args.ids or args.materialize or args.workers > 1 or args.unique
+                           or args.count or args.offset or args.limit is not None):
+        argParser.error('--automaton cannot be combined with options that select or format strings')
 
     try:
-        with open(sys.argv[1], 'r') as fileStream:
-            grammar = parser.getGrammarObject(fileStream)
+        with parser.recursionLimit(RECURSION_LIMIT):
+            grammar = cache.loadGrammar(args.grammarFile, useCache=not args.noCache)
+            generator = DeterministicGenerator(grammar)
+            if args.count:
+                counts = {}
+                for rule in grammar.publicRules:
+                    if args.distinct:
+                        count = generator.countDistinct(rule.rhs)
+                    else:
+                        count = generator.countExpansions(rule.rhs, counts)
+                    print(gram.ruleName(rule.lhs) + '\t' + str(count))
+                return
+            if args.automaton:
+                automaton = fsa.buildAutomaton(grammar)
+                with open(args.automaton, 'wb') as automatonFile:
+                    automaton.write(automatonFile)
+                print('states=%d transitions=%d strings=%d'
+                      % (automaton.numStates(), automaton.numTransitions(), automaton.count()),
+                      file=sys.stderr)
+                return
+            if not bounded:
+                counts = {}
+                for rule in grammar.publicRules:
+                    if generator.countExpansions(rule.rhs, counts) == INFINITY:
+                        argParser.error('rule %s is recursive and has infinitely many strings; '
+                                        'pass --max-depth or --max-length'
+                                        % gram.ruleName(rule.lhs))
+            # the compiled program is only used by --ids and --materialize
+            program = compiler.compileGrammar(grammar) if args.ids or args.materialize else None
+            if args.vocabulary:
+                with open(args.vocabulary, 'w') as vocabularyFile:
+                    grammar.vocabulary.write(vocabularyFile)
 
-            for rule in grammar.publicRules:
-                expansions = processRHS(rule.rhs)
-                for expansion in expansions:
-                    print(expansion)
+            if args.workers > 1 and not args.unique:
+                for text in generator.iterParallelExpansions(args.workers, args.offset, args.limit):
+                    sys.stdout.write(text)
+            elif args.unique:
+                statistics = {}
+                lines = iterUnique(_iterOutputLines(args, generator, program, 0, None),
+                                   args.uniqueMemory * 1024 * 1024, statistics=statistics)
+                stop = None if args.limit is None else args.offset + args.limit
+                writeLines(itertools.islice(lines, args.offset, stop))
+                duplicateRatio = statistics['duplicates'] / max(statistics['strings'], 1)
+                print('strings=%d unique=%d duplicates=%d (%.1f%%) runs=%d'
+                      % (statistics['strings'], statistics['unique'], statistics['duplicates'],
+                         100 * duplicateRatio, statistics['runs']), file=sys.stderr)
+            else:
+                writeLines(_iterOutputLines(args, generator, program, args.offset, args.limit))
+            sys.stdout.flush()
+    except BrokenPipeError:
+        # the reader (e.g. head) stopped early; silence the final flush
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+        sys.exit(0)
     except FileNotFoundError:
-        print(f"Error: Grammar file '{sys.argv[1]}' not found")
+        print(f"Error: Grammar file '{args.grammarFile}' not found")
         sys.exit(1)
     except Exception as e:
         print(f"Error processing grammar: {e}")
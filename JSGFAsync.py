@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+# @copyright: MIT License
+#   Copyright (c) 2018 syntactic (Pastèque Ho)
+#   Permission is hereby granted, free of charge, to any person obtaining a copy
+#   of this software and associated documentation files (the "Software"), to deal
+#   in the Software without restriction, including without limitation the rights
+#   to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#   copies of the Software, and to permit persons to whom the Software is
+#   furnished to do so, subject to the following conditions:
+#   The above copyright notice and this permission notice shall be included in all
+#   copies or substantial portions of the Software.
+#   THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#   IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#   FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#   AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#   LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#   OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#   SOFTWARE.
+# @summary: This file streams the strings of the generators to asyncio consumers.
+
+"""
+This file turns the generators of DeterministicGenerator and \
+        ProbabilisticGenerator into asynchronous generators, for asyncio \
+        programs. The strings are generated in blocks in a thread of an \
+        executor, so the event loop keeps running while they are produced:
+
+        ``async for sentence in generator.aiterSamples(1000, seed=1):``
+
+Generating strings is Python code, so the thread still takes turns with the \
+        event loop for the interpreter; use a process pool, such as the \
+        ``workers`` of ProbabilisticGenerator.iterSamples, for throughput.
+"""
+
+import asyncio
+import itertools
+import threading
+
+
+#: Number of strings generated per step by iterateAsync
+DEFAULT_BLOCK_SIZE = 1000
+
+async def iterateAsync(iterable, blockSize=DEFAULT_BLOCK_SIZE, executor=None):
+    """
+    Yields the elements of an iterable from an asyncio task, taking them in
+    blocks of blockSize in an executor. Closing the asynchronous generator
+    closes the iterable, once the block being taken is done.
+
+    :param iterable: iterable, such as the generator of the strings of a rule
+    :param blockSize: number of elements taken per step
+    :param executor: concurrent.futures executor, the default executor of \
+            the loop if None
+    :returns: asynchronous generator of the elements
+    """
+    if blockSize <= 0:
+        raise ValueError('The block size must be positive')
+    loop = asyncio.get_running_loop()
+    iterator = iter(iterable)
+    # a generator cannot be closed while another thread runs it
+    lock = threading.Lock()
+
+    def nextBlock():
+        with lock:
+            return list(itertools.islice(iterator, blockSize))
+
+    def close():
+        with lock:
+            iterator.close()
+
+    try:
+        while True:
+            block = await loop.run_in_executor(executor, nextBlock)
+            if not block:
+                return
+            for element in block:
+                yield element
+    finally:
+        if hasattr(iterator, 'close'):
+            await loop.run_in_executor(executor, close)
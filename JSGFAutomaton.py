@@ -0,0 +1,424 @@
+# -*- coding: utf-8 -*-
+# @copyright: MIT License
+#   Copyright (c) 2018 syntactic (Pastèque Ho)
+#   Permission is hereby granted, free of charge, to any person obtaining a copy
+#   of this software and associated documentation files (the "Software"), to deal
+#   in the Software without restriction, including without limitation the rights
+#   to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#   copies of the Software, and to permit persons to whom the Software is
+#   furnished to do so, subject to the following conditions:
+#   The above copyright notice and this permission notice shall be included in all
+#   copies or substantial portions of the Software.
+#   THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#   IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#   FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#   AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#   LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#   OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#   SOFTWARE.
+# @summary: This file compiles the language of a JSGF Grammar into a minimal automaton.
+
+"""
+This file compiles the strings of a non-recursive JSGFGrammar into a minimal \
+        deterministic acyclic automaton (a DAWG) over the token numbers of the \
+        grammar's vocabulary. The automaton is built from the expressions of \
+        the grammar, without enumerating the strings: every state is stored \
+        once in a register keyed by its finality and its transitions, so \
+        states with the same continuations are merged as they are built.
+
+        ``automaton = buildAutomaton(grammar)``
+
+        ``'the idea will suffice' in automaton`` tests membership, \
+        ``iter(automaton)`` yields the strings one at a time and \
+        ``automaton.count()`` returns their number
+
+The automaton can be written to a compact binary file and read back:
+
+        ``automaton.write(open('language.fsa', 'wb'))``
+
+        ``automaton = readAutomaton(open('language.fsa', 'rb'))``
+
+The same file is written by ``python DeterministicGenerator.py <grammarFile> \
+        --automaton language.fsa``.
+"""
+
+import sys
+import struct
+import bisect
+from array import array
+import JSGFParser as parser
+import JSGFGrammar as gram
+
+#: First bytes of an automaton file
+MAGIC = b'JSGFFSA\x01'
+
+#: Recursion limit while an automaton is built; building recurses once per
+#: nesting level of the grammar and once per token of the longest string
+RECURSION_LIMIT = 100000
+
+# number of tokens, states and transitions, and the item sizes of the token
+# numbers and of the state numbers
+_HEADER = struct.Struct('<QQQBB')
+
+# array typecodes by item size
+_TYPECODES = {array(code).itemsize: code for code in 'QLIHB'}
+
+
+class Automaton():
+    """
+    Automaton class, a minimal acyclic automaton whose states are numbered so
+    that every transition goes to a higher number; state 0 is the start.
+    The transitions of state s are at ``offsets[s]:offsets[s + 1]`` of
+    ``labels`` (token numbers, in increasing order) and ``targets``, and
+    ``finals[s]`` is 1 if a string may end in s. ``tokens`` maps token
+    numbers to tokens.
+    """
+
+    def __init__(self, tokens, finals, offsets, labels, targets):
+        self.tokens = tokens
+        self.finals = finals
+        self.offsets = offsets
+        self.labels = labels
+        self.targets = targets
+        self.ids = None
+
+    def numStates(self):
+        return len(self.finals)
+
+    def numTransitions(self):
+        return len(self.labels)
+
+    def transition(self, state, label):
+        """
+        :returns: the state reached from state by the token number label, or \
+                -1 if there is no such transition
+        """
+        start, end = self.offsets[state], self.offsets[state + 1]
+        i = bisect.bisect_left(self.labels, label, start, end)
+        if i < end and self.labels[i] == label:
+            return self.targets[i]
+        return -1
+
+    def acceptsIds(self, tokenIds):
+        """
+        :returns: True if the sequence of token numbers is a string of the language
+        """
+        if not self.finals:
+            return False
+        state = 0
+        for tokenId in tokenIds:
+            state = self.transition(state, tokenId)
+            if state < 0:
+                return False
+        return self.finals[state] == 1
+
+    def accepts(self, tokens):
+        """
+        :returns: True if the sequence of tokens is a string of the language
+        """
+        if self.ids is None:
+            self.ids = {token: tokenId for tokenId, token in enumerate(self.tokens)}
+        try:
+            return self.acceptsIds([self.ids[token] for token in tokens])
+        except KeyError:
+            return False
+
+    def __contains__(self, sentence):
+        return self.accepts(sentence.split())
+
+    def iterIds(self):
+        """
+        Yields the strings as tuples of token numbers, in increasing order of
+        token numbers, a string coming before the longer ones it starts. Only
+        the current path is held in memory.
+        """
+        offsets, labels, targets, finals = self.offsets, self.labels, self.targets, self.finals
+        if not finals:
+            return
+        path = []
+        # next transition to follow from each state of the path
+        stack = [offsets[0]]
+        states = [0]
+        if finals[0]:
+            yield ()
+        while stack:
+            state = states[-1]
+            i = stack[-1]
+            if i == offsets[state + 1]:
+                stack.pop()
+                states.pop()
+                if path:
+                    path.pop()
+                continue
+            stack[-1] = i + 1
+            target = targets[i]
+            path.append(labels[i])
+            if finals[target]:
+                yield tuple(path)
+            states.append(target)
+            stack.append(offsets[target])
+
+    def __iter__(self):
+        tokens = self.tokens
+        for tokenIds in self.iterIds():
+            yield ' '.join([tokens[t] for t in tokenIds])
+
+    def count(self):
+        """
+        :returns: number of strings of the language
+        """
+        offsets, targets, finals = self.offsets, self.targets, self.finals
+        counts = [0] * len(finals)
+        for state in range(len(finals) - 1, -1, -1):
+            total = finals[state]
+            for i in range(offsets[state], offsets[state + 1]):
+                total += counts[targets[i]]
+            counts[state] = total
+        return counts[0] if counts else 0
+
+    def write(self, fileStream):
+        """
+        Writes the automaton to a binary file: MAGIC, a header, the tokens
+        separated by newlines, a bitmap of the final states, then the offsets,
+        labels and targets as little-endian arrays of the smallest item size
+        that holds their values.
+
+        :param fileStream: file object opened in binary mode
+        """
+        numStates = len(self.finals)
+        tokenSize = _itemSize(len(self.tokens))
+        stateSize = _itemSize(max(numStates, len(self.labels)))
+        fileStream.write(MAGIC)
+        fileStream.write(_HEADER.pack(len(self.tokens), numStates, len(self.labels), tokenSize, stateSize))
+        tokenData = '\n'.join(self.tokens).encode('utf-8')
+        fileStream.write(struct.pack('<Q', len(tokenData)))
+        fileStream.write(tokenData)
+        bitmap = bytearray((numStates + 7) // 8)
+        for state in range(numStates):
+            if self.finals[state]:
+                bitmap[state >> 3] |= 1 << (state & 7)
+        fileStream.write(bitmap)
+        for values, size in ((self.offsets, stateSize), (self.labels, tokenSize), (self.targets, stateSize)):
+            packed = array(_TYPECODES[size], values)
+            if sys.byteorder == 'big':
+                packed.byteswap()
+            fileStream.write(packed.tobytes())
+
+
+def _itemSize(maxValue):
+    for size in (1, 2, 4, 8):
+        if maxValue < 1 << (8 * size) and size in _TYPECODES:
+            return size
+    raise ValueError('Automaton too large to write')
+
+def _readArray(fileStream, size, length):
+    values = array(_TYPECODES[size])
+    data = fileStream.read(size * length)
+    if len(data) != size * length:
+        raise ValueError('Truncated automaton file')
+    values.frombytes(data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+def readAutomaton(fileStream):
+    """
+    Reads an automaton written by Automaton.write
+
+    :param fileStream: file object opened in binary mode
+    :returns: Automaton object
+    :raises ValueError: if the file is not an automaton file
+    """
+    if fileStream.read(len(MAGIC)) != MAGIC:
+        raise ValueError('Not an automaton file')
+    header = fileStream.read(_HEADER.size + 8)
+    if len(header) != _HEADER.size + 8:
+        raise ValueError('Truncated automaton file')
+    numTokens, numStates, numTransitions, tokenSize, stateSize = _HEADER.unpack(header[:_HEADER.size])
+    if tokenSize not in _TYPECODES or stateSize not in _TYPECODES:
+        raise ValueError('Unsupported automaton file')
+    tokenData = fileStream.read(struct.unpack('<Q', header[_HEADER.size:])[0])
+    tokens = tokenData.decode('utf-8').split('\n') if numTokens else []
+    if len(tokens) != numTokens:
+        raise ValueError('Truncated automaton file')
+    bitmap = fileStream.read((numStates + 7) // 8)
+    if len(bitmap) != (numStates + 7) // 8:
+        raise ValueError('Truncated automaton file')
+    finals = bytearray((bitmap[state >> 3] >> (state & 7)) & 1 for state in range(numStates))
+    offsets = _readArray(fileStream, stateSize, numStates + 1)
+    labels = _readArray(fileStream, tokenSize, numTransitions)
+    targets = _readArray(fileStream, stateSize, numTransitions)
+    return Automaton(tokens, finals, offsets, labels, targets)
+
+
+class _Builder():
+    """
+    Builds minimal acyclic automata bottom up. A state is a number in the
+    register, which maps (final, transitions) to it; transitions is a tuple
+    of (token number, state) pairs sorted by token number. As the targets of
+    a new state are already unique, so is the state, which keeps every
+    automaton built minimal.
+    """
+
+    def __init__(self, grammar):
+        self.grammar = grammar
+        self.vocabulary = grammar.vocabulary
+        self.register = {}
+        self.finals = []
+        self.transitions = []
+        self.unions = {}
+        self.concatenations = {}
+        # id of expression -> (state, expression), the expression is kept so
+        # that its id cannot be reused
+        self.expressions = {}
+        self.rules = {}
+        self.pending = set()
+        self.epsilon = self.state(True, ())
+
+    def state(self, final, transitions):
+        key = (final, transitions)
+        state = self.register.get(key)
+        if state is None:
+            state = self.register[key] = len(self.finals)
+            self.finals.append(final)
+            self.transitions.append(transitions)
+        return state
+
+    def union(self, p, q):
+        if p == q:
+            return p
+        key = (p, q) if p < q else (q, p)
+        state = self.unions.get(key)
+        if state is not None:
+            return state
+        first, second = self.transitions[p], self.transitions[q]
+        merged = []
+        i = j = 0
+        while i < len(first) and j < len(second):
+            if first[i][0] < second[j][0]:
+                merged.append(first[i])
+                i += 1
+            elif first[i][0] > second[j][0]:
+                merged.append(second[j])
+                j += 1
+            else:
+                merged.append((first[i][0], self.union(first[i][1], second[j][1])))
+                i += 1
+                j += 1
+        merged.extend(first[i:])
+        merged.extend(second[j:])
+        state = self.unions[key] = self.state(self.finals[p] or self.finals[q], tuple(merged))
+        return state
+
+    def concatenate(self, p, q):
+        if q == self.epsilon:
+            return p
+        if p == self.epsilon:
+            return q
+        key = (p, q)
+        state = self.concatenations.get(key)
+        if state is not None:
+            return state
+        state = self.state(False, tuple((label, self.concatenate(target, q))
+                                        for label, target in self.transitions[p]))
+        if self.finals[p]:
+            state = self.union(state, q)
+        self.concatenations[key] = state
+        return state
+
+    def expression(self, expr):
+        if isinstance(expr, str):
+            if not expr:
+                return self.epsilon
+            return self.state(False, ((self.vocabulary.add(expr), self.epsilon),))
+        entry = self.expressions.get(id(expr))
+        if entry is not None:
+            return entry[0]
+        if isinstance(expr, list):
+            state = self.epsilon
+            for component in reversed(expr):
+                state = self.concatenate(self.expression(component), state)
+        elif isinstance(expr, tuple):
+            state = self.expression(expr[0])
+        elif isinstance(expr, gram.Disjunction):
+            disjuncts = expr.disjuncts
+            if type(disjuncts[0]) is tuple:
+                disjuncts = [d[0] for d in disjuncts]
+            state = self.expression(disjuncts[0])
+            for disjunct in disjuncts[1:]:
+                state = self.union(state, self.expression(disjunct))
+        elif isinstance(expr, gram.Optional):
+            state = self.union(self.epsilon, self.expression(expr.option))
+        elif isinstance(expr, gram.NonTerminal):
+            state = self.rule(expr)
+        else:
+            raise TypeError('Cannot build an automaton for ' + repr(expr))
+        self.expressions[id(expr)] = (state, expr)
+        return state
+
+    def rule(self, nt):
+        state = self.rules.get(nt.name)
+        if state is None:
+            if nt.name in self.pending:
+                raise ValueError('Rule ' + nt.name + ' is recursive, its strings cannot be '
+                                 'stored in an acyclic automaton')
+            self.pending.add(nt.name)
+            state = self.rules[nt.name] = self.expression(self.grammar.getRHS(nt))
+            self.pending.discard(nt.name)
+        return state
+
+    def compact(self, root):
+        """
+        :returns: Automaton of the states reachable from root, numbered in
+                  topological order
+        """
+        order = []
+        seen = {root}
+        stack = [(root, iter(self.transitions[root]))]
+        while stack:
+            state, children = stack[-1]
+            for label, target in children:
+                if target not in seen:
+                    seen.add(target)
+                    stack.append((target, iter(self.transitions[target])))
+                    break
+            else:
+                stack.pop()
+                order.append(state)
+        order.reverse()
+        numbers = {state: number for number, state in enumerate(order)}
+        finals = bytearray(len(order))
+        offsets = array('L', [0])
+        labels = array('L')
+        targets = array('L')
+        for number, state in enumerate(order):
+            finals[number] = self.finals[state]
+            for label, target in self.transitions[state]:
+                labels.append(label)
+                targets.append(numbers[target])
+            offsets.append(len(labels))
+        return Automaton(list(self.vocabulary.tokens), finals, offsets, labels, targets)
+
+
+def buildAutomaton(grammar, rules=None):
+    """
+    Builds the minimal automaton of the strings of some rules of a grammar,
+    the strings DeterministicGenerator prints for them without duplicates
+
+    :param grammar: JSGFGrammar object
+    :param rules: list of Rule objects, grammar.publicRules by default
+    :returns: Automaton object, whose token numbers are those of grammar.vocabulary
+    :raises ValueError: if one of the rules is recursive or uses an undefined rule
+    """
+    if rules is None:
+        rules = grammar.publicRules
+    with parser.recursionLimit(RECURSION_LIMIT):
+        builder = _Builder(grammar)
+        root = None
+        for rule in rules:
+            state = builder.expression(rule.rhs)
+            root = state if root is None else builder.union(root, state)
+        if root is None:
+            return Automaton(list(grammar.vocabulary.tokens), bytearray(), array('L', [0]),
+                             array('L'), array('L'))
+        return builder.compact(root)
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+# @copyright: MIT License
+#   Copyright (c) 2018 syntactic (Pastèque Ho)
+#   Permission is hereby granted, free of charge, to any person obtaining a copy
+#   of this software and associated documentation files (the "Software"), to deal
+#   in the Software without restriction, including without limitation the rights
+#   to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#   copies of the Software, and to permit persons to whom the Software is
+#   furnished to do so, subject to the following conditions:
+#   The above copyright notice and this permission notice shall be included in all
+#   copies or substantial portions of the Software.
+#   THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#   IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#   FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#   AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#   LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#   OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#   SOFTWARE.
+# @summary: This file caches parsed JSGF grammars on disk.
+
+"""
+This file keeps an on-disk cache of parsed grammars, so that a grammar file \
+        only has to be parsed the first time it is used. The parsed \
+        JSGFGrammar object is pickled into a file named after a hash of the \
+        grammar source and the parser version; later loads of the same source \
+        unpickle it instead of parsing.
+
+Cache files are written to a temporary file and renamed into place, so \
+        concurrent writers never expose a partial file. After every write the \
+        least recently used files are removed until the cache directory fits \
+        under its size cap.
+
+The cache directory is ``$JSGF_CACHE_DIR`` if set, otherwise ``jsgftools`` \
+        under ``$XDG_CACHE_HOME`` (``~/.cache`` by default). Setting \
+        ``$JSGF_NO_CACHE`` to a non-empty value, or passing ``useCache=False``, \
+        disables the cache.
+
+Unpickling runs code named by the file, so the cache is only used when it \
+        cannot have been written by anyone else: the directory is created \
+        with mode 0o700, and a directory or cache file that belongs to \
+        another user, or a directory that others can write to, is treated as \
+        a cache miss and left alone.
+"""
+
+import os
+import io
+import hashlib
+import pickle
+import tempfile
+import JSGFParser as parser
+
+#: Default size cap of the cache directory in bytes
+DEFAULT_MAX_CACHE_SIZE = 256 * 1024 * 1024
+
+CACHE_SUFFIX = '.grammar'
+
+
+def defaultCacheDir():
+    """
+    :returns: path of the cache directory to use when none is given
+    """
+    if os.environ.get('JSGF_CACHE_DIR'):
+        return os.environ['JSGF_CACHE_DIR']
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'jsgftools')
+
+def cacheKey(source):
+    """
+    Computes the name under which the grammar parsed from a source is cached
+
+    :param source: text of the grammar file
+    :returns: hex digest of the source and the parser version
+    """
+    digest = hashlib.sha256()
+    digest.update(('JSGFParser %s\n' % parser.PARSER_VERSION).encode('utf-8'))
+    digest.update(source.encode('utf-8', 'surrogatepass'))
+    return digest.hexdigest()
+
+def _ownedByUser(stat):
+    """
+    :returns: whether a file belongs to the current user; always True where
+        the platform has no user ids
+    """
+    return not hasattr(os, 'getuid') or stat.st_uid == os.getuid()
+
+def isPrivateDir(cacheDir):
+    """
+    Checks that only the current user can have written the cache directory
+
+    :returns: True if the directory belongs to the current user and neither
+        its group nor others can write to it
+    """
+    try:
+        stat = os.stat(cacheDir)
+    except OSError:
+        return False
+    return _ownedByUser(stat) and not stat.st_mode & 0o022
+
+def readCache(cacheDir, key):
+    """
+    Loads a cached grammar and marks it as recently used. Files in a directory
+    that fails :func:`isPrivateDir`, symbolic links and files owned by another
+    user are never unpickled.
+
+    :returns: JSGFGrammar object, or None on a cache miss
+    """
+    if not isPrivateDir(cacheDir):
+        return None
+    path = os.path.join(cacheDir, key + CACHE_SUFFIX)
+    try:
+        fd = os.open(path, os.O_RDONLY | getattr(os, 'O_BINARY', 0) | getattr(os, 'O_NOFOLLOW', 0))
+    except OSError:
+        return None
+    try:
+        with os.fdopen(fd, 'rb') as cacheFile:
+            if not _ownedByUser(os.fstat(cacheFile.fileno())):
+                return None
+            grammar = pickle.load(cacheFile)
+    except Exception:
+        # a truncated or stale file is dropped and rebuilt
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return None
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return grammar
+
+def writeCache(cacheDir, key, grammar, maxCacheSize=DEFAULT_MAX_CACHE_SIZE):
+    """
+    Stores a grammar in the cache with an atomic rename, then evicts the least
+    recently used files until the directory is under ``maxCacheSize`` bytes.
+    Failures to write are ignored: the cache only ever speeds loading up.
+    """
+    try:
+        os.makedirs(cacheDir, mode=0o700, exist_ok=True)
+    except OSError:
+        return
+    if not isPrivateDir(cacheDir):
+        return
+    try:
+        fd, tmpPath = tempfile.mkstemp(dir=cacheDir, suffix='.tmp')
+    except OSError:
+        return
+    try:
+        with os.fdopen(fd, 'wb') as tmpFile:
+            pickle.dump(grammar, tmpFile, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmpPath, os.path.join(cacheDir, key + CACHE_SUFFIX))
+    except Exception:
+        try:
+            os.remove(tmpPath)
+        except OSError:
+            pass
+        return
+    pruneCache(cacheDir, maxCacheSize)
+
+def pruneCache(cacheDir, maxCacheSize=DEFAULT_MAX_CACHE_SIZE):
+    """
+    Removes the least recently used cache files until the total size of the
+    cache directory is at most ``maxCacheSize`` bytes
+    """
+    entries = []
+    total = 0
+    try:
+        names = os.listdir(cacheDir)
+    except OSError:
+        return
+    for name in names:
+        if not name.endswith(CACHE_SUFFIX):
+            continue
+        try:
+            stat = os.stat(os.path.join(cacheDir, name))
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, name, stat.st_size))
+        total += stat.st_size
+    entries.sort()
+    for mtime, name, size in entries:
+        if total <= maxCacheSize:
+            break
+        try:
+            os.remove(os.path.join(cacheDir, name))
+        except OSError:
+            # another process evicted it first
+            pass
+        total -= size
+
+def loadGrammar(path, useCache=True, cacheDir=None, maxCacheSize=DEFAULT_MAX_CACHE_SIZE,
+                engine=parser.DEFAULT_ENGINE):
+    """
+    Produces a JSGFGrammar object for a grammar file, from the cache when the
+    same source has been parsed before
+
+    :param path: path of the grammar file
+    :param useCache: set to False to always parse the file
+    :param cacheDir: cache directory, :func:`defaultCacheDir` if None
+    :param maxCacheSize: size cap of the cache directory in bytes
+    :param engine: parser engine used on a cache miss
+    :returns: JSGFGrammar object
+    """
+    with open(path, 'r') as fileStream:
+        source = fileStream.read()
+    if not useCache or os.environ.get('JSGF_NO_CACHE'):
+        return parser.getGrammarObject(io.StringIO(source), engine=engine)
+
+    if cacheDir is None:
+        cacheDir = defaultCacheDir()
+    key = cacheKey(source)
+    grammar = readCache(cacheDir, key)
+    if grammar is None:
+        grammar = parser.getGrammarObject(io.StringIO(source), engine=engine)
+        writeCache(cacheDir, key, grammar, maxCacheSize)
+    return grammar
@@ -0,0 +1,519 @@
+# -*- coding: utf-8 -*-
+# @copyright: MIT License
+#   Copyright (c) 2018 syntactic (Pastèque Ho)
+#   Permission is hereby granted, free of charge, to any person obtaining a copy
+#   of this software and associated documentation files (the "Software"), to deal
+#   in the Software without restriction, including without limitation the rights
+#   to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#   copies of the Software, and to permit persons to whom the Software is
+#   furnished to do so, subject to the following conditions:
+#   The above copyright notice and this permission notice shall be included in all
+#   copies or substantial portions of the Software.
+#   THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#   IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#   FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#   AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#   LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#   OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#   SOFTWARE.
+# @summary: This file compiles a JSGF Grammar into a flat program for the generators.
+
+"""
+This file lowers a JSGFGrammar object into a flat, integer-indexed program \
+        and runs the generators on it. Every expression of the grammar becomes \
+        a node number; the kind of each node, its children, its token and its \
+        weights are stored in ``array`` buffers. Shared subexpressions are \
+        compiled once, and nonterminal references point straight at the node \
+        of the rule they name.
+
+Both generators can run on a compiled program with an explicit stack instead of \
+        recursing through the expression objects:
+
+        ``program = compileGrammar(grammar)``
+
+        ``program.expand(program.publicRoots[0])`` returns every string, in \
+        the order of ``DeterministicGenerator.processRHS``, and \
+        ``program.iterExpand`` yields them one at a time
+
+        ``program.sample(program.publicRoots[0])`` returns a random string, \
+        drawing the same random numbers as ``ProbabilisticGenerator.processRHS``
+"""
+
+import random
+from array import array
+import JSGFGrammar as gram
+
+#: Node kinds
+TOKEN, SEQUENCE, DISJUNCTION, OPTIONAL, NONTERMINAL = range(5)
+
+
+class Program():
+    """
+    Program class, a grammar compiled into parallel arrays indexed by node
+    number:
+
+    - ``kinds``: kind of the node
+    - ``values``: token number of a TOKEN, rule number of a NONTERMINAL
+    - ``childStart``/``childEnd``: slice of ``children`` holding the children \
+            of a SEQUENCE, DISJUNCTION or OPTIONAL. The children of a \
+            SEQUENCE are stored last to first, the order in which they are \
+            pushed on a stack.
+    - ``weightStart``: for a weighted DISJUNCTION, offset in \
+            ``aliasProbabilities`` and ``aliases`` of the alias table of its \
+            children (see :func:`buildAliasTable`), -1 otherwise
+
+    ``vocabulary`` numbers the tokens (``tokens`` is its list of tokens),
+    ``ruleNames`` and ``ruleRoots`` map rule numbers to rule names and to the
+    root node of their expansion (-1 while a rule is undefined).
+    """
+
+    def __init__(self, vocabulary=None):
+        self.kinds = array('b')
+        self.values = array('l')
+        self.childStart = array('l')
+        self.childEnd = array('l')
+        self.weightStart = array('l')
+        self.children = array('l')
+        self.aliasProbabilities = array('d')
+        self.aliases = array('l')
+        self.vocabulary = gram.Vocabulary() if vocabulary is None else vocabulary
+        self.tokens = self.vocabulary.tokens
+        self.ruleNames = []
+        self.ruleIds = {}
+        self.ruleRoots = array('l')
+        self.publicRoots = []
+        # id of compiled expression -> (node, expression), the expression is
+        # kept so that its id cannot be reused
+        self.compiled = {}
+
+    def addNode(self, kind, value=-1, children=(), weights=None):
+        node = len(self.kinds)
+        self.kinds.append(kind)
+        self.values.append(value)
+        self.childStart.append(len(self.children))
+        self.children.extend(children)
+        self.childEnd.append(len(self.children))
+        if weights is None:
+            self.weightStart.append(-1)
+        else:
+            self.weightStart.append(len(self.aliases))
+            probabilities, aliases = buildAliasTable(weights)
+            self.aliasProbabilities.extend(probabilities)
+            self.aliases.extend(aliases)
+        return node
+
+    def ruleId(self, name):
+        ruleId = self.ruleIds.get(name)
+        if ruleId is None:
+            ruleId = self.ruleIds[name] = len(self.ruleNames)
+            self.ruleNames.append(name)
+            self.ruleRoots.append(-1)
+        return ruleId
+
+    def compileExpression(self, expr):
+        """
+        Compiles an expression (a rule's right hand side or part of it)
+
+        :returns: number of the expression's node
+        """
+        if isinstance(expr, str):
+            key = ('T', expr)
+        else:
+            key = id(expr)
+        entry = self.compiled.get(key)
+        if entry is not None:
+            return entry[0]
+
+        if isinstance(expr, str):
+            node = self.addNode(TOKEN, self.vocabulary.add(expr))
+        elif isinstance(expr, list):
+            if len(expr) == 1:
+                node = self.compileExpression(expr[0])
+            else:
+                children = [self.compileExpression(e) for e in expr]
+                children.reverse()
+                node = self.addNode(SEQUENCE, children=children)
+        elif isinstance(expr, tuple):
+            # a lone weighted alternative, its weight does not matter
+            node = self.compileExpression(expr[0])
+        elif isinstance(expr, gram.Disjunction):
+            if type(expr.disjuncts[0]) is tuple:
+                node = self.addNode(DISJUNCTION,
+                                    children=[self.compileExpression(d[0]) for d in expr.disjuncts],
+                                    weights=[d[1] for d in expr.disjuncts])
+            else:
+                node = self.addNode(DISJUNCTION,
+                                    children=[self.compileExpression(d) for d in expr.disjuncts])
+        elif isinstance(expr, gram.Optional):
+            node = self.addNode(OPTIONAL, children=[self.compileExpression(expr.option)])
+        elif isinstance(expr, gram.NonTerminal):
+            node = self.addNode(NONTERMINAL, self.ruleId(expr.name))
+        else:
+            raise TypeError('Cannot compile ' + repr(expr))
+        self.compiled[key] = (node, expr)
+        return node
+
+    def addRule(self, rule):
+        """
+        Compiles a rule and makes nonterminals referring to it point at it
+        """
+        self.ruleRoots[self.ruleId(gram.ruleName(rule.lhs))] = self.compileExpression(rule.rhs)
+
+    def follow(self, node):
+        """
+        :returns: the node itself, or the root of the rule it refers to if it
+                  is a NONTERMINAL node of a defined rule
+        """
+        kinds, values, ruleRoots = self.kinds, self.values, self.ruleRoots
+        # bounded, in case rules are defined as each other
+        for i in range(len(ruleRoots)):
+            if kinds[node] != NONTERMINAL or ruleRoots[values[node]] < 0:
+                break
+            node = ruleRoots[values[node]]
+        return node
+
+    def link(self):
+        """
+        Makes children, rule roots and public roots that are references to
+        defined rules point directly at the root of the rule, so that the
+        generators only visit the NONTERMINAL nodes of undefined rules
+        """
+        for array_ in (self.children, self.ruleRoots):
+            for i in range(len(array_)):
+                if array_[i] >= 0:
+                    array_[i] = self.follow(array_[i])
+        self.publicRoots = [self.follow(root) for root in self.publicRoots]
+
+    def resolve(self, node):
+        """
+        :returns: root node of the rule a NONTERMINAL node refers to
+        """
+        root = self.ruleRoots[self.values[node]]
+        if root < 0:
+            raise ValueError("Rule not defined for " + self.ruleNames[self.values[node]])
+        return root
+
+    def rootOf(self, name):
+        """
+        :returns: root node of the expansion of the named rule
+        """
+        if name not in self.ruleIds or self.ruleRoots[self.ruleIds[name]] < 0:
+            raise ValueError("Rule not defined for " + str(name))
+        return self.ruleRoots[self.ruleIds[name]]
+
+    def detokenize(self, tokenIds):
+        """
+        :returns: the sentence made of a sequence of token numbers
+        """
+        return self.vocabulary.detokenize(tokenIds)
+
+    def expand(self, node):
+        """
+        Returns every string an expression generates, in the same order as
+        DeterministicGenerator. The strings of each node are built bottom-up
+        once, with an explicit stack, and reused wherever the node is shared.
+
+        :param node: number of the expression's node
+        :returns: list of strings
+        :raises ValueError: if the expression is recursive
+        """
+        tokens = self.tokens
+        return self._expandAll(node, lambda tokenId: [tokens[tokenId]], '', _concatenate)
+
+    def expandIds(self, node):
+        """
+        Same as :meth:`expand`, with every sentence as an array of token numbers
+
+        :returns: list of ``array('l')``
+        """
+        return self._expandAll(node, lambda tokenId: [array('l', (tokenId,))], array('l'),
+                               _concatenateIds)
+
+    def _expandAll(self, node, leaf, empty, concatenate):
+        kinds, values, children = self.kinds, self.values, self.children
+        childStart, childEnd = self.childStart, self.childEnd
+        expansions = {}
+        entered = set()
+        stack = [node]
+        while stack:
+            node = stack[-1]
+            if node in expansions:
+                stack.pop()
+                continue
+            kind = kinds[node]
+            if kind == TOKEN:
+                expansions[node] = leaf(values[node])
+                stack.pop()
+                continue
+            if kind == NONTERMINAL:
+                nodeChildren = [self.resolve(node)]
+            else:
+                nodeChildren = children[childStart[node]:childEnd[node]]
+            missing = [child for child in nodeChildren if child not in expansions]
+            if missing:
+                if node in entered:
+                    raise ValueError('Cannot expand a recursive expression')
+                entered.add(node)
+                stack.extend(missing)
+                continue
+            stack.pop()
+            entered.discard(node)
+            if kind == SEQUENCE:
+                # children of sequences are stored last to first
+                result = [empty]
+                for child in reversed(nodeChildren):
+                    result = concatenate(result, expansions[child])
+            elif kind == DISJUNCTION:
+                result = []
+                for child in nodeChildren:
+                    result.extend(expansions[child])
+            elif kind == OPTIONAL:
+                result = [empty] + expansions[nodeChildren[0]]
+            else:
+                result = expansions[nodeChildren[0]]
+            expansions[node] = result
+        return list(expansions[node])
+
+    def iterExpand(self, node):
+        """
+        Yields every string an expression generates, in the same order as
+        :meth:`expand`. Alternatives that remain to be explored are kept on
+        an explicit stack, so only one string is built at a time.
+
+        :param node: number of the expression's node
+        :returns: generator of strings
+        """
+        detokenize = self.vocabulary.detokenize
+        for tokenIds in self.iterExpandIds(node):
+            yield detokenize(tokenIds)
+
+    def iterExpandIds(self, node):
+        """
+        Same as :meth:`iterExpand`, with every sentence as an array of token numbers
+
+        :returns: generator of ``array('l')``
+        """
+        kinds, values, children = self.kinds, self.values, self.children
+        childStart, childEnd = self.childStart, self.childEnd
+        # a state is (pending nodes, tokens so far); both are linked lists of
+        # pairs so that states can share their tails
+        stack = [((node, None), None)]
+        while stack:
+            pending, output = stack.pop()
+            while pending is not None:
+                node, pending = pending
+                kind = kinds[node]
+                if kind == TOKEN:
+                    output = (values[node], output)
+                elif kind == SEQUENCE:
+                    # children of sequences are stored last to first
+                    for i in range(childStart[node], childEnd[node]):
+                        pending = (children[i], pending)
+                elif kind == NONTERMINAL:
+                    pending = (self.resolve(node), pending)
+                elif kind == OPTIONAL:
+                    # the empty expansion comes first
+                    stack.append(((children[childStart[node]], pending), output))
+                else:
+                    start = childStart[node]
+                    for i in range(childEnd[node] - 1, start, -1):
+                        stack.append(((children[i], pending), output))
+                    pending = (children[start], pending)
+            tokenIds = array('l')
+            while output is not None:
+                tokenId, output = output
+                tokenIds.append(tokenId)
+            tokenIds.reverse()
+            yield tokenIds
+
+    def sample(self, node, rng=random):
+        """
+        Generates one random string from an expression, drawing random numbers
+        in the same order as ProbabilisticGenerator
+
+        :param node: number of the expression's node
+        :param rng: source of random numbers, the random module by default
+        :returns: string
+        """
+        return self.vocabulary.detokenize(self.sampleIds(node, rng))
+
+    def sampleIds(self, node, rng=random):
+        """
+        Same as :meth:`sample`, with the sentence as an array of token numbers
+
+        :returns: ``array('l')``
+        """
+        kinds, values, children = self.kinds, self.values, self.children
+        childStart, childEnd = self.childStart, self.childEnd
+        weightStart, aliasProbabilities, aliases = self.weightStart, self.aliasProbabilities, self.aliases
+        random, randrange = rng.random, rng.randrange
+        output = array('l')
+        emit = output.append
+        stack = [node]
+        push, pop = stack.append, stack.pop
+        while stack:
+            node = pop()
+            kind = kinds[node]
+            if kind == TOKEN:
+                emit(values[node])
+            elif kind == SEQUENCE:
+                # children of sequences are stored last to first
+                stack.extend(children[childStart[node]:childEnd[node]])
+            elif kind == DISJUNCTION:
+                start = childStart[node]
+                count = childEnd[node] - start
+                weights = weightStart[node]
+                if weights < 0:
+                    push(children[start + randrange(count)])
+                else:
+                    x = random() * count
+                    choice = min(int(x), count - 1)
+                    if x - choice >= aliasProbabilities[weights + choice]:
+                        choice = aliases[weights + choice]
+                    push(children[start + choice])
+            elif kind == OPTIONAL:
+                if random() > 0.5:
+                    push(children[childStart[node]])
+            else:
+                push(self.resolve(node))
+        return output
+
+
+    def sampleBatch(self, node, count, rng=random):
+        """
+        Generates count random strings from an expression at once, see
+        :meth:`sampleBatchIds`
+
+        :returns: list of strings
+        """
+        detokenize = self.vocabulary.detokenize
+        return [detokenize(tokenIds) for tokenIds in self.sampleBatchIds(node, count, rng)]
+
+    def sampleBatchIds(self, node, count, rng=random):
+        """
+        Generates count random strings from an expression together. Instead
+        of walking the expression once per string, every node is visited
+        once with the batch of strings that reached it: the choices of a
+        disjunction or an optional are drawn for the whole batch, which is
+        then split between the children. The strings have the same
+        distribution as with :meth:`sampleIds`, but not the same random
+        numbers.
+
+        :param node: number of the expression's node
+        :param count: number of strings
+        :param rng: source of random numbers, the random module by default
+        :returns: list of ``array('l')``
+        """
+        kinds, values, children = self.kinds, self.values, self.children
+        childStart, childEnd = self.childStart, self.childEnd
+        weightStart, aliasProbabilities, aliases = self.weightStart, self.aliasProbabilities, self.aliases
+        random, getrandbits = rng.random, rng.getrandbits
+        outputs = [array('l') for i in range(count)]
+        stack = [(node, range(count))]
+        push, pop = stack.append, stack.pop
+        while stack:
+            node, batch = pop()
+            kind = kinds[node]
+            if kind == TOKEN:
+                tokenId = values[node]
+                for i in batch:
+                    outputs[i].append(tokenId)
+            elif kind == SEQUENCE:
+                # children of sequences are stored last to first
+                stack.extend([(child, batch) for child in children[childStart[node]:childEnd[node]]])
+            elif kind == DISJUNCTION:
+                start = childStart[node]
+                size = childEnd[node] - start
+                weights = weightStart[node]
+                # random() * size can round up to size
+                last = size - 1
+                if weights < 0:
+                    choices = [min(int(random() * size), last) for i in batch]
+                else:
+                    choices = []
+                    for i in batch:
+                        x = random() * size
+                        choice = min(int(x), last)
+                        if x - choice >= aliasProbabilities[weights + choice]:
+                            choice = aliases[weights + choice]
+                        choices.append(choice)
+                groups = [[] for i in range(size)]
+                for i, choice in zip(batch, choices):
+                    groups[choice].append(i)
+                stack.extend([(children[start + choice], group) for choice, group in enumerate(groups) if group])
+            elif kind == OPTIONAL:
+                # one random bit per string of the batch
+                flags = format(getrandbits(len(batch)), '0%db' % len(batch))
+                taken = [i for i, flag in zip(batch, flags) if flag == '1']
+                if taken:
+                    push((children[childStart[node]], taken))
+            else:
+                push((self.resolve(node), batch))
+        return outputs
+
+
+def buildAliasTable(weights):
+    """
+    Builds the Walker alias table of a list of weights with Vose's method, so
+    that an index can be drawn in constant time from a single random number
+    x in [0, 1): with u = x * n and i = int(u), the index is i if
+    u - i < probabilities[i] and aliases[i] otherwise. All-zero weights are
+    treated as equal weights.
+
+    :param weights: list of non-negative weights
+    :returns: (probabilities, aliases), two lists as long as weights
+    """
+    count = len(weights)
+    total = float(sum(weights))
+    if total <= 0:
+        return [1.0] * count, list(range(count))
+    scaled = [weight * count / total for weight in weights]
+    probabilities = [1.0] * count
+    aliases = list(range(count))
+    small = [i for i, p in enumerate(scaled) if p < 1.0]
+    large = [i for i, p in enumerate(scaled) if p >= 1.0]
+    while small and large:
+        lower, higher = small.pop(), large.pop()
+        probabilities[lower] = scaled[lower]
+        aliases[lower] = higher
+        scaled[higher] -= 1.0 - scaled[lower]
+        if scaled[higher] < 1.0:
+            small.append(higher)
+        else:
+            large.append(higher)
+    # what is left has probability 1 up to rounding errors
+    return probabilities, aliases
+
+def _concatenate(left, right):
+    """
+    :returns: every string of ``left`` followed by every string of ``right``, \
+            with ``left`` varying slowest
+    """
+    if len(left) == 1 and not left[0]:
+        return right
+    if '' in left or '' in right:
+        return [a + ' ' + b if a and b else a or b for a in left for b in right]
+    return [a + ' ' + b for a in left for b in right]
+
+def _concatenateIds(left, right):
+    """
+    Same as :func:`_concatenate` for arrays of token numbers
+    """
+    if len(left) == 1 and not left[0]:
+        return right
+    return [a + b for a in left for b in right]
+
+def compileGrammar(grammar):
+    """
+    Compiles all rules of a grammar
+
+    :param grammar: JSGFGrammar object
+    :returns: Program object, with the roots of the public rules in ``publicRoots``
+    """
+    program = Program(grammar.vocabulary)
+    for rule in grammar.rules:
+        program.addRule(rule)
+    for rule in grammar.publicRules:
+        program.publicRoots.append(program.compileExpression(rule.rhs))
+    program.link()
+    return program
@@ -0,0 +1,800 @@
+# -*- coding: utf-8 -*-
+# @copyright: MIT License
+#   Copyright (c) 2018 syntactic (Pastèque Ho)
+#   Permission is hereby granted, free of charge, to any person obtaining a copy
+#   of this software and associated documentation files (the "Software"), to deal
+#   in the Software without restriction, including without limitation the rights
+#   to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#   copies of the Software, and to permit persons to whom the Software is
+#   furnished to do so, subject to the following conditions:
+#   The above copyright notice and this permission notice shall be included in all
+#   copies or substantial portions of the Software.
+#   THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#   IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#   FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#   AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#   LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#   OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#   SOFTWARE.
+# @summary: This file parses sentences with the rules of a JSGF Grammar.
+
+"""
+This file parses sentences with a JSGF grammar: it finds which rules \
+        produced each part of a sentence, for instance to extract the slots \
+        of a transcribed utterance. Run it by entering in the command line:
+
+        ``python JSGFEarley.py <grammarFile> [<corpusFile> ...]``
+
+It prints, for each line of the corpus files (or of the standard input), the \
+        most probable parse tree of the line and the probability that \
+        ProbabilisticGenerator produces the line, or ``-`` if the line is not \
+        a string of the grammar.
+
+The parser is an Earley parser, so any grammar works, including recursive \
+        and ambiguous ones. Each rule is compiled once into a network of \
+        states; the chart holds (state, origin) items, with every way each \
+        item was reached, which packs all the derivations of a sentence. The \
+        rules that can start with each token are computed once per grammar, \
+        and only those are predicted. From Python:
+
+        ``parse = EarleyParser(grammar).parse('the idea can suffice')``
+
+        ``parse.tree.find('<Modal>').text()``
+
+        ``parse.probability, parse.sentenceProbability``
+"""
+
+import sys, argparse
+import JSGFParser as parser
+import JSGFGrammar as gram
+import JSGFCache as cache
+
+
+#: Recursion limit while a parser is built or trees are enumerated; both
+#: recurse once per nesting level
+RECURSION_LIMIT = 100000
+
+#: Number of first item sets kept by a parser, one per first token
+FIRST_SET_LIMIT = 1000
+
+#: Largest number of passes over a group of items that derive each other
+#: when the sentence probability is computed
+MAX_PASSES = 1000
+
+#: Relative change below which the sentence probability of such a group is
+#: considered exact
+TOLERANCE = 1e-12
+
+class Node():
+    """
+    Node class, a rule in a parse tree: the rule name, the span of tokens it
+    covers, from start up to but not including end, and its children, which
+    are tokens and Nodes
+    """
+    __slots__ = ('name', 'start', 'end', 'children')
+
+    def __init__(self, name, start, end, children):
+        self.name = name
+        self.start = start
+        self.end = end
+        self.children = children
+
+    def tokens(self):
+        """
+        :returns: list of the tokens covered by the node
+        """
+        result = []
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, Node):
+                stack.extend(reversed(node.children))
+            else:
+                result.append(node)
+        return result
+
+    def text(self):
+        """
+        :returns: the tokens covered by the node, separated by spaces
+        """
+        return ' '.join(self.tokens())
+
+    def iterNodes(self):
+        """
+        :returns: generator of the node and the nodes below it, parents first
+        """
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(child for child in reversed(node.children) if isinstance(child, Node))
+
+    def find(self, name):
+        """
+        :param name: rule name, such as ``'<city>'``
+        :returns: the first node of the rule, parents first, or None
+        """
+        for node in self.iterNodes():
+            if node.name == name:
+                return node
+        return None
+
+    def findAll(self, name):
+        """
+        :param name: rule name, such as ``'<city>'``
+        :returns: list of the nodes of the rule, parents first
+        """
+        return [node for node in self.iterNodes() if node.name == name]
+
+    def __eq__(self, other):
+        return (isinstance(other, Node) and self.name == other.name and self.start == other.start
+                and self.end == other.end and self.children == other.children)
+
+    def __str__(self):
+        parts = []
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, Node):
+                parts.append('(' + node.name)
+                stack.append(None)
+                stack.extend(reversed(node.children))
+            elif node is None:
+                parts[-1] += ')'
+            else:
+                parts.append(node)
+        return ' '.join(parts)
+
+    def __repr__(self):
+        return '%s[%d:%d]' % (self, self.start, self.end)
+
+class Parse():
+    """
+    Parse class, the result of parsing a string of the grammar
+
+    - ``tree``: Node of the rule that derives the sentence in its most \
+            probable derivation
+    - ``probability``: probability of that derivation
+    - ``sentenceProbability``: probability of the sentence, the sum over \
+            all its derivations
+    """
+    __slots__ = ('tree', 'probability', 'sentenceProbability')
+
+    def __init__(self, tree, probability, sentenceProbability):
+        self.tree = tree
+        self.probability = probability
+        self.sentenceProbability = sentenceProbability
+
+    def __repr__(self):
+        return 'Parse(%s, %g, %g)' % (self.tree, self.probability, self.sentenceProbability)
+
+class Chart():
+    """
+    Chart class, the item sets of a sentence. Set k maps each item, a
+    (state, origin) pair, to the links it was reached by: (previous item,
+    weight, completed item or None), where items are (set, state, origin)
+    keys. Set k only depends on the first k + 1 tokens, so the next
+    sentence keeps the sets of the tokens it starts with in common with the
+    previous one. The first set is the parser's, shared with the other
+    charts.
+    """
+
+    def __init__(self):
+        self.sets = []
+        self.waiting = []
+        # per set, the items that read the next token
+        self.scanned = []
+        self.tokens = []
+        self.size = 0
+        # number of sets filled for the previous sentence
+        self.filled = 0
+
+    def reset(self, tokens):
+        """
+        Empties the sets that differ for a new sentence, and makes room for
+        its sets
+
+        :param tokens: list of the tokens of the sentence
+        :returns: number of sets kept from the previous sentence
+        """
+        kept = 0
+        limit = min(self.filled, len(tokens), len(self.tokens))
+        while kept < limit and tokens[kept] == self.tokens[kept]:
+            kept += 1
+        size = len(tokens) + 1
+        for i in range(max(kept, 1), min(len(self.sets), size)):
+            self.sets[i].clear()
+            self.waiting[i].clear()
+        while len(self.sets) < size:
+            self.sets.append({})
+            self.waiting.append({})
+            self.scanned.append(None)
+        self.tokens = tokens
+        self.size = size
+        self.filled = kept
+        return kept
+
+class EarleyParser():
+    """
+    EarleyParser class, parses sentences with some rules of a grammar. The
+    probabilities are those of ProbabilisticGenerator: alternatives are
+    chosen according to their weights, or equally likely without weights,
+    optional groups are used half of the time, and the rules parsed are
+    equally likely. A parser can be shared by threads.
+
+    :param grammar: JSGFGrammar object
+    :param rules: list of Rule objects, grammar.publicRules by default
+    :raises ValueError: if a rule uses an undefined rule
+    """
+
+    def __init__(self, grammar, rules=None):
+        if rules is None:
+            rules = grammar.publicRules
+        self.grammar = grammar
+        # per state: dictionary from token to (target state, weight) pairs or
+        # None, (target, weight) pairs of the moves without a token,
+        # (rule number, state to return to, weight) triples of the rules used
+        # there, and the number of the rule the state ends or -1
+        self.tokenEdges = []
+        self.epsilons = []
+        self.calls = []
+        self.ruleEnded = []
+        # rule 0 parses the rules asked for
+        self.ruleNames = [None]
+        self.ruleNumbers = {}
+        self.ruleStarts = [self._newState()]
+        self.ruleEnds = [self._newState()]
+        self.ruleEnded[1] = 0
+        self.pending = []
+        with parser.recursionLimit(RECURSION_LIMIT):
+            for rule in rules:
+                call = self._newState()
+                self.epsilons[0].append((call, 1.0 / len(rules)))
+                self.calls[call].append((self._ruleNumber(gram.ruleName(rule.lhs), rule.rhs), 1, 1.0))
+            while self.pending:
+                number, rhs = self.pending.pop()
+                self._build(rhs, self.ruleStarts[number], self.ruleEnds[number])
+        self.tokens = set()
+        for edges in self.tokenEdges:
+            if edges:
+                self.tokens.update(edges)
+        self._leftCorners()
+        # (rule number, next token) -> start states of the rules to predict
+        self.predictions = {}
+        # first token -> (first set, its waiting items, its items reading the token)
+        self.firstSets = {}
+
+    def _newState(self):
+        self.tokenEdges.append(None)
+        self.epsilons.append([])
+        self.calls.append([])
+        self.ruleEnded.append(-1)
+        return len(self.epsilons) - 1
+
+    def _ruleNumber(self, name, rhs=None):
+        number = self.ruleNumbers.get(name)
+        if number is None:
+            if rhs is None:
+                if name not in self.grammar:
+                    raise ValueError('Rule not defined for ' + str(name))
+                rhs = self.grammar[name]
+            number = self.ruleNumbers[name] = len(self.ruleNames)
+            self.ruleNames.append(name)
+            self.ruleStarts.append(self._newState())
+            self.ruleEnds.append(self._newState())
+            self.ruleEnded[self.ruleEnds[number]] = number
+            self.pending.append((number, rhs))
+        return number
+
+    def _build(self, expr, entry, exit, weight=1.0):
+        # adds the paths of an expression from entry to exit; weight is the
+        # probability of its first move
+        if isinstance(expr, str):
+            if expr:
+                edges = self.tokenEdges[entry]
+                if edges is None:
+                    edges = self.tokenEdges[entry] = {}
+                edges.setdefault(expr, []).append((exit, weight))
+            else:
+                self.epsilons[entry].append((exit, weight))
+        elif type(expr) is list:
+            if not expr:
+                self.epsilons[entry].append((exit, weight))
+            for i, component in enumerate(expr):
+                target = exit if i == len(expr) - 1 else self._newState()
+                self._build(component, entry, target, weight if i == 0 else 1.0)
+                entry = target
+        elif isinstance(expr, gram.Disjunction):
+            disjuncts = expr.disjuncts
+            if disjuncts and type(disjuncts[0]) is tuple:
+                total = float(sum(w for d, w in disjuncts)) or 1.0
+                choices = [(d, w / total) for d, w in disjuncts]
+            else:
+                choices = [(d, 1.0 / len(disjuncts)) for d in disjuncts]
+            for disjunct, probability in choices:
+                # each alternative has its own entry, so that the
+                # derivations through alternatives are told apart
+                alternative = self._newState()
+                self.epsilons[entry].append((alternative, weight * probability))
+                self._build(disjunct, alternative, exit)
+        elif isinstance(expr, gram.Optional):
+            option = self._newState()
+            self.epsilons[entry].append((exit, weight * 0.5))
+            self.epsilons[entry].append((option, weight * 0.5))
+            self._build(expr.option, option, exit)
+        elif isinstance(expr, gram.NonTerminal):
+            self.calls[entry].append((self._ruleNumber(expr.name), exit, weight))
+        elif isinstance(expr, tuple):
+            self._build(expr[0], entry, exit, weight)
+
+    def _leftCorners(self):
+        """
+        Finds the rules that derive the empty string, the tokens each rule
+        can start with, and the rules each rule can start with
+        """
+        numStates = len(self.epsilons)
+        nullable = bytearray(numStates)
+        changed = True
+        while changed:
+            changed = False
+            for state in range(numStates - 1, -1, -1):
+                if nullable[state]:
+                    continue
+                if (self.ruleEnded[state] >= 0 or any(nullable[target] for target, weight in self.epsilons[state])
+                        or any(nullable[self.ruleStarts[rule]] and nullable[target]
+                               for rule, target, weight in self.calls[state])):
+                    nullable[state] = 1
+                    changed = True
+        self.nullable = [bool(nullable[start]) for start in self.ruleStarts]
+        self.stateNullable = nullable
+        # tokens and rules met before any token, from the start of each rule
+        firstTokens = []
+        firstCalls = {}
+        for number, start in enumerate(self.ruleStarts):
+            tokens, calls = set(), set()
+            seen = {start}
+            work = [start]
+            while work:
+                state = work.pop()
+                if self.tokenEdges[state]:
+                    tokens.update(self.tokenEdges[state])
+                targets = [target for target, weight in self.epsilons[state]]
+                for rule, target, weight in self.calls[state]:
+                    calls.add(rule)
+                    if self.nullable[rule]:
+                        targets.append(target)
+                for target in targets:
+                    if target not in seen:
+                        seen.add(target)
+                        work.append(target)
+            firstTokens.append(tokens)
+            firstCalls[number] = calls
+        self.first = [None] * len(self.ruleStarts)
+        self.corners = [None] * len(self.ruleStarts)
+        for group in gram.ruleGroups(firstCalls):
+            tokens = set()
+            corners = set(group)
+            for rule in group:
+                tokens.update(firstTokens[rule])
+                for callee in firstCalls[rule]:
+                    if self.first[callee] is not None:
+                        tokens.update(self.first[callee])
+                        corners.update(self.corners[callee])
+            tokens = frozenset(tokens)
+            corners = tuple(sorted(corners))
+            for rule in group:
+                self.first[rule] = tokens
+                self.corners[rule] = corners
+        self._stateFirst()
+
+    def _stateFirst(self):
+        """
+        Finds the tokens that can come first from each state, before the end
+        of its rule; the parser only keeps the items that can read the next
+        token or end their rule
+        """
+        empty = frozenset()
+        first = self.stateFirst = [None] * len(self.epsilons)
+        # within a rule, the moves without a token do not loop
+        for root in range(len(first)):
+            stack = [(root, False)]
+            while stack:
+                state, expanded = stack.pop()
+                if first[state] is not None:
+                    continue
+                successors = [target for target, weight in self.epsilons[state]]
+                successors.extend(target for rule, target, weight in self.calls[state] if self.nullable[rule])
+                if not expanded:
+                    stack.append((state, True))
+                    stack.extend((target, False) for target in successors if first[target] is None)
+                    continue
+                parts = [first[target] for target in successors]
+                parts.extend(self.first[rule] for rule, target, weight in self.calls[state])
+                if self.tokenEdges[state]:
+                    parts.append(frozenset(self.tokenEdges[state]))
+                parts = [part for part in parts if part]
+                if not parts:
+                    first[state] = empty
+                elif all(part is parts[0] for part in parts):
+                    first[state] = parts[0]
+                else:
+                    first[state] = frozenset().union(*parts)
+
+    def _predictions(self, rule, token):
+        """
+        :returns: the start states of the rules a rule can start with, \
+                keeping those that can start with the token or derive the \
+                empty string
+        """
+        key = (rule, token)
+        predicted = self.predictions.get(key)
+        if predicted is None:
+            predicted = tuple(self.ruleStarts[corner] for corner in self.corners[rule]
+                              if token in self.first[corner] or self.nullable[corner])
+            self.predictions[key] = predicted
+        return predicted
+
+    def _fill(self, chart, tokens):
+        """
+        Fills the chart with the items of a sentence
+
+        :returns: True if the sentence is a string of the rules
+        """
+        size = len(tokens)
+        kept = chart.reset(tokens)
+        epsilons, calls, ruleEnded = self.epsilons, self.calls, self.ruleEnded
+        tokenEdges, ruleEnds, predictions = self.tokenEdges, self.ruleEnds, self._predictions
+        first, nullable = self.stateFirst, self.stateNullable
+        for k in range(kept, size + 1):
+            token = tokens[k] if k < size else None
+            firstSet = None
+            if k == 0:
+                # the first set only depends on the first token, and is not
+                # changed once filled, so charts share it
+                firstSet = self.firstSets.get(token)
+                if firstSet is None:
+                    chart.sets[0] = {(0, 0): []}
+                    chart.waiting[0] = {}
+                    queue = [(0, 0)]
+                else:
+                    chart.sets[0], chart.waiting[0], chart.scanned[0] = firstSet
+                    queue = []
+            else:
+                # the items of the previous set that read its token, keeping
+                # those that can go on with this one
+                items = chart.sets[k]
+                queue = []
+                for state, origin in chart.scanned[k - 1]:
+                    key = (k - 1, state, origin)
+                    for target, weight in tokenEdges[state][tokens[k - 1]]:
+                        if token not in first[target] and not nullable[target]:
+                            continue
+                        links = items.get((target, origin))
+                        if links is None:
+                            items[(target, origin)] = [(key, weight, None)]
+                            queue.append((target, origin))
+                        else:
+                            links.append((key, weight, None))
+                if not queue:
+                    chart.filled = k
+                    return False
+            if firstSet is not None:
+                continue
+            items = chart.sets[k]
+            waiting = chart.waiting[k]
+            # rules completed from k at k
+            empty = set()
+            scanned = []
+            j = 0
+            while j < len(queue):
+                item = queue[j]
+                j += 1
+                state, origin = item
+                key = (k, state, origin)
+                for target, weight in epsilons[state]:
+                    if token not in first[target] and not nullable[target]:
+                        continue
+                    links = items.get((target, origin))
+                    if links is None:
+                        items[(target, origin)] = [(key, weight, None)]
+                        queue.append((target, origin))
+                    else:
+                        links.append((key, weight, None))
+                for rule, target, weight in calls[state]:
+                    waiters = waiting.get(rule)
+                    if waiters is None:
+                        waiting[rule] = [(state, origin, target, weight)]
+                        for start in predictions(rule, token):
+                            if (start, k) not in items:
+                                items[(start, k)] = []
+                                queue.append((start, k))
+                    else:
+                        waiters.append((state, origin, target, weight))
+                    if rule in empty and (token in first[target] or nullable[target]):
+                        link = (key, weight, (k, ruleEnds[rule], k))
+                        links = items.get((target, origin))
+                        if links is None:
+                            items[(target, origin)] = [link]
+                            queue.append((target, origin))
+                        else:
+                            links.append(link)
+                rule = ruleEnded[state]
+                if rule >= 0:
+                    if origin == k:
+                        empty.add(rule)
+                    for caller, callerOrigin, target, weight in chart.waiting[origin].get(rule, ()):
+                        if token not in first[target] and not nullable[target]:
+                            continue
+                        link = ((origin, caller, callerOrigin), weight, key)
+                        links = items.get((target, callerOrigin))
+                        if links is None:
+                            items[(target, callerOrigin)] = [link]
+                            queue.append((target, callerOrigin))
+                        else:
+                            links.append(link)
+                if token is not None and tokenEdges[state] and token in tokenEdges[state]:
+                    scanned.append(item)
+            chart.scanned[k] = scanned
+            if k == 0:
+                if len(self.firstSets) >= FIRST_SET_LIMIT:
+                    self.firstSets.clear()
+                self.firstSets[token] = (items, waiting, scanned)
+        chart.filled = size + 1
+        return (1, 0) in chart.sets[size]
+
+    def _score(self, chart):
+        """
+        Computes the probability of the items that lead to the end of the
+        sentence, the probability of their best derivation and its last link
+
+        :returns: (probabilities, best probabilities, best links), \
+                dictionaries keyed by (set, state, origin)
+        """
+        sets = chart.sets
+        final = (chart.size - 1, 1, 0)
+        # the items reached back from the end, dependencies first; an item
+        # met again while its dependencies are visited is part of a cycle
+        links = {}
+        order = []
+        visiting = set()
+        cyclic = False
+        work = [(final, False)]
+        while work:
+            key, visited = work.pop()
+            if visited:
+                visiting.discard(key)
+                order.append(key)
+                continue
+            if key in links:
+                if key in visiting:
+                    cyclic = True
+                continue
+            itemLinks = links[key] = sets[key[0]][key[1:]]
+            visiting.add(key)
+            work.append((key, True))
+            for previous, weight, child in itemLinks:
+                work.append((previous, False))
+                if child is not None:
+                    work.append((child, False))
+        inside = {}
+        best = {}
+        bestLinks = {}
+        if not cyclic:
+            for key in order:
+                inside[key], best[key], bestLinks[key] = _evaluate(links[key], inside, best)
+            return inside, best, bestLinks
+        dependencies = {key: [link[0] for link in itemLinks] + [link[2] for link in itemLinks if link[2]]
+                        for key, itemLinks in links.items()}
+        for group in gram.ruleGroups(dependencies):
+            if len(group) == 1 and group[0] not in dependencies[group[0]]:
+                key = group[0]
+                inside[key], best[key], bestLinks[key] = _evaluate(links[key], inside, best)
+                continue
+            # the best derivations do not loop, and the probabilities of the
+            # loops shrink geometrically
+            for key in group:
+                inside[key] = best[key] = 0.0
+                bestLinks[key] = None
+            for number in range(MAX_PASSES):
+                changed = False
+                for key in group:
+                    total, top, topLink = _evaluate(links[key], inside, best)
+                    if top > best[key] or bestLinks[key] is None:
+                        changed = True
+                        best[key] = top
+                        bestLinks[key] = topLink
+                    if abs(total - inside[key]) > TOLERANCE * total:
+                        changed = True
+                    inside[key] = total
+                if not changed:
+                    break
+        return inside, best, bestLinks
+
+    def _tree(self, tokens, key, bestLinks):
+        """
+        :returns: Node of the best derivation of a completed item
+        """
+        root = Node(self.ruleNames[self.ruleEnded[key[1]]], key[2], key[0], None)
+        stack = [(root, key)]
+        while stack:
+            node, key = stack.pop()
+            children = []
+            link = bestLinks[key]
+            while link is not None:
+                previous, weight, child = link
+                if child is not None:
+                    subtree = Node(self.ruleNames[self.ruleEnded[child[1]]], child[2], child[0], None)
+                    children.append(subtree)
+                    stack.append((subtree, child))
+                elif previous[0] != key[0]:
+                    children.append(tokens[previous[0]])
+                key = previous
+                link = bestLinks[key]
+            children.reverse()
+            node.children = children
+        return root
+
+    def _parse(self, chart, sentence):
+        tokens = sentence.split() if isinstance(sentence, str) else list(sentence)
+        if not all(token in self.tokens for token in tokens) or not self._fill(chart, tokens):
+            return None
+        inside, best, bestLinks = self._score(chart)
+        final = (len(tokens), 1, 0)
+        # rule 0 only uses one of the rules parsed
+        tree = self._tree(tokens, final, bestLinks).children[0]
+        return Parse(tree, best[final], inside[final])
+
+    def parse(self, sentence):
+        """
+        Parses a sentence with the rules
+
+        :param sentence: string of tokens separated by white space, or list \
+                of tokens
+        :returns: Parse object, or None if the sentence is not a string of \
+                the rules
+        """
+        return self._parse(Chart(), sentence)
+
+    def iterParses(self, sentences):
+        """
+        Parses the sentences of a corpus one after the other, in a single
+        chart: each sentence keeps the sets of the tokens it starts with in
+        common with the previous one
+
+        :param sentences: iterable of sentences, see :meth:`parse`
+        :returns: generator of Parse objects or None, one per sentence
+        """
+        chart = Chart()
+        for sentence in sentences:
+            yield self._parse(chart, sentence)
+
+    def parseAll(self, sentences):
+        """
+        Parses a batch of sentences in a single chart, in the order of their
+        tokens, so that sentences starting alike follow each other and share
+        the sets of their common tokens
+
+        :param sentences: iterable of sentences, see :meth:`parse`
+        :returns: list of Parse objects or None, one per sentence, in the \
+                order of the sentences
+        """
+        batch = [sentence.split() if isinstance(sentence, str) else list(sentence) for sentence in sentences]
+        results = [None] * len(batch)
+        chart = Chart()
+        for i in sorted(range(len(batch)), key=batch.__getitem__):
+            results[i] = self._parse(chart, batch[i])
+        return results
+
+    def matches(self, sentence):
+        """
+        :param sentence: string of tokens separated by white space, or list \
+                of tokens
+        :returns: True if the sentence is a string of the rules
+        """
+        tokens = sentence.split() if isinstance(sentence, str) else list(sentence)
+        return all(token in self.tokens for token in tokens) and self._fill(Chart(), tokens)
+
+    def iterTrees(self, sentence):
+        """
+        Yields the tree of every derivation of a sentence, in no particular
+        order. A derivation that goes through the same item twice, which
+        only grammars with rules deriving themselves on the same tokens
+        have, is left out, so there are finitely many.
+
+        :param sentence: string of tokens separated by white space, or list \
+                of tokens
+        :returns: generator of Nodes, empty if the sentence is not a string \
+                of the rules
+        """
+        tokens = sentence.split() if isinstance(sentence, str) else list(sentence)
+        chart = Chart()
+        if not all(token in self.tokens for token in tokens) or not self._fill(chart, tokens):
+            return
+        with parser.recursionLimit(RECURSION_LIMIT):
+            for children in self._iterChildren(chart, tokens, (len(tokens), 1, 0), frozenset()):
+                yield children[0]
+
+    def _iterChildren(self, chart, tokens, key, path):
+        # yields the children lists of the derivations of the part of a rule
+        # up to an item
+        links = chart.sets[key[0]][key[1:]]
+        if not links:
+            yield []
+            return
+        path = path | {key}
+        for previous, weight, child in links:
+            if previous in path or child in path:
+                continue
+            for children in self._iterChildren(chart, tokens, previous, path):
+                if child is not None:
+                    name = self.ruleNames[self.ruleEnded[child[1]]]
+                    for subtree in self._iterChildren(chart, tokens, child, path):
+                        yield children + [Node(name, child[2], child[0], subtree)]
+                elif previous[0] != key[0]:
+                    yield children + [tokens[previous[0]]]
+                else:
+                    yield children
+
+
+def _evaluate(links, inside, best):
+    """
+    :returns: (probability of an item, probability of its best derivation, \
+            last link of that derivation) from those of the items it is \
+            reached from
+    """
+    if not links:
+        return 1.0, 1.0, None
+    total = 0.0
+    top = -1.0
+    topLink = None
+    for link in links:
+        previous, weight, child = link
+        probability = weight * inside[previous]
+        bestProbability = weight * best[previous]
+        if child is not None:
+            probability *= inside[child]
+            bestProbability *= best[child]
+        total += probability
+        if bestProbability > top:
+            top = bestProbability
+            topLink = link
+    return total, top, topLink
+
+def main():
+    """Main function for command line usage"""
+    argParser = argparse.ArgumentParser(description='Print the most probable parse of each line with a JSGF grammar')
+    argParser.add_argument('grammarFile', help='Path to the JSGF grammar file')
+    argParser.add_argument('corpusFiles', nargs='*', metavar='corpusFile',
+                           help='Files of sentences, one per line; the standard input if none')
+    argParser.add_argument('--no-cache', dest='noCache', action='store_true',
+                           help='Parse the grammar file even if a cached copy exists')
+
+    try:
+        args = argParser.parse_args()
+    except SystemExit:
+        return
+
+    try:
+        grammar = cache.loadGrammar(args.grammarFile, useCache=not args.noCache)
+        earley = EarleyParser(grammar)
+        for fileName in args.corpusFiles or ['-']:
+            corpus = sys.stdin if fileName == '-' else open(fileName)
+            try:
+                lines = (line.rstrip('\n') for line in corpus)
+                for result in earley.iterParses(lines):
+                    if result is None:
+                        print('-')
+                    else:
+                        print('%s\t%g' % (result.tree, result.sentenceProbability))
+            finally:
+                if corpus is not sys.stdin:
+                    corpus.close()
+    except FileNotFoundError as e:
+        print(f"Error: file '{e.filename}' not found")
+        sys.exit(1)
+    except Exception as e:
+        print(f"Error processing grammar: {e}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -28,16 +28,34 @@ This file lays out the class structure for a JSGF Grammar.
 """
 
 
+import sys
+
+
 class JSGFExpression():
-    pass
+    """
+    Base class of the expression nodes. Nodes use __slots__ and cannot be
+    modified once built, so that identical subtrees can be shared (see
+    :class:`NodeTable`).
+    """
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        raise AttributeError(type(self).__name__ + ' objects are immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError(type(self).__name__ + ' objects are immutable')
 
 class Disjunction(JSGFExpression):
     """
-    Disjunction class stores disjuncts in a list
+    Disjunction class stores disjuncts in a tuple
     """
+    __slots__ = ('disjuncts',)
     
     def __init__(self, disjuncts):
-        self.disjuncts = disjuncts
+        object.__setattr__(self, 'disjuncts', tuple(disjuncts))
+
+    def __reduce__(self):
+        return (Disjunction, (self.disjuncts,))
 
     def __str__(self):
         return '( ' + ' | '.join(map(str,self.disjuncts)) + ' )'
@@ -53,9 +71,13 @@ class Optional(JSGFExpression):
     Optional class stores either a JSGFExpression, list, or string 
     as its optional element
     """
+    __slots__ = ('option',)
 
     def __init__(self, option):
-        self.option = option
+        object.__setattr__(self, 'option', option)
+
+    def __reduce__(self):
+        return (Optional, (self.option,))
 
     def __str__(self):
         return ('[ ' + str(self.option) + ' ]')
@@ -70,9 +92,13 @@ class NonTerminal(JSGFExpression):
     """
     NonTerminal class simply stores the label of the nonterminal
     """
+    __slots__ = ('name',)
 
     def __init__(self, ntName):
-        self.name = ntName
+        object.__setattr__(self, 'name', ntName)
+
+    def __reduce__(self):
+        return (NonTerminal, (self.name,))
 
     def __str__(self):
         return self.name
@@ -84,12 +110,143 @@ class NonTerminal(JSGFExpression):
         return self.name
 
 
+class Vocabulary():
+    """
+    Vocabulary class, numbers every distinct token of a grammar so that
+    sentences can be handled as arrays of token numbers and only turned into
+    text when they are written out
+    """
+
+    def __init__(self):
+        self.tokens = []
+        self.ids = {}
+
+    def add(self, token):
+        """
+        returns the number of a token, numbering it if it is new
+        """
+        tokenId = self.ids.get(token)
+        if tokenId is None:
+            tokenId = self.ids[token] = len(self.tokens)
+            self.tokens.append(token)
+        return tokenId
+
+    def __getitem__(self, token):
+        """
+        returns the number of a known token
+        """
+        return self.ids[token]
+
+    def __contains__(self, token):
+        return token in self.ids
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def detokenize(self, tokenIds):
+        """
+        returns the sentence made of a sequence of token numbers
+        """
+        tokens = self.tokens
+        return ' '.join([tokens[t] for t in tokenIds])
+
+    def write(self, fileStream):
+        """
+        writes the tokens one per line, the line number being the token number
+        """
+        for token in self.tokens:
+            fileStream.write(token + '\n')
+
+class NodeTable():
+    """
+    Hash-consing constructor for expressions. Building expressions through
+    the same table returns the same object for structurally identical
+    expressions, so a repeated ``[ please ]`` or token list is stored once.
+    Sequences are still plain lists and weighted alternatives plain
+    (expression, weight) tuples; they must not be modified once built.
+
+    Children passed to the constructors must come from the same table. The
+    table only needs to live while a grammar is being built. Tokens are also
+    numbered in the table's vocabulary.
+    """
+
+    def __init__(self, vocabulary=None):
+        self.nodes = {}
+        self.vocabulary = Vocabulary() if vocabulary is None else vocabulary
+
+    def key(self, expr):
+        # children are canonical, so their identity stands for their structure
+        if isinstance(expr, str):
+            return expr
+        return id(expr)
+
+    def token(self, token):
+        key = ('T', token)
+        node = self.nodes.get(key)
+        if node is None:
+            node = self.nodes[key] = sys.intern(token)
+            self.vocabulary.add(node)
+        return node
+
+    def nonTerminal(self, name):
+        key = ('N', name)
+        node = self.nodes.get(key)
+        if node is None:
+            node = self.nodes[key] = NonTerminal(sys.intern(name))
+        return node
+
+    def optional(self, option):
+        key = ('O', self.key(option))
+        node = self.nodes.get(key)
+        if node is None:
+            node = self.nodes[key] = Optional(option)
+        return node
+
+    def disjunction(self, disjuncts):
+        key = ('D',) + tuple(map(self.key, disjuncts))
+        node = self.nodes.get(key)
+        if node is None:
+            node = self.nodes[key] = Disjunction(disjuncts)
+        return node
+
+    def sequence(self, items):
+        key = ('S',) + tuple(map(self.key, items))
+        node = self.nodes.get(key)
+        if node is None:
+            node = self.nodes[key] = list(items)
+        return node
+
+    def weighted(self, expr, weight):
+        key = ('W', self.key(expr), weight)
+        node = self.nodes.get(key)
+        if node is None:
+            node = self.nodes[key] = (expr, weight)
+        return node
+
+    def canonical(self, expr):
+        """
+        returns the shared copy of an expression built without the table
+        """
+        if isinstance(expr, list):
+            return self.sequence([self.canonical(e) for e in expr])
+        elif isinstance(expr, tuple):
+            return self.weighted(self.canonical(expr[0]), expr[1])
+        elif isinstance(expr, Disjunction):
+            return self.disjunction([self.canonical(e) for e in expr.disjuncts])
+        elif isinstance(expr, Optional):
+            return self.optional(self.canonical(expr.option))
+        elif isinstance(expr, NonTerminal):
+            return self.nonTerminal(expr.name)
+        return self.token(expr)
+
+
 class Rule():
     """
     Rule class, represents a JSGF rule, with a nonterminal name representing the
     left hand side, and a list of possible expansions representing the right
     hand side. 
     """
+    __slots__ = ('lhs', 'rhs')
 
     def __init__(self):
         """
@@ -118,47 +275,150 @@ class Rule():
         return str(self)
 
         
+def ruleName(lhs):
+    """
+    returns the name a rule is indexed under
+
+    :param lhs: left hand side of a rule, a NonTerminal or its name
+    """
+    if isinstance(lhs, NonTerminal):
+        return lhs.name
+    return lhs
+
+def ruleGroups(calls):
+    """
+    groups rules that can expand each other: the strongly connected
+    components of the graph of rule uses, found with Tarjan's algorithm and
+    an explicit stack
+
+    :param calls: dictionary from rule name to the names of the rules it \
+            uses; other names are ignored
+    :returns: list of lists of rule names, a group coming after the groups \
+              of the rules it uses
+    """
+    index = {}
+    lowLink = {}
+    onStack = set()
+    stack = []
+    groups = []
+    for root in calls:
+        if root in index:
+            continue
+        work = [(root, iter(calls[root]))]
+        index[root] = lowLink[root] = len(index)
+        stack.append(root)
+        onStack.add(root)
+        while work:
+            name, callees = work[-1]
+            for callee in callees:
+                if callee not in calls:
+                    continue
+                if callee not in index:
+                    index[callee] = lowLink[callee] = len(index)
+                    stack.append(callee)
+                    onStack.add(callee)
+                    work.append((callee, iter(calls[callee])))
+                    break
+                if callee in onStack:
+                    lowLink[name] = min(lowLink[name], index[callee])
+            else:
+                work.pop()
+                if work:
+                    caller = work[-1][0]
+                    lowLink[caller] = min(lowLink[caller], lowLink[name])
+                if lowLink[name] == index[name]:
+                    group = []
+                    while True:
+                        member = stack.pop()
+                        onStack.discard(member)
+                        group.append(member)
+                        if member == name:
+                            break
+                    groups.append(group)
+    return groups
+
 class Grammar(): 
     """
     Grammar class which contains a list for public rules and a list
-    for all rules. 
+    for all rules, and a dictionary indexing all rules by name so that
+    nonterminals can be looked up in constant time. The parser numbers
+    every token of the grammar in its vocabulary. The generation counts the
+    rules redefined with replaceRule, so that anything computed from the
+    rules can tell when it is out of date.
     """
 
     def __init__(self): 
         self.rules = []
         self.publicRules = []
+        self.ruleIndex = {}
+        self.publicRuleIndex = {}
+        self.vocabulary = Vocabulary()
+        self.generation = 0
 
     def addRule(self, rule):
         """
         adds a rule to the list of rules
+
+        :raises ValueError: if a rule with the same name was already added
         """
+        name = ruleName(rule.lhs)
+        if name in self.ruleIndex:
+            raise ValueError('Rule defined more than once: ' + str(name))
+        self.ruleIndex[name] = rule
         self.rules.append(rule)
 
     def addPublicRule(self, rule):
         """
         adds a rule to the list of public rules
+
+        :raises ValueError: if a public rule with the same name was already added
         """
+        name = ruleName(rule.lhs)
+        if name in self.publicRuleIndex:
+            raise ValueError('Public rule defined more than once: ' + str(name))
+        self.publicRuleIndex[name] = rule
         self.publicRules.append(rule)
 
+    def replaceRule(self, rule):
+        """
+        defines a rule, replacing the rule with the same name if there is one,
+        including its public version
+        """
+        name = ruleName(rule.lhs)
+        oldRule = self.ruleIndex.get(name)
+        if oldRule is None:
+            self.addRule(rule)
+            return
+        self.rules[self.rules.index(oldRule)] = rule
+        self.ruleIndex[name] = rule
+        oldPublicRule = self.publicRuleIndex.get(name)
+        if oldPublicRule is not None:
+            self.publicRules[self.publicRules.index(oldPublicRule)] = rule
+            self.publicRuleIndex[name] = rule
+        self.generation += 1
+
     def getRHS(self, nt):
         """
         returns rule definition
         
         :param nt: Non-Terminal (variable) whose definition to get
         """
-        for rule in self.rules:
-            #print 'checking', nt.name, 'and', rule.lhs, type(nt.name), rule.lhs.name
-            if rule.lhs.name == nt.name:
-                return rule.rhs
-        raise ValueError("Rule not defined for " + str(nt))
+        try:
+            return self.ruleIndex[nt.name].rhs
+        except KeyError:
+            raise ValueError("Rule not defined for " + str(nt))
 
     def __getitem__(self, nt):
-        #rhsides = [] to do for multiple rhsides
-        for rule in self.rules:
-            if rule.lhs == nt:
-                return rule.rhs
-            else:
-                raise ValueError('Rule not defined for ' + str(nt))
+        """
+        returns the rule definition of a nonterminal or a rule name
+        """
+        try:
+            return self.ruleIndex[ruleName(nt)].rhs
+        except KeyError:
+            raise ValueError('Rule not defined for ' + str(nt))
+
+    def __contains__(self, nt):
+        return ruleName(nt) in self.ruleIndex
 
     def __str__(self):
         return 'All Rules:' + str(self.rules) + '\n' + 'Public Rules:' + str(self.publicRules)
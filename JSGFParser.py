@@ -21,9 +21,13 @@
 
 """
 This file parses a JSGF grammar file and returns a JSGFGrammar object. \
-        It uses the pyparsing module and defines a grammar for JSGF grammars. \
-        Upon finding a string or JSGF expression, it builds a grammar object from \
-        the bottom up, composing JSGF expressions with strings and lists. When the \
+        It has two parser engines which build identical grammar objects. The \
+        default ``fast`` engine tokenizes the text with a single regular \
+        expression and parses the tokens with a hand-written recursive descent \
+        parser in one linear pass. The ``pyparsing`` engine uses the pyparsing \
+        module and defines a grammar for JSGF grammars; pyparsing is only \
+        imported when this engine is used. Upon finding a string or JSGF \
+        expression, either engine builds a grammar object from the bottom up, composing JSGF expressions with strings and lists. When the \
         entire right hand side of a rule has been parsed and a JSGF expression \
         object has been created of it, it gets added to the main JSGFGrammar \
         object as one of its rules.
@@ -36,7 +40,9 @@ To run the parser independently and print the resulting JSGFGrammar object, \
 Generally, this module should be imported and the getGrammarObject should be called \
         with a ``file`` object as its argument. This function returns a grammar \
         object that can be used by the Generator scripts ``DeterministicGenerator.py`` \
-        and ``ProbabilisticGenerator.py``.
+        and ``ProbabilisticGenerator.py``. For grammar files too large to hold \
+        in memory, ``iterRules`` reads the stream in chunks and yields each rule \
+        as soon as it has been parsed.
 
 The features of JSGF that this parser can handle include:
     - rulenames
@@ -58,15 +64,29 @@ Notable features of JSGF that are **not** handled by this parser are:
 
 """
 
+import re
 import sys
+import contextlib
+import threading
 import JSGFGrammar as gram
-from pyparsing import (Word, Literal, Group, Optional, ZeroOrMore, OneOrMore,
-                      Forward, MatchFirst, Combine, alphas, alphanums, nums,
-                      stringEnd) 
 
-sys.setrecursionlimit(100000)
 usePackrat = True
 
+#: Recursion limit while the pyparsing engine runs, as pyparsing recurses
+#: once or more per alternative of a rule. It is restored afterwards.
+PYPARSING_RECURSION_LIMIT = 100000
+
+#: Parser engines accepted by :func:`getGrammarObject`
+ENGINES = ('fast', 'pyparsing')
+DEFAULT_ENGINE = 'fast'
+
+#: Version of the grammar objects the parser builds. It is part of the key of
+#: grammars cached by JSGFCache, so it must change whenever they change.
+PARSER_VERSION = 5
+
+#: Number of characters read from a stream at a time by :func:`iterRules`
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
 def foundWeight(s, loc, toks):
     """
     PyParsing action to run when a weight is found.
@@ -162,37 +182,336 @@ def foundSeq(s, loc, toks):
         #print 'seq returning', list(toks[0])[0], type(list(toks[0])[0])
         return list(toks[0])[0]
 
-# PyParsing rule for a weight
-weight = (Literal('/').suppress() + (Word(nums + '.')).setResultsName('weightAmount') + Literal('/').suppress()).setParseAction(foundWeight).setResultsName("weight")
+# The pyparsing grammar is only built (and pyparsing only imported) the first
+# time the pyparsing engine is used, so that the fast engine keeps it out of
+# the startup path.
+_pyparsingGrammar = None
+
+def _buildPyparsingGrammar():
+    """
+    Builds the pyparsing grammar for JSGF rules
+
+    :returns: dictionary mapping the names of the pyparsing rules to the rules
+    """
+    from pyparsing import (Word, Literal, Group, Optional, OneOrMore,
+                          Forward, MatchFirst, Combine, alphanums, nums,
+                          stringEnd)
+
+    # PyParsing rule for a weight
+    weight = (Literal('/').suppress() + (Word(nums + '.')).setResultsName('weightAmount') + Literal('/').suppress()).setParseAction(foundWeight).setResultsName("weight")
+
+    # PyParsing rule for a token
+    token = Word(alphanums+"'_-,.?@").setResultsName('token').setParseAction(foundToken)
+
+    # PyParsing rule for a nonterminal reference
+    nonterminal = Combine(Literal('<') + Word(alphanums+'$_:;,=|/\\()[]@#%!^&~') + Literal('>')).setParseAction(foundNonterminal).setResultsName('NonTerminal')
+
+    Sequence = Forward()
+
+    weightedExpression = (weight + Group(Sequence).setResultsName("expr")).setResultsName('weightedExpression').setParseAction(foundWeightedExpression)
 
-# PyParsing rule for a token
-token = Word(alphanums+"'_-,.?@").setResultsName('token').setParseAction(foundToken)
+    weightAlternatives = Forward()
+    weightedPrime = Literal('|').suppress() + weightAlternatives
+    weightAlternatives << MatchFirst([(Group(weightedExpression).setResultsName("disj1") + Group(weightedPrime).setResultsName("disj2")).setParseAction(foundPair).setResultsName("pair"), Group(weightedExpression).setParseAction(foundSeq)])
 
-# PyParsing rule for a nonterminal reference
-nonterminal = Combine(Literal('<') + Word(alphanums+'$_:;,=|/\\()[]@#%!^&~') + Literal('>')).setParseAction(foundNonterminal).setResultsName('NonTerminal')
+    disj = Forward()
+    disjPrime = Literal('|').suppress() + disj
+    disj << MatchFirst([(Group(Sequence).setResultsName("disj1") + Group(disjPrime).setResultsName("disj2")).setParseAction(foundPair).setResultsName("pair"), Group(Sequence).setParseAction(foundSeq)])
 
-Sequence = Forward()
+    topLevel = MatchFirst([disj, weightAlternatives])
+    StartSymbol = Optional(Literal('public')).setResultsName('public') + nonterminal.setResultsName('identifier') + Literal('=').suppress() + Group(topLevel).setResultsName('ruleDef') + Literal(';').suppress() + stringEnd
 
-weightedExpression = (weight + Group(Sequence).setResultsName("expr")).setResultsName('weightedExpression').setParseAction(foundWeightedExpression)
 
-weightAlternatives = Forward()
-weightedPrime = Literal('|').suppress() + weightAlternatives
-weightAlternatives << MatchFirst([(Group(weightedExpression).setResultsName("disj1") + Group(weightedPrime).setResultsName("disj2")).setParseAction(foundPair).setResultsName("pair"), Group(weightedExpression).setParseAction(foundSeq)])
+    Expression = MatchFirst([nonterminal, token])
 
-disj = Forward()
-disjPrime = Literal('|').suppress() + disj
-disj << MatchFirst([(Group(Sequence).setResultsName("disj1") + Group(disjPrime).setResultsName("disj2")).setParseAction(foundPair).setResultsName("pair"), Group(Sequence).setParseAction(foundSeq)])
+    Grouping = Literal('(').suppress() + topLevel + Literal(')').suppress()
+    OptionalGrouping = (Literal('[').suppress() + Group(topLevel).setResultsName("optionalItem") + Literal(']').suppress()).setParseAction(foundOptionalGroup)
 
-topLevel = MatchFirst([disj, weightAlternatives])
-StartSymbol = Optional(Literal('public')).setResultsName('public') + nonterminal.setResultsName('identifier') + Literal('=').suppress() + Group(topLevel).setResultsName('ruleDef') + Literal(';').suppress() + stringEnd
+    Sequence << Group(OneOrMore(MatchFirst([Grouping, OptionalGrouping, Expression]))).setResultsName("seq").setParseAction(foundSeq)
 
+    return dict(weight=weight, token=token, nonterminal=nonterminal,
+                Sequence=Sequence, weightedExpression=weightedExpression,
+                weightAlternatives=weightAlternatives,
+                weightedPrime=weightedPrime, disj=disj, disjPrime=disjPrime,
+                topLevel=topLevel, StartSymbol=StartSymbol,
+                Expression=Expression, Grouping=Grouping,
+                OptionalGrouping=OptionalGrouping)
 
-Expression = MatchFirst([nonterminal, token])
+def _getPyparsingGrammar():
+    global _pyparsingGrammar
+    if _pyparsingGrammar is None:
+        _pyparsingGrammar = _buildPyparsingGrammar()
+    return _pyparsingGrammar
 
-Grouping = Literal('(').suppress() + topLevel + Literal(')').suppress()
-OptionalGrouping = (Literal('[').suppress() + Group(topLevel).setResultsName("optionalItem") + Literal(']').suppress()).setParseAction(foundOptionalGroup)
+# names of the pyparsing rules that are available as module attributes
+_PYPARSING_RULES = frozenset([
+    'weight', 'token', 'nonterminal', 'Sequence', 'weightedExpression',
+    'weightAlternatives', 'weightedPrime', 'disj', 'disjPrime', 'topLevel',
+    'StartSymbol', 'Expression', 'Grouping', 'OptionalGrouping'])
 
-Sequence << Group(OneOrMore(MatchFirst([Grouping, OptionalGrouping, Expression]))).setResultsName("seq").setParseAction(foundSeq)
+def __getattr__(name):
+    # keeps the pyparsing rules (StartSymbol, Sequence, ...) available as
+    # module attributes without building them at import time; other names
+    # fail without importing pyparsing
+    if name not in _PYPARSING_RULES:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    return _getPyparsingGrammar()[name]
+
+# Lexer for the fast engine. The character classes are the same as the ones
+# used by the pyparsing rules for tokens and nonterminals, and only the
+# whitespace characters pyparsing skips are ignored. Every other character is
+# returned as a single character error token.
+_lexer = re.compile(r"""
+    (<[A-Za-z0-9$_:;,=|/\\()\[\]@\#%!^&~]+>)       # nonterminal
+  | /[ \t\r\n]*([0-9.]+)[ \t\r\n]*/                 # weight
+  | ([A-Za-z0-9'_\-,.?@]+)                          # token
+  | ([|()\[\]=;])                                   # punctuation
+  | ([^ \t\r\n])                                    # anything else
+  """, re.VERBOSE)
+
+_NONTERMINAL, _WEIGHT, _TOKEN, _PUNCT, _ERROR = range(5)
+
+class _FastParseError(Exception):
+    pass
+
+def tokenize(text):
+    """
+    Splits JSGF text into lexical tokens in a single pass
+
+    :param text: string containing JSGF rules, with comments already removed
+    :returns: list of (kind, value) pairs
+    """
+    tokens = []
+    append = tokens.append
+    for nt, weightAmount, tok, punct, error in _lexer.findall(text):
+        if nt:
+            append((_NONTERMINAL, nt))
+        elif tok:
+            append((_TOKEN, tok))
+        elif punct:
+            append((_PUNCT, punct))
+        elif weightAmount:
+            append((_WEIGHT, weightAmount))
+        else:
+            append((_ERROR, error))
+    return tokens
+
+class _FastParser():
+    """
+    Recursive descent parser over the output of :func:`tokenize`. It builds
+    exactly the same expression objects as the parse actions of the pyparsing
+    engine: alternatives are parsed in a loop rather than by recursion, so
+    very wide rules do not need a deep stack.
+    """
+
+    def __init__(self, tokens, pos, end, table):
+        self.tokens = tokens
+        self.pos = pos
+        self.end = end
+        self.table = table
+
+    def peek(self):
+        if self.pos < self.end:
+            return self.tokens[self.pos]
+        return (None, None)
+
+    def expect(self, punct):
+        if self.peek() != (_PUNCT, punct):
+            raise _FastParseError(punct)
+        self.pos += 1
+
+    def parseRule(self):
+        """
+        :returns: (isPublic, Rule) for a rule spanning all remaining tokens
+        """
+        isPublic = False
+        kind, value = self.peek()
+        if kind == _TOKEN and value == 'public':
+            isPublic = True
+            self.pos += 1
+            kind, value = self.peek()
+        if kind != _NONTERMINAL:
+            raise _FastParseError('rule name')
+        self.pos += 1
+        identifier = self.table.nonTerminal(value)
+        self.expect('=')
+        ruleDef = self.parseTopLevel()
+        if self.pos != self.end:
+            raise _FastParseError('end of rule')
+        return isPublic, gram.Rule(identifier, self.table.sequence(ruleDef))
+
+    def parseTopLevel(self):
+        if self.peek()[0] == _WEIGHT:
+            return self.parseWeightAlternatives()
+        return self.parseDisjunction()
+
+    def parseDisjunction(self):
+        alternatives = [self.parseSequence()]
+        while self.peek() == (_PUNCT, '|'):
+            self.pos += 1
+            alternatives.append(self.parseSequence())
+        if len(alternatives) == 1:
+            return alternatives[0]
+        # mirrors foundPair folding the alternatives from the right
+        sequence = self.table.sequence
+        disjuncts = []
+        for alternative in alternatives[:-1]:
+            disjuncts.append(sequence(alternative) if len(alternative) > 1 else alternative[0])
+        last = alternatives[-1]
+        if len(last) > 1:
+            disjuncts.append(sequence(last))
+        elif isinstance(last[0], gram.Disjunction):
+            disjuncts.extend(last[0].disjuncts)
+        else:
+            disjuncts.append(last[0])
+        return [self.table.disjunction(disjuncts)]
+
+    def parseWeightAlternatives(self):
+        alternatives = [self.parseWeightedExpression()]
+        while self.peek() == (_PUNCT, '|'):
+            self.pos += 1
+            alternatives.append(self.parseWeightedExpression())
+        if len(alternatives) == 1:
+            return alternatives
+        return [self.table.disjunction(alternatives)]
+
+    def parseWeightedExpression(self):
+        kind, value = self.peek()
+        if kind != _WEIGHT:
+            raise _FastParseError('weight')
+        self.pos += 1
+        weight = float(value)
+        expr = self.parseSequence()
+        if len(expr) == 1:
+            expr = expr[0]
+        else:
+            expr = self.table.sequence(expr)
+        return self.table.weighted(expr, weight)
+
+    def parseSequence(self):
+        items = []
+        tokens = self.tokens
+        table = self.table
+        while self.pos < self.end:
+            kind, value = tokens[self.pos]
+            if kind == _TOKEN:
+                items.append(table.token(value))
+                self.pos += 1
+            elif kind == _NONTERMINAL:
+                items.append(table.nonTerminal(value))
+                self.pos += 1
+            elif value == '(' and kind == _PUNCT:
+                self.pos += 1
+                items.extend(self.parseTopLevel())
+                self.expect(')')
+            elif value == '[' and kind == _PUNCT:
+                self.pos += 1
+                optionalItem = self.parseTopLevel()
+                self.expect(']')
+                if len(optionalItem) > 1:
+                    items.append(table.optional(table.sequence(optionalItem)))
+                else:
+                    items.append(table.optional(optionalItem[0]))
+            else:
+                break
+        if not items:
+            raise _FastParseError('sequence')
+        return items
+
+def _parseStatementFast(tokens, start, end, table):
+    """
+    Parses the tokens of one statement (without its terminating semicolon).
+    Like pyparsing's scanString, text that cannot start a rule is skipped
+    until a rule is found that extends to the end of the statement.
+
+    :returns: (isPublic, Rule), or None if the statement holds no rule
+    """
+    for pos in range(start, end):
+        kind, value = tokens[pos]
+        if kind == _NONTERMINAL or (kind == _TOKEN and value == 'public'):
+            try:
+                return _FastParser(tokens, pos, end, table).parseRule()
+            except _FastParseError:
+                continue
+    return None
+
+# limits of the recursionLimit blocks in progress in all threads, and the
+# limit in force before the first of them
+_recursionLimits = []
+_savedRecursionLimit = None
+_recursionLimitLock = threading.Lock()
+
+@contextlib.contextmanager
+def recursionLimit(limit):
+    """
+    Raises the interpreter recursion limit to at least limit for the duration
+    of a with block. The limit is shared by all threads, so it stays at the
+    largest limit of the blocks in progress in any thread and is only
+    restored when the last of them ends.
+    """
+    global _savedRecursionLimit
+    with _recursionLimitLock:
+        if not _recursionLimits:
+            _savedRecursionLimit = sys.getrecursionlimit()
+        _recursionLimits.append(limit)
+        sys.setrecursionlimit(max(limit, sys.getrecursionlimit()))
+    try:
+        yield
+    finally:
+        with _recursionLimitLock:
+            _recursionLimits.remove(limit)
+            sys.setrecursionlimit(max(_recursionLimits + [_savedRecursionLimit]))
+
+def _parseStatementPyparsing(statement, table):
+    """
+    Parses one statement (including its terminating semicolon) with pyparsing
+
+    :returns: (isPublic, Rule), or None if the statement holds no rule
+    """
+    StartSymbol = _getPyparsingGrammar()['StartSymbol']
+    with recursionLimit(PYPARSING_RECURSION_LIMIT):
+        match = next(StartSymbol.scanString(statement), None)
+    if match is None:
+        return None
+    tokens, start, end = match
+    #print 'rule dict is', tokens.asDict()
+    rule = gram.Rule(table.canonical(tokens.identifier), table.canonical(list(tokens.ruleDef)))
+    return 'public' in tokens.keys(), rule
+
+def _parseStatementFastText(statement, table):
+    tokens = tokenize(statement)
+    # the last token is the semicolon that terminates the statement
+    return _parseStatementFast(tokens, 0, len(tokens) - 1, table)
+
+# A statement ends at a semicolon, unless the semicolon is part of a
+# nonterminal name (which may contain one) or of a quoted token. Neither can
+# span a line break, so each line can be searched on its own.
+_terminator = re.compile(r'<[A-Za-z0-9$_:;,=|/\\()\[\]@#%!^&~]+>|"[^"\n]*"|(;)')
+
+def iterStatements(lines):
+    """
+    Groups lines of JSGF text into statements. Every line is searched for
+    terminating semicolons once, so the cost is linear in the size of the text
+    no matter how many lines a statement spans. Text after the last semicolon
+    is an unterminated statement and is dropped.
+
+    :param lines: iterable of lines with the comments already removed
+    :returns: generator of statement strings, each ending with a semicolon
+    """
+    pending = []
+    for line in lines:
+        if ';' not in line:
+            pending.append(line)
+            continue
+        start = 0
+        for match in _terminator.finditer(line):
+            if match.group(1):
+                end = match.end()
+                pending.append(line[start:end])
+                yield ''.join(pending)
+                pending = []
+                start = end
+        pending.append(line[start:])
 
 def nocomment(oldline):
     """
@@ -208,35 +527,84 @@ def nocomment(oldline):
     else:
         return oldline
 
-def getGrammarObject(fileStream):
+def iterLines(fileStream, chunkSize=DEFAULT_CHUNK_SIZE):
+    """
+    Reads a stream in fixed-size chunks and yields its lines
+
+    :param fileStream: file object to read from
+    :param chunkSize: number of characters to read at a time
+    :returns: generator of lines, each ending with a newline except maybe the last
+    """
+    parts = []
+    while True:
+        chunk = fileStream.read(chunkSize)
+        if not chunk:
+            break
+        if '\n' not in chunk:
+            parts.append(chunk)
+            continue
+        parts.append(chunk)
+        lines = ''.join(parts).split('\n')
+        parts = [lines.pop()]
+        for line in lines:
+            yield line + '\n'
+    if parts and parts[0]:
+        yield ''.join(parts)
+
+def iterRules(fileStream, engine=DEFAULT_ENGINE, chunkSize=DEFAULT_CHUNK_SIZE, vocabulary=None,
+              share=False):
+    """
+    Parses a stream of JSGF text incrementally, yielding every rule as soon as
+    its terminating semicolon has been read. Only the statement being read is
+    held in memory, so arbitrarily large grammar files can be processed in
+    constant memory, as long as the rules yielded are not kept and neither
+    share nor vocabulary is given.
+
+    :param fileStream: file object containing the contents of the grammar file
+    :param engine: parser engine to use, see :func:`getGrammarObject`
+    :param chunkSize: number of characters to read from the stream at a time
+    :param vocabulary: JSGFGrammar.Vocabulary in which to number the tokens; \
+            it grows with the number of distinct tokens of the stream
+    :param share: if True, identical subexpressions are shared across all \
+            rules of the stream, which saves memory when every rule is kept \
+            but makes the table grow with the stream; otherwise they are \
+            only shared within a rule
+    :returns: generator of (isPublic, Rule) pairs
+    """
+    if engine not in ENGINES:
+        raise ValueError("Unknown parser engine: " + str(engine))
+    if engine == 'pyparsing':
+        parseStatement = _parseStatementPyparsing
+    else:
+        parseStatement = _parseStatementFastText
+
+    lines = (nocomment(line) for line in iterLines(fileStream, chunkSize))
+    table = gram.NodeTable(vocabulary)
+    # each statement is parsed exactly once, as soon as its semicolon is seen
+    for statement in iterStatements(lines):
+        if not share:
+            table = gram.NodeTable(vocabulary)
+        parsed = parseStatement(statement, table)
+        if parsed is not None:
+            yield parsed
+
+def getGrammarObject(fileStream, engine=DEFAULT_ENGINE):
     """
     Produces a JSGFGrammar object from a stream of text, the grammar object has a set of public rules and regular rules
 
     :param fileStream: file object containing the contents of the grammar file
     :type fileStream: file object
+    :param engine: parser engine to use, either ``'fast'`` (a hand-written \
+            single-pass lexer and parser) or ``'pyparsing'``. Both build the same \
+            grammar objects.
     :returns: JSGFGrammar object
     """
-    linegenerator = fileStream
-    lines = linegenerator.readlines()
-    for i in range(len(lines)):
-        lines[i] = nocomment(lines[i])
-    # buffer will accumulate lines until a fully parseable piece is found
-    buffer = ""
-
     grammar = gram.Grammar()
-    for line in lines:
-        buffer += line
-
-        match = next(StartSymbol.scanString(buffer), None)
-        while match:
-            tokens, start, end = match
-            #print 'rule dict is', tokens.asDict()
-            if 'public' in tokens.keys():
-                grammar.addPublicRule(gram.Rule(tokens.identifier, list(tokens.ruleDef)))
-            grammar.addRule(gram.Rule(tokens.identifier, list(tokens.ruleDef)))
-
-            buffer = buffer[end:]
-            match = next(StartSymbol.scanString(buffer), None)
+    for isPublic, rule in iterRules(fileStream, engine=engine, vocabulary=grammar.vocabulary,
+                                     share=True):
+        if isPublic:
+            grammar.addPublicRule(gram.Rule(rule.lhs, list(rule.rhs)))
+        grammar.addRule(rule)
     return grammar
 
 if __name__ == '__main__':
@@ -0,0 +1,418 @@
+# -*- coding: utf-8 -*-
+# @copyright: MIT License
+#   Copyright (c) 2018 syntactic (Pastèque Ho)
+#   Permission is hereby granted, free of charge, to any person obtaining a copy
+#   of this software and associated documentation files (the "Software"), to deal
+#   in the Software without restriction, including without limitation the rights
+#   to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#   copies of the Software, and to permit persons to whom the Software is
+#   furnished to do so, subject to the following conditions:
+#   The above copyright notice and this permission notice shall be included in all
+#   copies or substantial portions of the Software.
+#   THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#   IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#   FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#   AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#   LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#   OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#   SOFTWARE.
+# @summary: This file checks whether sentences are strings of a JSGF Grammar.
+
+"""
+This file recognizes the strings of a JSGF grammar: it tells whether a \
+        sentence, such as a transcribed utterance, is one of the strings the \
+        public rules generate. Run it by entering in the command line:
+
+        ``python JSGFRecognizer.py <grammarFile> [<corpusFile> ...]``
+
+It prints the lines of the corpus files (or of the standard input) that are \
+        strings of the grammar, like grep; ``--invert`` prints the others and \
+        ``--count`` only their number.
+
+The grammar is compiled into a nondeterministic automaton over tokens, with \
+        one fragment per rule shared by all the places that use it. The \
+        automaton is made deterministic lazily: each set of automaton states \
+        met while reading sentences becomes a deterministic state, whose \
+        transitions are kept, so after a short warm-up each token costs one \
+        dictionary lookup and a sentence is recognized in time linear in its \
+        length. Rules may use themselves, directly or through other rules, \
+        at their end (right recursion), which keeps the language regular; \
+        other recursive rules are rejected.
+
+        ``recognizer = Recognizer(grammar)``
+
+        ``recognizer.matches('the idea can suffice')``
+
+        ``recognizer.matchAll(sentences)``
+"""
+
+import sys, argparse, itertools, threading
+import JSGFParser as parser
+import JSGFGrammar as gram
+import JSGFCache as cache
+
+
+#: Recursion limit while a recognizer is built; building recurses once per
+#: nesting level of the expressions of a rule
+RECURSION_LIMIT = 100000
+
+#: Default number of deterministic states kept by a Recognizer before they
+#: are dropped and built again as needed
+DEFAULT_MAX_STATES = 10000
+
+#: Number of sentences read at once by the command line
+BLOCK_SIZE = 10000
+
+class _State():
+    """
+    Deterministic state: the configurations of the automaton that have
+    token transitions, whether a configuration ends the start rule, and the
+    transitions found so far, from token to _State
+    """
+    __slots__ = ('configurations', 'accepting', 'transitions')
+
+    def __init__(self, configurations, accepting):
+        self.configurations = configurations
+        self.accepting = accepting
+        self.transitions = {}
+
+# state of the sentences that cannot be completed
+_DEAD = _State(frozenset(), False)
+
+class Recognizer():
+    """
+    Recognizer class, checks whether sentences are strings of some rules of a
+    grammar. A configuration of its automaton is a state and the stack of
+    states to return to at the end of the rules in progress; a rule used at
+    the end of another does not push anything, so right recursion needs no
+    stack. A recognizer can be shared by threads.
+
+    :param grammar: JSGFGrammar object
+    :param rules: list of Rule objects, grammar.publicRules by default
+    :param maxStates: number of deterministic states kept; past that, they \
+            are dropped and built again as sentences need them
+    :raises ValueError: if a rule uses itself other than at its end, or \
+            uses an undefined rule
+    """
+
+    def __init__(self, grammar, rules=None, maxStates=DEFAULT_MAX_STATES):
+        if rules is None:
+            rules = grammar.publicRules
+        self.grammar = grammar
+        self.maxStates = maxStates
+        # per automaton state: dictionary from token to target states or
+        # None, states reached without a token, and (rule number, state to
+        # return to) pairs of the rules used there
+        self.tokenEdges = []
+        self.epsilons = []
+        self.calls = []
+        self.ruleNames = []
+        self.ruleNumbers = {}
+        self.ruleStarts = []
+        self.ruleEnds = []
+        # state 0 starts and state 1 ends the strings of the rules
+        self._newState()
+        self._newState()
+        self.tokens = set()
+        self.pending = []
+        with parser.recursionLimit(RECURSION_LIMIT):
+            for rule in rules:
+                self._build(rule.rhs, 0, 1)
+            while self.pending:
+                number = self.pending.pop()
+                self._build(grammar[self.ruleNames[number]], self.ruleStarts[number],
+                            self.ruleEnds[number])
+        self.ends = bytearray(len(self.epsilons))
+        self.ends[1] = 1
+        for end in self.ruleEnds:
+            self.ends[end] = 1
+        self.tails = self._tails()
+        self._checkRecursion()
+        self.lock = threading.Lock()
+        self._reset()
+
+    def _newState(self):
+        self.tokenEdges.append(None)
+        self.epsilons.append([])
+        self.calls.append([])
+        return len(self.epsilons) - 1
+
+    def _ruleNumber(self, name):
+        number = self.ruleNumbers.get(name)
+        if number is None:
+            if name not in self.grammar:
+                raise ValueError('Rule not defined for ' + str(name))
+            number = self.ruleNumbers[name] = len(self.ruleNames)
+            self.ruleNames.append(name)
+            self.ruleStarts.append(self._newState())
+            self.ruleEnds.append(self._newState())
+            self.pending.append(number)
+        return number
+
+    def _build(self, expr, entry, exit):
+        # adds the paths of an expression from entry to exit; without
+        # repetition operators, alternatives can share their entry and exit
+        if isinstance(expr, str):
+            if expr:
+                edges = self.tokenEdges[entry]
+                if edges is None:
+                    edges = self.tokenEdges[entry] = {}
+                edges.setdefault(expr, []).append(exit)
+                self.tokens.add(expr)
+            else:
+                self.epsilons[entry].append(exit)
+        elif type(expr) is list:
+            if not expr:
+                self.epsilons[entry].append(exit)
+            for i, component in enumerate(expr):
+                target = exit if i == len(expr) - 1 else self._newState()
+                self._build(component, entry, target)
+                entry = target
+        elif isinstance(expr, gram.Disjunction):
+            for disjunct in expr.disjuncts:
+                if type(disjunct) is tuple:
+                    disjunct = disjunct[0]
+                self._build(disjunct, entry, exit)
+        elif isinstance(expr, gram.Optional):
+            self.epsilons[entry].append(exit)
+            self._build(expr.option, entry, exit)
+        elif isinstance(expr, gram.NonTerminal):
+            self.calls[entry].append((self._ruleNumber(expr.name), exit))
+        elif isinstance(expr, tuple):
+            self._build(expr[0], entry, exit)
+
+    def _tails(self):
+        """
+        :returns: bytearray marking the states from which only the end of \
+                their rule can be reached, without a token or a rule
+        """
+        tails = bytearray(self.ends)
+        # number of successors of each candidate state not yet known to be tails
+        remaining = [len(targets) for targets in self.epsilons]
+        predecessors = [[] for targets in self.epsilons]
+        for state, targets in enumerate(self.epsilons):
+            if self.ends[state] or self.tokenEdges[state] or self.calls[state]:
+                remaining[state] = -1
+            for target in targets:
+                predecessors[target].append(state)
+        work = [state for state in range(len(tails)) if tails[state]]
+        work.extend(state for state, count in enumerate(remaining) if count == 0)
+        for state in work:
+            tails[state] = 1
+        while work:
+            state = work.pop()
+            for predecessor in predecessors[state]:
+                if remaining[predecessor] > 0:
+                    remaining[predecessor] -= 1
+                    if remaining[predecessor] == 0:
+                        tails[predecessor] = 1
+                        work.append(predecessor)
+        return tails
+
+    def _checkRecursion(self):
+        # a rule that can use itself before its end needs an unbounded stack
+        ruleCalls = {name: set() for name in self.ruleNames}
+        pushes = []
+        for number, name in enumerate(self.ruleNames):
+            # the states of a rule are those reached from its start
+            seen = {self.ruleStarts[number]}
+            work = [self.ruleStarts[number]]
+            while work:
+                state = work.pop()
+                targets = list(self.epsilons[state])
+                if self.tokenEdges[state]:
+                    targets.extend(itertools.chain.from_iterable(self.tokenEdges[state].values()))
+                for callee, returnState in self.calls[state]:
+                    ruleCalls[name].add(self.ruleNames[callee])
+                    if not self.tails[returnState]:
+                        pushes.append((name, self.ruleNames[callee]))
+                    targets.append(returnState)
+                for target in targets:
+                    if target not in seen:
+                        seen.add(target)
+                        work.append(target)
+        groups = {}
+        for group in gram.ruleGroups(ruleCalls):
+            for name in group:
+                groups[name] = id(group)
+        for caller, callee in pushes:
+            if groups[caller] == groups[callee]:
+                raise ValueError('Rule %s uses itself before its end, through %s; its language may '
+                                 'not be regular' % (callee, caller))
+
+    def _closure(self, configurations):
+        """
+        :returns: (configurations reached without a token that have token \
+                transitions, whether one of them ends the start rule)
+        """
+        epsilons, calls, ends, tails = self.epsilons, self.calls, self.ends, self.tails
+        ruleStarts, tokenEdges = self.ruleStarts, self.tokenEdges
+        seen = set(configurations)
+        work = list(seen)
+        kernel = []
+        accepting = False
+        while work:
+            configuration = work.pop()
+            state, stack = configuration
+            if tokenEdges[state]:
+                kernel.append(configuration)
+            successors = [(target, stack) for target in epsilons[state]]
+            for callee, returnState in calls[state]:
+                successors.append((ruleStarts[callee], stack if tails[returnState] else (returnState, stack)))
+            if ends[state]:
+                if stack is None:
+                    accepting = True
+                else:
+                    successors.append(stack)
+            for successor in successors:
+                if successor not in seen:
+                    seen.add(successor)
+                    work.append(successor)
+        return frozenset(kernel), accepting
+
+    def _reset(self):
+        # called with the lock held, or before the recognizer is shared
+        self.states = {}
+        self.start = self._state(self._closure([(0, None)]))
+
+    def _state(self, closure):
+        configurations, accepting = closure
+        if not configurations and not accepting:
+            return _DEAD
+        # the kernel leaves out the ends of rules, so it does not tell
+        # whether the state accepts
+        state = self.states.get(closure)
+        if state is None:
+            state = self.states[closure] = _State(configurations, accepting)
+        return state
+
+    def _step(self, state, token):
+        """
+        :returns: the state reached from a state by a token, built if needed
+        """
+        if token not in self.tokens:
+            return _DEAD
+        with self.lock:
+            target = state.transitions.get(token)
+            if target is not None:
+                return target
+            tokenEdges = self.tokenEdges
+            moved = [(target, stack) for state_, stack in state.configurations
+                     for target in tokenEdges[state_].get(token, ())]
+            if len(self.states) >= self.maxStates:
+                # the states are dropped; those in use stay valid
+                self._reset()
+            target = self._state(self._closure(moved))
+            state.transitions[token] = target
+            return target
+
+    def numStates(self):
+        """
+        :returns: (number of states of the automaton, number of \
+                deterministic states built so far)
+        """
+        return len(self.epsilons), len(self.states)
+
+    def matches(self, sentence):
+        """
+        Tells whether a sentence is a string of the rules, in time linear in
+        its number of tokens once the states it goes through are built
+
+        :param sentence: string of tokens separated by white space, or list \
+                of tokens
+        :returns: True or False
+        """
+        if isinstance(sentence, str):
+            sentence = sentence.split()
+        state = self.start
+        for token in sentence:
+            target = state.transitions.get(token)
+            if target is None:
+                target = self._step(state, token)
+            if target is _DEAD:
+                return False
+            state = target
+        return state.accepting
+
+    def __contains__(self, sentence):
+        return self.matches(sentence)
+
+    def iterMatches(self, sentences):
+        """
+        Recognizes the sentences of a corpus one after the other
+
+        :param sentences: iterable of sentences, see :meth:`matches`
+        :returns: generator of True or False, one per sentence
+        """
+        step = self._step
+        for sentence in sentences:
+            if isinstance(sentence, str):
+                sentence = sentence.split()
+            # the start state changes when the states are dropped
+            state = self.start
+            for token in sentence:
+                target = state.transitions.get(token)
+                if target is None:
+                    target = step(state, token)
+                if target is _DEAD:
+                    state = _DEAD
+                    break
+                state = target
+            yield state.accepting
+
+    def matchAll(self, sentences):
+        """
+        :param sentences: iterable of sentences, see :meth:`matches`
+        :returns: list of True or False, one per sentence
+        """
+        return list(self.iterMatches(sentences))
+
+
+def main():
+    """Main function for command line usage"""
+    argParser = argparse.ArgumentParser(description='Print the lines that are strings of a JSGF grammar')
+    argParser.add_argument('grammarFile', help='Path to the JSGF grammar file')
+    argParser.add_argument('corpusFiles', nargs='*', metavar='corpusFile',
+                           help='Files of sentences, one per line; the standard input if none')
+    argParser.add_argument('--no-cache', dest='noCache', action='store_true',
+                           help='Parse the grammar file even if a cached copy exists')
+    argParser.add_argument('--invert', '-v', action='store_true',
+                           help='Print the lines that are not strings of the grammar')
+    argParser.add_argument('--count', '-c', action='store_true',
+                           help='Print the number of lines selected instead of the lines')
+
+    try:
+        args = argParser.parse_args()
+    except SystemExit:
+        return
+
+    try:
+        grammar = cache.loadGrammar(args.grammarFile, useCache=not args.noCache)
+        recognizer = Recognizer(grammar)
+        count = 0
+        for fileName in args.corpusFiles or ['-']:
+            corpus = sys.stdin if fileName == '-' else open(fileName)
+            try:
+                while True:
+                    block = [line.rstrip('\n') for line in itertools.islice(corpus, BLOCK_SIZE)]
+                    if not block:
+                        break
+                    selected = [line for line, match in zip(block, recognizer.iterMatches(block))
+                                if match != args.invert]
+                    count += len(selected)
+                    if not args.count:
+                        sys.stdout.write(''.join([line + '\n' for line in selected]))
+            finally:
+                if corpus is not sys.stdin:
+                    corpus.close()
+        if args.count:
+            print(count)
+    except FileNotFoundError as e:
+        print(f"Error: file '{e.filename}' not found")
+        sys.exit(1)
+    except Exception as e:
+        print(f"Error processing grammar: {e}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
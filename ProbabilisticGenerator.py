@@ -41,30 +41,67 @@ It requires two arguments: the path to the JSGF\
 
 This will generate 20 sentences based on the public rule(s) in Ideas.gram, using the \
 weights if they are provided.
+
+With recursive rules, a sentence only has a finite expected length if the weights \
+        make recursion unlikely enough (see :func:`expectedLengths`); a warning is \
+        printed otherwise. ``--max-depth`` and ``--max-length`` bound every \
+        derivation (see :func:`sample`).
 """
 
-import sys, itertools, random, bisect, argparse
-import JSGFParser as parser
+import sys, itertools, random, argparse, collections, concurrent.futures, hashlib, math, threading
 import JSGFGrammar as gram
+import JSGFCache as cache
+import JSGFCompiler as compiler
+import JSGFAsync
+
+
+#: Largest number of alias tables kept by weightedChoice; the tables are
+#: dropped all at once when it is reached
+WEIGHT_TABLE_LIMIT = 100000
 
+# id of a tuple of (element, weight) tuples -> (elements, probabilities,
+# aliases, tuple), the tuple is kept so that its id cannot be reused
+weightTables = {}
 
-def weightedChoice(listOfTuples):
+def weightTable(listOfTuples):
     """
-    Chooses an element of a list based on its weight
+    Returns the alias table of a list of weighted elements. Tables of tuples,
+    such as the disjuncts of a Disjunction, are built once and kept in
+    weightTables; tables of lists are built on every call, since lists can
+    change.
+
+    :returns: (elements, probabilities, aliases), see JSGFCompiler.buildAliasTable
+    """
+    if type(listOfTuples) is tuple:
+        table = weightTables.get(id(listOfTuples))
+        if table is not None:
+            return table
+    choices, weights = zip(*listOfTuples)
+    probabilities, aliases = compiler.buildAliasTable(weights)
+    table = (choices, probabilities, aliases, listOfTuples)
+    if type(listOfTuples) is tuple:
+        if len(weightTables) >= WEIGHT_TABLE_LIMIT:
+            weightTables.clear()
+        weightTables[id(listOfTuples)] = table
+    return table
+
+def weightedChoice(listOfTuples, rng=random):
+    """
+    Chooses an element of a list based on its weight, in constant time once
+    the alias table of the list is built (see :func:`weightTable`)
 
     :param listOfTuples: a list of (element, weight) tuples, where the element can be a JSGF expression object, string, or list,\
             and the weight is a float
+    :param rng: source of random numbers, the random module by default
     :returns: the first element of a chosen tuple
     """
-    def accum(listOfWeights): # support function for creating ranges for weights
-        for i in range(len(listOfWeights)):
-            if i > 0:
-                listOfWeights[i] += listOfWeights[i-1]
-        return listOfWeights
-    choices, weights = zip(*listOfTuples)
-    cumdist = accum(list(weights))
-    x = random.random() * cumdist[-1]
-    return choices[bisect.bisect(cumdist, x)]
+    choices, probabilities, aliases, _ = weightTable(listOfTuples)
+    count = len(choices)
+    x = rng.random() * count
+    choice = min(int(x), count - 1)
+    if x - choice >= probabilities[choice]:
+        choice = aliases[choice]
+    return choices[choice]
 
 def combineSets(listOfSets):
     """
@@ -87,82 +124,1035 @@ def processSequence(seq):
     """
     Combines adjacent elements in a sequence.
     """
-    componentSets = []
-    for component in seq:
-        expandedComponent = processRHS(component).strip()
-        if len(expandedComponent) > 0:
-            componentSets.append(expandedComponent)
-    return ' '.join(componentSets)
+    return _generator().processRHS(seq)
 
 
 def processNonTerminal(nt):
     """
     Finds the rule expansion for a nonterminal and returns its expansion.
     """
-    return processRHS(grammar.getRHS(nt))
+    return _generator().processRHS(nt)
 
 def processDisjunction(disj):
     """
     Chooses either a random disjunct (for alternatives without weights) or
     a disjunct based on defined weights. 
     """
-    if type(disj.disjuncts[0]) is tuple:
-        return processRHS(weightedChoice(disj.disjuncts))
-    else:
-        return processRHS(random.choice(disj.disjuncts))
+    return _generator().processRHS(disj)
 
 def processOptional(opt):
     """
     Processes the optional element 50% of the time, skips it the other 50% of the time
     """
-    rand = random.random()
-    if rand <= 0.5:
-        return ''
-    else:
-        return processRHS(opt.option)
+    return _generator().processRHS(opt)
 
 def processRHS(rhs):
-    if type(rhs) is list:
-        return processSequence(rhs)
+    """
+    :meth:`ProbabilisticGenerator.processRHS` for the module grammar, with
+    the random module as source of random numbers
+    """
+    return _generator().processRHS(rhs)
+
+INFINITY = float('inf')
+
+#: Number of derivations sample tries before giving up on the bounds
+DEFAULT_MAX_ATTEMPTS = 1000
+
+def sampleTokens(rhs, maxDepth=None, maxLength=None, rng=random):
+    """
+    :meth:`ProbabilisticGenerator.sampleTokens` for the module grammar
+    """
+    return _generator().sampleTokens(rhs, maxDepth, maxLength, rng)
+
+def sample(rhs, maxDepth=None, maxLength=None, maxAttempts=DEFAULT_MAX_ATTEMPTS, rng=random):
+    """
+    :meth:`ProbabilisticGenerator.sample` for the module grammar
+    """
+    return _generator().sample(rhs, maxDepth, maxLength, maxAttempts, rng)
+
+def expectedLengths():
+    """
+    :meth:`ProbabilisticGenerator.expectedLengths` for the module grammar
+    """
+    return _generator().expectedLengths()
+
+def divergentRules():
+    """
+    :meth:`ProbabilisticGenerator.divergentRules` for the module grammar
+    """
+    return _generator().divergentRules()
+
+def _expectedLength(rhs):
+    """
+    :returns: (expected tokens outside rules, dictionary from rule name to \
+              expected number of expansions) of an expression
+    """
+    if isinstance(rhs, str):
+        return (1.0 if rhs else 0.0), {}
+    elif type(rhs) is list:
+        return _combineLengths([(1.0, _expectedLength(component)) for component in rhs])
     elif isinstance(rhs, gram.Disjunction):
-        return processDisjunction(rhs)
+        if type(rhs.disjuncts[0]) is tuple:
+            weights = [weight for expr, weight in rhs.disjuncts]
+            disjuncts = [expr for expr, weight in rhs.disjuncts]
+        else:
+            weights = [1.0] * len(rhs.disjuncts)
+            disjuncts = rhs.disjuncts
+        total = float(sum(weights))
+        if total <= 0:
+            # all-zero weights are drawn as equal weights
+            weights, total = [1.0] * len(weights), float(len(weights))
+        return _combineLengths([(weight / total, _expectedLength(disjunct))
+                                for weight, disjunct in zip(weights, disjuncts)])
     elif isinstance(rhs, gram.Optional):
-        return processOptional(rhs)
+        return _combineLengths([(0.5, _expectedLength(rhs.option))])
     elif isinstance(rhs, gram.NonTerminal):
-        return processNonTerminal(rhs)
-    elif isinstance(rhs, str):
-        return rhs
+        return 0.0, {rhs.name: 1.0}
+    elif isinstance(rhs, tuple):
+        return _expectedLength(rhs[0])
+    return 0.0, {}
+
+def _combineLengths(scaledLengths):
+    constant = 0.0
+    calls = {}
+    for scale, (partConstant, partCalls) in scaledLengths:
+        constant += scale * partConstant
+        for name, coefficient in partCalls.items():
+            calls[name] = calls.get(name, 0.0) + scale * coefficient
+    return constant, calls
+
+def _expectedLengthOf(rhs, lengths):
+    constant, calls = _expectedLength(rhs)
+    for name, coefficient in calls.items():
+        if coefficient > 0:
+            constant += coefficient * lengths.get(name, 0.0)
+    return constant
+
+def _solveExpectedLengths(grammar):
+    """
+    :returns: dictionary from rule name to expected number of tokens, see \
+              ProbabilisticGenerator.expectedLengths
+    """
+    forms = {name: _expectedLength(rule.rhs) for name, rule in grammar.ruleIndex.items()}
+    lengths = {}
+    for group in gram.ruleGroups({name: form[1] for name, form in forms.items()}):
+        positions = {name: i for i, name in enumerate(group)}
+        size = len(group)
+        # (I - M) x = b, with a second right hand side of ones: the group
+        # converges if and only if that solution is non-negative
+        matrix = [[0.0] * size + [0.0, 1.0] for name in group]
+        for i, name in enumerate(group):
+            constant, calls = forms[name]
+            matrix[i][i] = 1.0
+            for callee, coefficient in calls.items():
+                if callee in positions:
+                    matrix[i][positions[callee]] -= coefficient
+                elif callee in lengths:
+                    constant += coefficient * lengths[callee]
+            matrix[i][size] = constant
+        solution = _solve(matrix, size)
+        converges = (solution is not None and all(x >= -1e-9 for x, y in solution)
+                     and all(y >= -1e-9 for x, y in solution))
+        for i, name in enumerate(group):
+            lengths[name] = max(solution[i][0], 0.0) if converges else INFINITY
+    return lengths
+
+def _solve(matrix, size):
+    """
+    Solves a linear system by Gauss-Jordan elimination with partial pivoting
+
+    :param matrix: rows of size coefficients followed by the values of two \
+            right hand sides; modified in place
+    :returns: list of (x, y) pairs, the solutions for both right hand \
+              sides, or None if the system is singular
+    """
+    for column in range(size):
+        pivot = max(range(column, size), key=lambda row: abs(matrix[row][column]))
+        if abs(matrix[pivot][column]) < 1e-12:
+            return None
+        matrix[column], matrix[pivot] = matrix[pivot], matrix[column]
+        pivotRow = matrix[column]
+        scale = pivotRow[column]
+        for j in range(column, size + 2):
+            pivotRow[j] /= scale
+        for row in range(size):
+            if row != column and matrix[row][column] != 0.0:
+                factor = matrix[row][column]
+                target = matrix[row]
+                for j in range(column, size + 2):
+                    target[j] -= factor * pivotRow[j]
+    return [(row[size], row[size + 1]) for row in matrix]
+
+def _calledRules(rhs):
+    """
+    :returns: set of the names of the rules an expression uses directly
+    """
+    names = set()
+    stack = [rhs]
+    while stack:
+        expr = stack.pop()
+        if type(expr) is list:
+            stack.extend(expr)
+        elif isinstance(expr, gram.Disjunction):
+            stack.extend(expr.disjuncts)
+        elif isinstance(expr, gram.Optional):
+            stack.append(expr.option)
+        elif isinstance(expr, gram.NonTerminal):
+            names.add(expr.name)
+        elif isinstance(expr, tuple):
+            stack.append(expr[0])
+    return names
+
+class UniformSampler():
+    """
+    UniformSampler class, draws the derivations of an expression uniformly:
+    every string of a finite language is equally likely, or with maxLength,
+    every string of at most maxLength tokens of any language. The weights of
+    the alternatives and the 50% chance of optional groups are ignored.
+    A string with several derivations is drawn once per derivation, as it
+    is counted by DeterministicGenerator.countExpansions.
+
+    The number of derivations of each rule, per length with maxLength, is
+    computed once when the sampler is built, and the numbers of the
+    subexpressions as they are first needed. A string is then drawn top
+    down without rejection, each alternative being chosen with probability
+    proportional to its number of derivations: the work per string is
+    proportional to its derivation, times maxLength to split the length of
+    sequences.
+
+    :param grammar: JSGFGrammar object
+    :param maxLength: largest number of tokens, or None for a finite language
+    :raises ValueError: if a rule of the grammar has infinitely many \
+            derivations of the same length, because it can reach itself \
+            without producing a token
+    """
+
+    def __init__(self, grammar, maxLength=None):
+        if maxLength is not None and maxLength < 0:
+            raise ValueError('The maximum length must not be negative')
+        self.grammar = grammar
+        self.maxLength = maxLength
+        # rule name -> number of derivations, or list of numbers per length
+        self.ruleCounts = {}
+        # id of an expression -> (number of derivations, expression), the
+        # expression is kept so that its id cannot be reused
+        self.counts = {}
+        # (id of a sequence, start) -> (numbers of derivations per length of
+        # its components from start on, sequence)
+        self.suffixes = {}
+        calls = {name: _calledRules(rule.rhs) for name, rule in grammar.ruleIndex.items()}
+        for group in gram.ruleGroups(calls):
+            if len(group) == 1 and group[0] not in calls[group[0]]:
+                name = group[0]
+                self.ruleCounts[name] = self._evaluate(grammar.ruleIndex[name].rhs, {})
+            elif maxLength is None:
+                for name in group:
+                    self.ruleCounts[name] = INFINITY
+            else:
+                self._solveGroup(group)
+
+    def _solveGroup(self, group):
+        # the numbers of derivations of each length only grow as the
+        # derivations get deeper; without a cycle of rules that produce no
+        # token, they stop growing after a pass per length and per rule
+        for name in group:
+            self.ruleCounts[name] = [0] * (self.maxLength + 1)
+        for iteration in range((self.maxLength + 1) * (len(group) + 1) + 1):
+            memo = {}
+            changed = False
+            for name in group:
+                counts = self._evaluate(self.grammar.ruleIndex[name].rhs, memo)
+                if counts != self.ruleCounts[name]:
+                    self.ruleCounts[name] = counts
+                    changed = True
+            if not changed:
+                return
+        raise ValueError('Rule %s has infinitely many derivations of the same length' % group[0])
+
+    def _evaluate(self, expr, memo):
+        # numbers of derivations of an expression from the current numbers
+        # of the rules, memo keeps those of shared subexpressions
+        key = id(expr)
+        if key in memo:
+            return memo[key][0]
+        maxLength = self.maxLength
+        if isinstance(expr, str):
+            length = 1 if expr else 0
+            if maxLength is None:
+                counts = 1
+            else:
+                counts = [0] * (maxLength + 1)
+                if length <= maxLength:
+                    counts[length] = 1
+        elif type(expr) is list:
+            counts = 1 if maxLength is None else [1] + [0] * maxLength
+            for component in expr:
+                counts = self._product(counts, self._evaluate(component, memo))
+        elif isinstance(expr, gram.Disjunction):
+            counts = 0 if maxLength is None else [0] * (maxLength + 1)
+            for disjunct in expr.disjuncts:
+                counts = self._sum(counts, self._evaluate(disjunct, memo))
+        elif isinstance(expr, gram.Optional):
+            empty = 1 if maxLength is None else [1] + [0] * maxLength
+            counts = self._sum(empty, self._evaluate(expr.option, memo))
+        elif isinstance(expr, gram.NonTerminal):
+            # undefined rules have no derivation
+            counts = self.ruleCounts.get(expr.name, 0 if maxLength is None else [0] * (maxLength + 1))
+        elif isinstance(expr, tuple):
+            counts = self._evaluate(expr[0], memo)
+        else:
+            counts = 0 if maxLength is None else [0] * (maxLength + 1)
+        memo[key] = (counts, expr)
+        return counts
+
+    def _sum(self, first, second):
+        if self.maxLength is None:
+            return first + second
+        return [x + y for x, y in zip(first, second)]
+
+    def _product(self, first, second):
+        if self.maxLength is None:
+            if first == 0 or second == 0:
+                return 0
+            return first * second
+        counts = [0] * (self.maxLength + 1)
+        for i, x in enumerate(first):
+            if x:
+                for j in range(self.maxLength + 1 - i):
+                    if second[j]:
+                        counts[i + j] += x * second[j]
+        return counts
+
+    def count(self, rhs):
+        """
+        :param rhs: portion of JSGF rule
+        :returns: number of derivations of the expression, of at most \
+                maxLength tokens if maxLength was given; INFINITY if it is \
+                recursive and maxLength was not given
+        """
+        counts = self._evaluate(rhs, self.counts)
+        return counts if self.maxLength is None else sum(counts)
+
+    def _suffix(self, seq, start):
+        key = (id(seq), start)
+        entry = self.suffixes.get(key)
+        if entry is None:
+            counts = [1] + [0] * self.maxLength
+            for component in seq[start:]:
+                counts = self._product(counts, self._evaluate(component, self.counts))
+            entry = self.suffixes[key] = (counts, seq)
+        return entry[0]
+
+    @staticmethod
+    def _choose(weights, rng):
+        # index drawn with probability proportional to an integer weight
+        r = rng.randrange(sum(weights))
+        for i, weight in enumerate(weights):
+            if r < weight:
+                return i
+            r -= weight
+
+    def sampleTokens(self, rhs, rng=random):
+        """
+        Draws one derivation of an expression uniformly, with an explicit
+        stack
+
+        :param rhs: portion of JSGF rule
+        :param rng: source of random numbers, the random module by default
+        :returns: list of tokens
+        :raises ValueError: if the expression has no derivation, or \
+                infinitely many and maxLength was not given
+        """
+        total = self.count(rhs)
+        if total == INFINITY:
+            raise ValueError('The expression is recursive; give a maximum length')
+        if total == 0:
+            raise ValueError('The expression has no derivation within the maximum length')
+        if self.maxLength is None:
+            return self._sampleFinite(rhs, rng)
+        return self._sampleBounded(rhs, rng)
+
+    def _sampleFinite(self, rhs, rng):
+        counts = self.counts
+        tokens = []
+        stack = [rhs]
+        while stack:
+            expr = stack.pop()
+            if isinstance(expr, str):
+                if expr:
+                    tokens.append(expr)
+            elif type(expr) is list:
+                # the derivations of a sequence are the combinations of
+                # those of its components, which are drawn independently
+                stack.extend(reversed(expr))
+            elif isinstance(expr, gram.Disjunction):
+                weights = [self._evaluate(disjunct, counts) for disjunct in expr.disjuncts]
+                stack.append(expr.disjuncts[self._choose(weights, rng)])
+            elif isinstance(expr, gram.Optional):
+                if rng.randrange(1 + self._evaluate(expr.option, counts)):
+                    stack.append(expr.option)
+            elif isinstance(expr, gram.NonTerminal):
+                stack.append(self.grammar.getRHS(expr))
+            elif isinstance(expr, tuple):
+                stack.append(expr[0])
+        return tokens
+
+    def _sampleBounded(self, rhs, rng):
+        counts = self.counts
+        tokens = []
+        # (expression, exact number of tokens, first component of a sequence)
+        stack = [(rhs, self._choose(self._evaluate(rhs, counts), rng), 0)]
+        while stack:
+            expr, length, start = stack.pop()
+            if isinstance(expr, str):
+                if expr:
+                    tokens.append(expr)
+            elif type(expr) is list:
+                if start == len(expr):
+                    continue
+                first = self._evaluate(expr[start], counts)
+                rest = self._suffix(expr, start + 1)
+                split = self._choose([first[i] * rest[length - i] for i in range(length + 1)], rng)
+                stack.append((expr, length - split, start + 1))
+                stack.append((expr[start], split, 0))
+            elif isinstance(expr, gram.Disjunction):
+                weights = [self._evaluate(disjunct, counts)[length] for disjunct in expr.disjuncts]
+                stack.append((expr.disjuncts[self._choose(weights, rng)], length, 0))
+            elif isinstance(expr, gram.Optional):
+                empty = 1 if length == 0 else 0
+                if self._choose([empty, self._evaluate(expr.option, counts)[length]], rng):
+                    stack.append((expr.option, length, 0))
+            elif isinstance(expr, gram.NonTerminal):
+                stack.append((self.grammar.getRHS(expr), length, 0))
+            elif isinstance(expr, tuple):
+                stack.append((expr[0], length, 0))
+        return tokens
+
+    def sample(self, rhs, rng=random):
+        """
+        Generates a string from an expression, uniformly among its
+        derivations, see :meth:`sampleTokens`
+
+        :returns: string
+        """
+        return ' '.join(self.sampleTokens(rhs, rng))
+
+#: Number of sentences generated together, with their own random numbers,
+#: see :func:`sampleBatch`
+SAMPLE_BATCH_SIZE = 10000
+
+def startExpression(grammar):
+    """
+    Returns the expression main samples from: the public rule, or a
+    disjunction of the public rules if there are several, each then equally
+    likely
+    """
+    if len(grammar.publicRules) > 1:
+        return gram.Disjunction([rule.rhs for rule in grammar.publicRules])
+    return grammar.publicRules[0].rhs
+
+def startNode(program, grammar):
+    """
+    Returns the node of :func:`startExpression` in a compiled grammar
+
+    :param program: JSGFCompiler.Program of the grammar
+    """
+    if len(grammar.publicRules) > 1:
+        return program.compileExpression(startExpression(grammar))
+    return program.publicRoots[0]
+
+def chunkRandom(seed, index):
+    """
+    Returns the random number generator of a chunk of a seeded run. The
+    stream of each chunk is derived from the seed and the chunk number
+    alone, so chunks can be sampled in any order and in any process and
+    still give the same strings.
+
+    :param seed: integer seed of the run
+    :param index: number of the chunk
+    :returns: random.Random object
+    """
+    # string seeds are hashed with SHA-512, independently of PYTHONHASHSEED
+    return random.Random('%d:%d' % (seed, index))
+
+def splitSamples(n, chunkSize=SAMPLE_BATCH_SIZE):
+    """
+    Splits n strings into chunks of at most chunkSize strings
+
+    :param n: number of strings, or None for chunks without end
+    :returns: generator of (chunk number, number of strings) pairs, in order
+    """
+    if n is None:
+        for index in itertools.count():
+            yield index, chunkSize
+        return
+    for index, first in enumerate(range(0, n, chunkSize)):
+        yield index, min(chunkSize, n - first)
+
+def newSeed():
+    """
+    Returns a seed for a run that is not given one
+    """
+    return random.SystemRandom().getrandbits(64)
+
+def sampleBatch(grammar, n, seed=None):
+    """
+    Generates n random strings from the public rules of a grammar in batches.
+    Each node of the compiled grammar is visited once per batch rather than
+    once per string, and its random choices are drawn for the whole batch
+    (see JSGFCompiler.Program.sampleBatchIds). Strings are distributed as
+    with processRHS.
+
+    :param grammar: JSGFGrammar object
+    :param n: number of strings
+    :param seed: integer seed; the same seed gives the same strings, which \
+            are also those of ``ProbabilisticGenerator.py --seed``
+    :returns: list of strings
+    """
+    if seed is None:
+        seed = newSeed()
+    return ProbabilisticGenerator(grammar).sampleBatch(n, seed)
+
+class ProbabilisticGenerator():
+    """
+    ProbabilisticGenerator class, generates random strings from a grammar.
+    It owns the grammar, a random number generator, and the compiled
+    program, expected lengths and uniform samplers of the grammar, which are
+    built when first needed and kept until the grammar is modified with
+    JSGFGrammar.Grammar.replaceRule. A generator can be shared by threads.
+    Threads then draw from the same random number generator, so their
+    strings depend on each other's draws; give each call its own rng or
+    seed for strings that can be reproduced.
+
+    :param grammar: JSGFGrammar object
+    :param seed: seed of the random number generator
+    :param rng: source of random numbers, instead of random.Random(seed)
+    """
+
+    def __init__(self, grammar, seed=None, rng=None):
+        self.grammar = grammar
+        self.rng = random.Random(seed) if rng is None else rng
+        self.lock = threading.Lock()
+        self.generation = grammar.generation
+        self.program = None
+        self.start = None
+        self.lengths = None
+        # maximum length -> (UniformSampler, start expression)
+        self.uniformSamplers = {}
+
+    def _checkGeneration(self):
+        # called with the lock held
+        if self.generation != self.grammar.generation:
+            self.program = self.start = self.lengths = None
+            self.uniformSamplers = {}
+            self.generation = self.grammar.generation
+
+    def compiled(self):
+        """
+        :returns: (JSGFCompiler.Program of the grammar, node of \
+                :func:`startExpression` in it)
+        """
+        with self.lock:
+            self._checkGeneration()
+            if self.program is None:
+                program = compiler.compileGrammar(self.grammar)
+                self.start = startNode(program, self.grammar)
+                self.program = program
+            return self.program, self.start
+
+    def processRHS(self, rhs):
+        """
+        Generates a random string from an expression. The expression is
+        walked with an explicit stack (see :meth:`sampleTokens`), so deep or
+        recursive grammars do not exhaust the interpreter stack.
+
+        :param rhs: portion of JSGF rule
+        :returns: string
+        """
+        return ' '.join(self.sampleTokens(rhs))
+
+    def sampleTokens(self, rhs, maxDepth=None, maxLength=None, rng=None):
+        """
+        Draws one derivation of an expression with an explicit stack,
+        expanding its parts from left to right.
+
+        :param rhs: portion of JSGF rule
+        :param maxDepth: largest number of nested rules in the derivation, \
+                unbounded if None; the expression itself is at depth 0
+        :param maxLength: largest number of tokens, unbounded if None
+        :param rng: source of random numbers, the generator's if None
+        :returns: list of tokens, or None as soon as the derivation exceeds a bound
+        """
+        if rng is None:
+            rng = self.rng
+        if maxDepth is None:
+            maxDepth = INFINITY
+        if maxLength is None:
+            maxLength = INFINITY
+        getRHS = self.grammar.getRHS
+        tokens = []
+        stack = [(rhs, 0)]
+        push, pop = stack.append, stack.pop
+        while stack:
+            expr, depth = pop()
+            if isinstance(expr, str):
+                if expr:
+                    if len(tokens) >= maxLength:
+                        return None
+                    tokens.append(expr)
+            elif type(expr) is list:
+                stack.extend([(component, depth) for component in reversed(expr)])
+            elif isinstance(expr, gram.Disjunction):
+                if type(expr.disjuncts[0]) is tuple:
+                    push((weightedChoice(expr.disjuncts, rng), depth))
+                else:
+                    push((rng.choice(expr.disjuncts), depth))
+            elif isinstance(expr, gram.Optional):
+                if rng.random() > 0.5:
+                    push((expr.option, depth))
+            elif isinstance(expr, gram.NonTerminal):
+                if depth >= maxDepth:
+                    return None
+                push((getRHS(expr), depth + 1))
+            elif isinstance(expr, tuple):
+                push((expr[0], depth))
+        return tokens
+
+    def sample(self, rhs, maxDepth=None, maxLength=None, maxAttempts=DEFAULT_MAX_ATTEMPTS, rng=None):
+        """
+        Generates a random string from an expression within bounds.
+        Derivations that exceed a bound are abandoned as soon as they do and
+        drawn again, so the strings follow the distribution of processRHS
+        restricted to the strings within the bounds, and the time spent on
+        each string is at most maxAttempts derivations of bounded size. With
+        maxLength alone, a rule that can reach itself without producing a
+        token may still take long to finish; give maxDepth too.
+
+        :param rhs: portion of JSGF rule
+        :param maxDepth: largest number of nested rules in the derivation, unbounded if None
+        :param maxLength: largest number of tokens, unbounded if None
+        :param maxAttempts: number of derivations to draw before giving up
+        :param rng: source of random numbers, the generator's if None
+        :returns: string
+        :raises ValueError: if no derivation within the bounds was drawn
+        """
+        for attempt in range(maxAttempts):
+            tokens = self.sampleTokens(rhs, maxDepth, maxLength, rng)
+            if tokens is not None:
+                return ' '.join(tokens)
+        raise ValueError('No string within the bounds after %d attempts' % maxAttempts)
+
+    def expectedLengths(self):
+        """
+        Computes the expected number of tokens each rule of the grammar
+        produces, from the weights of its alternatives and the 50% chance of
+        its optional groups. The expectations are the solution of a linear
+        system, solved one group of mutually recursive rules at a time. A
+        group whose rules call each other on average at least once per
+        expansion never finishes expanding on average: the grammar is
+        divergent.
+
+        :returns: dictionary from rule name to expected number of tokens, \
+                INFINITY for rules of divergent groups or using them
+        """
+        with self.lock:
+            self._checkGeneration()
+            if self.lengths is None:
+                self.lengths = _solveExpectedLengths(self.grammar)
+            return dict(self.lengths)
+
+    def divergentRules(self):
+        """
+        :returns: names of the public rules whose expected length is \
+                infinite, see :meth:`expectedLengths`
+        """
+        lengths = self.expectedLengths()
+        return [gram.ruleName(rule.lhs) for rule in self.grammar.publicRules
+                if _expectedLengthOf(rule.rhs, lengths) == INFINITY]
+
+    def uniformSampler(self, maxLength=None):
+        """
+        :returns: the UniformSampler of the grammar for a maximum length, \
+                built on first use
+        """
+        return self._uniformStart(maxLength)[0]
+
+    def _uniformStart(self, maxLength):
+        with self.lock:
+            self._checkGeneration()
+            entry = self.uniformSamplers.get(maxLength)
+            if entry is None:
+                entry = self.uniformSamplers[maxLength] = (UniformSampler(self.grammar, maxLength),
+                                                           startExpression(self.grammar))
+            return entry
+
+    def sampleBatch(self, n, seed=None):
+        """
+        Generates n random strings from the public rules in batches, see
+        :func:`sampleBatch`
+
+        :param n: number of strings
+        :param seed: integer seed, drawn from the generator's random numbers \
+                if None
+        :returns: list of strings
+        """
+        if seed is None:
+            seed = self.rng.getrandbits(64)
+        program, start = self.compiled()
+        strings = []
+        for index, size in splitSamples(n):
+            strings.extend(program.sampleBatch(start, size, chunkRandom(seed, index)))
+        return strings
+
+    def _sampleChunk(self, task):
+        index, size, seed, ids, maxDepth, maxLength, uniform = task
+        rng = chunkRandom(seed, index)
+        if uniform:
+            sampler, rhs = self._uniformStart(maxLength)
+            lines = [sampler.sample(rhs, rng) for i in range(size)]
+        elif maxDepth is not None or maxLength is not None:
+            # the compiled program does not keep track of rule nesting
+            rhs = startExpression(self.grammar)
+            lines = [self.sample(rhs, maxDepth, maxLength, rng=rng) for i in range(size)]
+        if uniform or maxDepth is not None or maxLength is not None:
+            if ids:
+                vocabulary = self.grammar.vocabulary
+                lines = [' '.join([str(vocabulary[token]) for token in line.split()]) for line in lines]
+            return ''.join([line + '\n' for line in lines])
+        program, start = self.compiled()
+        batch = program.sampleBatchIds(start, size, rng)
+        if ids:
+            lines = [' '.join(map(str, tokenIds)) for tokenIds in batch]
+        else:
+            lines = [program.vocabulary.detokenize(tokenIds) for tokenIds in batch]
+        return ''.join([line + '\n' for line in lines])
+
+    def iterSamples(self, n, seed=None, ids=False, workers=1, chunkSize=SAMPLE_BATCH_SIZE, maxDepth=None,
+                    maxLength=None, uniform=False):
+        """
+        Generates random strings from the public rules of the grammar, chunk
+        by chunk, in this process or in a pool of worker processes. Each
+        chunk has its own random numbers (see :func:`chunkRandom`), so the
+        output only depends on the seed and the chunk size, not on the number
+        of workers. The text of the chunks comes back in order; only a few
+        chunks per worker are in flight at any time.
+
+        :param n: number of strings, or None to generate them until the \
+                generator is closed
+        :param seed: integer seed, drawn from the generator's random numbers \
+                if None
+        :param ids: if True, the strings are written as token numbers
+        :param workers: number of worker processes, 1 to sample in this process
+        :param maxDepth: largest number of nested rules, see :meth:`sample`
+        :param maxLength: largest number of tokens, see :meth:`sample`
+        :param uniform: if True, draw the derivations uniformly, with at most \
+                maxLength tokens, see :class:`UniformSampler`
+        :returns: generator of blocks of text, one string per line
+        """
+        if seed is None:
+            seed = self.rng.getrandbits(64)
+        tasks = ((index, size, seed, ids, maxDepth, maxLength, uniform) for index, size in splitSamples(n, chunkSize))
+        if workers <= 1:
+            for task in tasks:
+                yield self._sampleChunk(task)
+            return
+        with concurrent.futures.ProcessPoolExecutor(workers, initializer=_initWorker,
+                                                    initargs=(self.grammar,)) as pool:
+            pending = collections.deque()
+            for task in tasks:
+                pending.append(pool.submit(_sampleWorkerChunk, task))
+                if len(pending) >= 4 * workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def aiterSamples(self, n, seed=None, maxDepth=None, maxLength=None, uniform=False,
+                     blockSize=JSGFAsync.DEFAULT_BLOCK_SIZE, executor=None):
+        """
+        Streams the strings of :meth:`iterSamples` to an asyncio consumer;
+        the same seed gives the same strings. They are generated in blocks
+        in a thread, so the event loop is not blocked.
+
+        :param blockSize: number of strings generated per step
+        :param executor: concurrent.futures executor generating the blocks, \
+                the default executor of the loop if None
+        :returns: asynchronous generator of strings, see JSGFAsync.iterateAsync
+        """
+        texts = self.iterSamples(n, seed, maxDepth=maxDepth, maxLength=maxLength, uniform=uniform)
+        return JSGFAsync.iterateAsync(_iterLines(texts), blockSize, executor)
+
+def _iterLines(texts):
+    try:
+        for text in texts:
+            yield from text.splitlines()
+    finally:
+        texts.close()
+
+# generator of the module level functions, which are kept for existing
+# callers; it is rebuilt when grammar is reassigned
+_moduleGenerator = None
+
+def _generator():
+    global _moduleGenerator
+    generator = _moduleGenerator
+    if generator is None or generator.grammar is not grammar:
+        generator = _moduleGenerator = ProbabilisticGenerator(grammar, rng=random)
+    return generator
+
+def _initWorker(workerGrammar):
+    global workerGenerator
+    workerGenerator = ProbabilisticGenerator(workerGrammar)
+    workerGenerator.compiled()
+
+def _sampleWorkerChunk(task):
+    return workerGenerator._sampleChunk(task)
+
+def iterSamples(n, seed, ids=False, workers=1, chunkSize=SAMPLE_BATCH_SIZE, maxDepth=None, maxLength=None,
+                uniform=False):
+    """
+    :meth:`ProbabilisticGenerator.iterSamples` for the module grammar
+    """
+    return _generator().iterSamples(n, seed, ids, workers, chunkSize, maxDepth, maxLength, uniform)
+
+#: Default memory for the exact set of sentences seen by iterUniqueSamples
+DEFAULT_UNIQUE_MEMORY = 256 * 1024 * 1024
+#: Estimated bytes a set uses per string, besides the string itself
+SET_ENTRY_SIZE = 40
+#: Default false positive rate of the Bloom filter of iterUniqueSamples
+DEFAULT_ERROR_RATE = 0.001
+#: Default number of draws in a row without a new sentence after which
+#: iterUniqueSamples stops
+DEFAULT_PATIENCE = 100000
+
+class ScalableBloomFilter():
+    """
+    ScalableBloomFilter class, a set of strings that may wrongly claim to
+    hold a string it does not, with a false positive rate of at most
+    errorRate, in a few bits per string. It is a series of Bloom filters:
+    when one is full, a new one twice as large, with half the error rate, is
+    added, so the number of strings does not need to be known in advance.
+    """
+
+    def __init__(self, initialCapacity=1 << 16, errorRate=DEFAULT_ERROR_RATE):
+        if not 0 < errorRate < 1:
+            raise ValueError('The error rate must be between 0 and 1')
+        self.initialCapacity = initialCapacity
+        self.errorRate = errorRate
+        # (bits, number of bits, number of hashes, capacity, strings added)
+        self.filters = []
+        self.count = 0
+
+    def _addFilter(self):
+        number = len(self.filters)
+        capacity = self.initialCapacity << number
+        # the error rates of the filters add up to less than errorRate
+        errorRate = self.errorRate / 2 ** (number + 1)
+        numBits = max(8, int(math.ceil(-capacity * math.log(errorRate) / math.log(2) ** 2)))
+        numHashes = max(1, int(round(numBits / capacity * math.log(2))))
+        self.filters.append([bytearray((numBits + 7) // 8), numBits, numHashes, capacity, 0])
+
+    @staticmethod
+    def _hashes(string):
+        digest = hashlib.blake2b(string.encode('utf-8'), digest_size=16).digest()
+        return int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+
+    def __contains__(self, string):
+        first, step = self._hashes(string)
+        return any(self._filterContains(entry, first, step) for entry in self.filters)
+
+    @staticmethod
+    def _filterContains(entry, first, step):
+        bits, numBits, numHashes = entry[0], entry[1], entry[2]
+        for i in range(numHashes):
+            position = (first + i * step) % numBits
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def add(self, string):
+        """
+        Adds a string
+
+        :returns: True if the string was not in the filter, False if it \
+                was or is a false positive
+        """
+        first, step = self._hashes(string)
+        if any(self._filterContains(entry, first, step) for entry in self.filters):
+            return False
+        if not self.filters or self.filters[-1][4] >= self.filters[-1][3]:
+            self._addFilter()
+        entry = self.filters[-1]
+        bits, numBits, numHashes = entry[0], entry[1], entry[2]
+        for i in range(numHashes):
+            position = (first + i * step) % numBits
+            bits[position >> 3] |= 1 << (position & 7)
+        entry[4] += 1
+        self.count += 1
+        return True
+
+    def __len__(self):
+        return self.count
+
+    def size(self):
+        """
+        :returns: bytes used by the bits of the filters
+        """
+        return sum(len(entry[0]) for entry in self.filters)
+
+def iterUniqueSamples(lines, n=None, maxMemory=DEFAULT_UNIQUE_MEMORY, errorRate=DEFAULT_ERROR_RATE,
+                      patience=DEFAULT_PATIENCE, statistics=None):
+    """
+    Yields the strings of a stream of random strings that were not seen
+    before. They are kept in a set until it reaches maxMemory, then in a
+    ScalableBloomFilter, which may drop a new string as already seen with
+    probability errorRate. The stream stops after n strings, or once
+    patience strings in a row were all seen before: the probability that
+    the next string is new is then below 3 / patience with 95% confidence,
+    as no success in patience trials is unlikely above that rate.
+
+    :param lines: iterable of strings, such as the lines of :func:`iterSamples`
+    :param n: number of distinct strings wanted, no limit if None
+    :param maxMemory: estimated bytes the set of strings may use
+    :param errorRate: false positive rate of the Bloom filter
+    :param patience: number of strings in a row without a new one after \
+            which the language is deemed exhausted
+    :param statistics: dictionary filled with the numbers of strings drawn \
+            ('drawn'), distinct strings yielded ('unique') and strings \
+            dropped ('duplicates'), whether the Bloom filter was used \
+            ('bloom') and whether the stream stopped for lack of new \
+            strings ('exhausted'). The counts are kept up to date, so they \
+            are right if the consumer stops early.
+    :returns: generator of strings
+    :raises ValueError: if maxMemory or patience is not positive
+    """
+    if maxMemory <= 0:
+        raise ValueError('The memory budget must be positive')
+    if patience <= 0:
+        raise ValueError('The patience must be positive')
+    if statistics is None:
+        statistics = {}
+    statistics.update(drawn=0, unique=0, duplicates=0, bloom=False, exhausted=False)
+    if n == 0:
+        return
+    seen = set()
+    size = 0
+    bloom = None
+    sinceNew = 0
+    for line in lines:
+        statistics['drawn'] += 1
+        if bloom is None:
+            new = line not in seen
+            if new:
+                seen.add(line)
+                size += sys.getsizeof(line) + SET_ENTRY_SIZE
+                if size > maxMemory:
+                    bloom = ScalableBloomFilter(2 * len(seen), errorRate)
+                    for string in seen:
+                        bloom.add(string)
+                    seen = None
+                    statistics['bloom'] = True
+        else:
+            new = bloom.add(line)
+        if not new:
+            statistics['duplicates'] += 1
+            sinceNew += 1
+            if sinceNew >= patience:
+                statistics['exhausted'] = True
+                return
+            continue
+        sinceNew = 0
+        statistics['unique'] += 1
+        yield line
+        if statistics['unique'] == n:
+            return
+
+def formatUniqueStatistics(statistics, patience=DEFAULT_PATIENCE):
+    """
+    :returns: one line summing up the statistics of :func:`iterUniqueSamples`
+    """
+    line = ('drawn=%d unique=%d acceptance=%.1f%% filter=%s'
+            % (statistics['drawn'], statistics['unique'],
+               100.0 * statistics['unique'] / max(statistics['drawn'], 1),
+               'bloom' if statistics['bloom'] else 'set'))
+    if statistics['exhausted']:
+        line += ' exhausted (new string probability < %.2g)' % (3.0 / patience)
+    return line
 
 
 def main():
     """Main function for command line usage"""
-    global grammar
-
     argParser = argparse.ArgumentParser(description='Generate random strings from a JSGF grammar')
     argParser.add_argument('grammarFile', help='Path to the JSGF grammar file')
     argParser.add_argument('iterations', type=int, help='Number of strings to generate')
+    argParser.add_argument('--no-cache', dest='noCache', action='store_true',
+                           help='Parse the grammar file even if a cached copy exists')
+    argParser.add_argument('--ids', action='store_true',
+                           help='Print sentences as token numbers instead of text')
+    argParser.add_argument('--vocabulary', metavar='FILE',
+                           help='Write the tokens to FILE, one per line, in token number order')
+    argParser.add_argument('--seed', type=int,
+                           help='Seed of the random numbers; the same seed gives the same strings '
+                                'whatever the number of workers')
+    argParser.add_argument('--workers', type=int, default=1,
+                           help='Generate the strings in this many processes')
+    argParser.add_argument('--max-depth', dest='maxDepth', type=int,
+                           help='Draw again derivations that nest rules more deeply than this')
+    argParser.add_argument('--max-length', dest='maxLength', type=int,
+                           help='Draw again derivations of more than this many tokens')
+    argParser.add_argument('--uniform', action='store_true',
+                           help='Draw every string of the language equally often, ignoring the weights; '
+                                'recursive grammars need --max-length')
+    argParser.add_argument('--unique', action='store_true',
+                           help='Print only strings not printed before, up to the number asked for; '
+                                'statistics go to stderr')
+    argParser.add_argument('--unique-memory', dest='uniqueMemory', type=int,
+                           default=DEFAULT_UNIQUE_MEMORY // (1024 * 1024), metavar='MB',
+                           help='With --unique, memory for the exact set of strings seen before '
+                                'a Bloom filter takes over, in megabytes')
+    argParser.add_argument('--error-rate', dest='errorRate', type=float, default=DEFAULT_ERROR_RATE,
+                           help='With --unique, probability that the Bloom filter drops a new string')
+    argParser.add_argument('--patience', type=int, default=DEFAULT_PATIENCE,
+                           help='With --unique, stop after this many strings in a row were all '
+                                'seen before')
 
     try:
         args = argParser.parse_args()
     except SystemExit:
         return
+    if args.uniform and args.maxDepth is not None:
+        argParser.error('--max-depth cannot be used with --uniform')
 
     try:
-        with open(args.grammarFile, 'r') as fileStream:
-            grammar = parser.getGrammarObject(fileStream)
-
-            if len(grammar.publicRules) > 1:
-                # Multiple public rules - create a disjunction of all of them
-                disjuncts = [rule.rhs for rule in grammar.publicRules]
-                newStartSymbol = gram.Disjunction(disjuncts)
-                for i in range(args.iterations):
-                    print(processRHS(newStartSymbol))
-            else:
-                # Single public rule
-                startSymbol = grammar.publicRules[0]
-                for i in range(args.iterations):
-                    expansions = processRHS(startSymbol.rhs)
-                    print(expansions)
+        grammar = cache.loadGrammar(args.grammarFile, useCache=not args.noCache)
+        generator = ProbabilisticGenerator(grammar)
+        if args.vocabulary:
+            with open(args.vocabulary, 'w') as vocabularyFile:
+                grammar.vocabulary.write(vocabularyFile)
+
+        if not args.uniform and args.maxDepth is None and args.maxLength is None:
+            for name in generator.divergentRules():
+                print('Warning: the expected length of %s is infinite, so sampling may not finish; '
+                      'pass --max-depth or --max-length' % name, file=sys.stderr)
+        seed = newSeed() if args.seed is None else args.seed
+        if args.unique:
+            statistics = {}
+            texts = generator.iterSamples(None, seed, args.ids, args.workers,
+                                maxDepth=args.maxDepth, maxLength=args.maxLength, uniform=args.uniform)
+            lines = (line for text in texts for line in text.splitlines())
+            unique = iterUniqueSamples(lines, args.iterations, args.uniqueMemory * 1024 * 1024,
+                                       args.errorRate, args.patience, statistics)
+            while True:
+                block = list(itertools.islice(unique, SAMPLE_BATCH_SIZE))
+                if not block:
+                    break
+                sys.stdout.write(''.join([line + '\n' for line in block]))
+            texts.close()
+            print(formatUniqueStatistics(statistics, args.patience), file=sys.stderr)
+        else:
+            for text in generator.iterSamples(args.iterations, seed, args.ids, args.workers,
+                                              maxDepth=args.maxDepth, maxLength=args.maxLength,
+                                              uniform=args.uniform):
+                sys.stdout.write(text)
     except FileNotFoundError:
         print(f"Error: Grammar file '{args.grammarFile}' not found")
         sys.exit(1)
@@ -0,0 +1,470 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for JSGFTools
+
+Each benchmark builds a synthetic grammar, times one operation on it and prints
+one line per measurement. Run all of them with:
+
+        ``python benchmarks.py``
+
+or a selection by name:
+
+        ``python benchmarks.py parser``
+"""
+
+import sys
+import time
+from io import StringIO, BytesIO
+
+import JSGFParser as parser
+
+
+def timeIt(function, *args, **kwargs):
+    """
+    Calls a function once and measures it
+
+    :returns: (result of the call, elapsed seconds)
+    """
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def bestOf(repeat, function, *args, **kwargs):
+    """
+    Calls a function several times
+
+    :returns: (result of the last call, smallest elapsed seconds)
+    """
+    best = None
+    for i in range(repeat):
+        result, elapsed = timeIt(function, *args, **kwargs)
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def makeEntityGrammar(numRules, numAlternatives):
+    """
+    Builds the text of a grammar with one public template rule and many
+    private rules, each a list of alternatives with optional and weighted parts
+    """
+    lines = ['public <start> = ' + ' | '.join('<rule%d>' % i for i in range(min(numRules, 50))) + ';']
+    for i in range(numRules):
+        alternatives = ' | '.join('[ please ] value%d_%d ( now | later )' % (i, j)
+                                  for j in range(numAlternatives))
+        lines.append('<rule%d> = %s;' % (i, alternatives))
+        lines.append('<weighted%d> = /2/ yes | /1/ no | /0.5/ <rule%d>;' % (i, i))
+    return '\n'.join(lines) + '\n'
+
+
+def benchParser():
+    """Compares the parser engines on grammars of growing size"""
+    for numRules in (100, 1000, 10000):
+        text = makeEntityGrammar(numRules, 5)
+        times = {}
+        for engine in ('fast', 'pyparsing'):
+            if engine == 'pyparsing' and numRules > 1000:
+                continue
+            _, times[engine] = timeIt(parser.getGrammarObject, StringIO(text), engine=engine)
+        line = 'parser rules=%-6d fast=%.3fs' % (2 * numRules, times['fast'])
+        if 'pyparsing' in times:
+            line += ' pyparsing=%.3fs speedup=%.0fx' % (times['pyparsing'], times['pyparsing'] / times['fast'])
+        print(line)
+
+
+def benchLongRule():
+    """
+    Parses a single rule with one alternative per line. The time per
+    alternative should stay flat as the rule grows.
+    """
+    for numAlternatives in (1000, 10000, 100000):
+        lines = ['public <entity> = entity0'] + ['  | entity%d' % i for i in range(1, numAlternatives)] + [';']
+        text = '\n'.join(lines) + '\n'
+        for engine in ('fast', 'pyparsing'):
+            # pyparsing recurses once per alternative
+            if engine == 'pyparsing' and numAlternatives > 1000:
+                continue
+            _, elapsed = timeIt(parser.getGrammarObject, StringIO(text), engine=engine)
+            print('long rule alternatives=%-6d engine=%-9s %.3fs (%.2fus per alternative)'
+                  % (numAlternatives, engine, elapsed, 1e6 * elapsed / numAlternatives))
+
+
+def benchRuleLookup():
+    """
+    Samples from grammars whose start rule refers to the rules defined last.
+    Sentences per second should not depend on the number of rules.
+    """
+    import ProbabilisticGenerator as prob_gen
+    numSamples = 20000
+    for numRules in (10, 1000, 100000):
+        lines = ['public <start> = <r%d> <r%d> [ <r%d> ];' % (numRules - 1, numRules - 2, numRules - 3)]
+        lines.extend('<r%d> = word%d | other%d;' % (i, i, i) for i in range(numRules))
+        prob_gen.grammar = parser.getGrammarObject(StringIO('\n'.join(lines)))
+        rhs = prob_gen.grammar.publicRules[0].rhs
+
+        def sample():
+            for i in range(numSamples):
+                prob_gen.processRHS(rhs)
+        _, elapsed = timeIt(sample)
+        print('rule lookup rules=%-6d %.0f sentences/s' % (numRules, numSamples / elapsed))
+
+
+def countNodes(expr):
+    """
+    :returns: number of nodes in the expression tree, counting shared nodes once per reference
+    """
+    import JSGFGrammar as gram
+    count = 0
+    stack = [expr]
+    while stack:
+        expr = stack.pop()
+        count += 1
+        if isinstance(expr, (list, tuple)):
+            stack.extend(e for e in expr if not isinstance(e, float))
+        elif isinstance(expr, gram.Disjunction):
+            stack.extend(expr.disjuncts)
+        elif isinstance(expr, gram.Optional):
+            stack.append(expr.option)
+    return count
+
+
+def benchMemory():
+    """Measures the memory held by the parsed grammar of a synthetic 1M-node grammar"""
+    import gc
+    import tracemalloc
+    lines = []
+    for i in range(12500):
+        alternatives = ' | '.join('[ please ] ( show | find ) me value%d' % (10 * i + j) for j in range(10))
+        lines.append('<entity%d> = %s;' % (i, alternatives))
+    text = '\n'.join(lines) + '\n'
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    grammar = parser.getGrammarObject(StringIO(text))
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    nodes = sum(countNodes(rule.rhs) for rule in grammar.rules)
+    print('memory nodes=%d %.1f MB (%.0f bytes per node)' % (nodes, (after - before) / 1e6, (after - before) / nodes))
+
+
+def benchCompiledProgram():
+    """Compares the recursive generators with the compiled program"""
+    import random
+    import DeterministicGenerator as det_gen
+    import ProbabilisticGenerator as prob_gen
+    import JSGFCompiler as compiler
+    text = """
+    public <start> = [ please ] <action> <object> [ <time> ];
+    <action> = show | find | play | open | close | list | send;
+    <object> = [ the | a | my ] ( song | album | file | message | note | picture | video ) [ <qualifier> ];
+    <qualifier> = ( from | by | for ) ( <name> | them | me );
+    <name> = alice | bob | carol | dave | erin | frank | grace | heidi;
+    <time> = /3/ now | /1/ later | /1/ ( tomorrow | today ) [ morning | evening ];
+    """
+    grammar = parser.getGrammarObject(StringIO(text))
+    rhs = grammar.publicRules[0].rhs
+    program = compiler.compileGrammar(grammar)
+    root = program.publicRoots[0]
+
+    det_gen.grammar = grammar
+    expected, astTime = bestOf(3, det_gen.processRHS, rhs)
+    result, irTime = bestOf(3, program.expand, root)
+    assert result == expected
+    print('compiled enumeration strings=%d ast=%.3fs program=%.3fs speedup=%.1fx'
+          % (len(result), astTime, irTime, astTime / irTime))
+
+    numSamples = 100000
+    prob_gen.grammar = grammar
+    _, astTime = bestOf(3, lambda: [prob_gen.processRHS(rhs) for i in range(numSamples)])
+    _, irTime = bestOf(3, lambda: [program.sample(root) for i in range(numSamples)])
+    print('compiled sampling ast=%.0f/s program=%.0f/s speedup=%.1fx'
+          % (numSamples / astTime, numSamples / irTime, astTime / irTime))
+
+
+def benchWeightedChoice():
+    """Times sampling from wide weighted alternative lists with and without precomputed alias tables"""
+    import bisect
+    import itertools
+    import random
+    import ProbabilisticGenerator as prob_gen
+    import JSGFCompiler as compiler
+    rules = ['<slot%d> = %s;' % (i, ' | '.join('/%d/ w%d_%d' % (j % 7 + 1, i, j) for j in range(200)))
+             for i in range(20)]
+    rules.append('public <start> = ' + ' '.join('<slot%d>' % i for i in range(20)) + ';')
+    grammar = prob_gen.grammar = parser.getGrammarObject(StringIO('\n'.join(rules)))
+    rhs = grammar.publicRules[0].rhs
+    program = compiler.compileGrammar(grammar)
+    root = program.publicRoots[0]
+
+    def rebuildingChoice(listOfTuples):
+        # cumulative weights built on every call, as before alias tables
+        choices, weights = zip(*listOfTuples)
+        cumdist = list(itertools.accumulate(weights))
+        return choices[bisect.bisect(cumdist, random.random() * cumdist[-1])]
+
+    numSamples = 20000
+    savedChoice = prob_gen.weightedChoice
+    try:
+        prob_gen.weightedChoice = rebuildingChoice
+        _, rebuildTime = bestOf(3, lambda: [prob_gen.processRHS(rhs) for i in range(numSamples)])
+    finally:
+        prob_gen.weightedChoice = savedChoice
+    _, aliasTime = bestOf(3, lambda: [prob_gen.processRHS(rhs) for i in range(numSamples)])
+    _, programTime = bestOf(3, lambda: [program.sample(root) for i in range(numSamples)])
+    print('weighted choice alternatives=200 rebuilt=%.0f/s alias=%.0f/s (%.1fx) program=%.0f/s'
+          % (numSamples / rebuildTime, numSamples / aliasTime, rebuildTime / aliasTime,
+             numSamples / programTime))
+
+
+def benchBatchSampling():
+    """Compares sampling strings one at a time with sampling them in batches"""
+    import JSGFCompiler as compiler
+    import ProbabilisticGenerator as prob_gen
+    text = """
+    public <start> = [ please ] <action> <object> [ <time> ];
+    <action> = show | find | play | open | close | list | send;
+    <object> = [ the | a | my ] ( song | album | file | message | note | picture | video ) [ <qualifier> ];
+    <qualifier> = ( from | by | for ) ( <name> | them | me );
+    <name> = alice | bob | carol | dave | erin | frank | grace | heidi;
+    <time> = /3/ now | /1/ later | /1/ ( tomorrow | today ) [ morning | evening ];
+    """
+    grammar = parser.getGrammarObject(StringIO(text))
+    program = compiler.compileGrammar(grammar)
+    root = prob_gen.startNode(program, grammar)
+
+    numSamples = 100000
+    _, singleTime = bestOf(3, lambda: [program.sample(root) for i in range(numSamples)])
+    line = 'batch sampling single=%.0f/s' % (numSamples / singleTime)
+    for batchSize in (100, prob_gen.SAMPLE_BATCH_SIZE):
+        def sampleAll():
+            return [sentence for first in range(0, numSamples, batchSize)
+                    for sentence in program.sampleBatch(root, batchSize)]
+        _, batchTime = bestOf(3, sampleAll)
+        line += ' batch%d=%.0f/s (%.1fx)' % (batchSize, numSamples / batchTime, singleTime / batchTime)
+    print(line)
+
+
+def benchStreaming():
+    """Compares streaming enumeration with building the whole list of strings"""
+    import tracemalloc
+    import DeterministicGenerator as det_gen
+    rules = ['<d%d> = %s;' % (i, ' | '.join('w%d_%d' % (i, j) for j in range(10))) for i in range(5)]
+    rules.append('public <start> = [ please ] ' + ' '.join('<d%d>' % i for i in range(5)) + ';')
+    det_gen.grammar = parser.getGrammarObject(StringIO('\n'.join(rules)))
+    rhs = det_gen.grammar.publicRules[0].rhs
+
+    _, firstTime = timeIt(next, det_gen.iterExpansions(rhs))
+    results = {}
+    for name, expand in (('list', det_gen.processRHS),
+                         ('stream', lambda rhs: sum(1 for e in det_gen.iterExpansions(rhs)))):
+        tracemalloc.start()
+        result, elapsed = timeIt(expand, rhs)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results[name] = (elapsed, peak)
+    print('streaming strings=%d first=%.4fs list=%.2fs/%.1fMB stream=%.2fs/%.1fMB'
+          % (2 * 10 ** 5, firstTime, results['list'][0], results['list'][1] / 2 ** 20,
+             results['stream'][0], results['stream'][1] / 2 ** 20))
+
+
+def benchParallel():
+    """Compares sharded enumeration in worker processes with one process"""
+    import os
+    import DeterministicGenerator as det_gen
+    rules = ['<d%d> = %s;' % (i, ' | '.join('w%d_%d' % (i, j) for j in range(10))) for i in range(6)]
+    rules.append('public <start> = [ please ] ' + ' '.join('<d%d>' % i for i in range(6)) + ';')
+    det_gen.grammar = parser.getGrammarObject(StringIO('\n'.join(rules)))
+    rhs = det_gen.grammar.publicRules[0].rhs
+
+    def single():
+        output = StringIO()
+        det_gen.writeLines(det_gen.iterExpansions(rhs), output)
+        return output.getvalue()
+
+    expected, singleTime = timeIt(single)
+    line = 'parallel strings=%d workers=1 %.2fs' % (2 * 10 ** 6, singleTime)
+    for workers in sorted({2, os.cpu_count() or 1} - {1}):
+        result, elapsed = timeIt(lambda: ''.join(det_gen.iterParallelExpansions(workers)))
+        assert result == expected
+        line += ' workers=%d %.2fs (%.1fx)' % (workers, elapsed, singleTime / elapsed)
+    print(line)
+
+
+def benchParallelSampling():
+    """Compares seeded sampling in worker processes with one process"""
+    import os
+    import ProbabilisticGenerator as prob_gen
+    with open('IdeasNonRecursive.gram') as f:
+        prob_gen.grammar = parser.getGrammarObject(f)
+    numSamples = 500000
+
+    expected, singleTime = timeIt(lambda: ''.join(prob_gen.iterSamples(numSamples, 1)))
+    line = 'parallel sampling strings=%d workers=1 %.2fs' % (numSamples, singleTime)
+    for workers in sorted({2, os.cpu_count() or 1} - {1}):
+        result, elapsed = timeIt(lambda: ''.join(prob_gen.iterSamples(numSamples, 1, workers=workers)))
+        assert result == expected
+        line += ' workers=%d %.2fs (%.1fx)' % (workers, elapsed, singleTime / elapsed)
+    print(line)
+
+
+def benchExpansionCache():
+    """Times processRHS with and without the nonterminal expansion cache"""
+    import DeterministicGenerator as det_gen
+    rules = ['<city> = ' + ' | '.join('city%d [ center | airport ]' % i for i in range(5000)) + ';',
+             '<day> = today | tomorrow | monday | friday;']
+    for i in range(30):
+        rules.append('public <template%d> = ( book | find ) trip%d to <city> [ <day> ];' % (i, i))
+    det_gen.grammar = parser.getGrammarObject(StringIO('\n'.join(rules)))
+
+    def expandAll():
+        return sum(len(det_gen.processRHS(rule.rhs)) for rule in det_gen.grammar.publicRules)
+
+    savedCache = det_gen.expansionCache
+    try:
+        det_gen.expansionCache = None
+        expected, uncachedTime = timeIt(expandAll)
+        det_gen.expansionCache = det_gen.ExpansionCache()
+        result, cachedTime = timeIt(expandAll)
+        statistics = det_gen.expansionCache.statistics()
+    finally:
+        det_gen.expansionCache = savedCache
+    assert result == expected
+    print('expansion cache strings=%d uncached=%.2fs cached=%.2fs speedup=%.1fx hits=%d misses=%d size=%.1fMB'
+          % (result, uncachedTime, cachedTime, uncachedTime / cachedTime, statistics['hits'],
+             statistics['misses'], statistics['size'] / 2 ** 20))
+
+
+def benchAutomaton():
+    """Compares the size of the minimal automaton of a language with its list of strings"""
+    import DeterministicGenerator as det_gen
+    import JSGFAutomaton as fsa
+    for numSlots in (6, 12):
+        rules = ['<d%d> = %s;' % (i, ' | '.join('w%d_%d' % (i, j) for j in range(10))) for i in range(numSlots)]
+        rules.append('public <start> = [ please ] ' + ' '.join('<d%d>' % i for i in range(numSlots)) + ';')
+        grammar = det_gen.grammar = parser.getGrammarObject(StringIO('\n'.join(rules)))
+        automaton, buildTime = timeIt(fsa.buildAutomaton, grammar)
+        output = BytesIO()
+        automaton.write(output)
+        line = ('automaton strings=%d build=%.3fs states=%d transitions=%d file=%.1fKB'
+                % (automaton.count(), buildTime, automaton.numStates(), automaton.numTransitions(),
+                   len(output.getvalue()) / 2 ** 10))
+        if numSlots <= 6:
+            listSize = sum(len(sentence) + 1 for sentence in det_gen.iterExpansions(grammar.publicRules[0].rhs))
+            line += ' list=%.1fMB' % (listSize / 2 ** 20)
+        print(line)
+
+
+def benchUniformSampling():
+    """Compares uniform sampling with counts to per-node sampling and to picking from the enumeration"""
+    import random
+    import DeterministicGenerator as det_gen
+    import ProbabilisticGenerator as prob_gen
+    rules = ['<d%d> = %s;' % (i, ' | '.join('w%d_%d' % (i, j) for j in range(10))) for i in range(5)]
+    rules.append('<long> = ' + ' '.join('<d%d>' % i for i in range(5)) + ';')
+    rules.append('public <start> = yes | no | <long>;')
+    grammar = prob_gen.grammar = det_gen.grammar = parser.getGrammarObject(StringIO('\n'.join(rules)))
+    rhs = grammar.publicRules[0].rhs
+    numSamples = 100000
+
+    sampler, buildTime = timeIt(prob_gen.UniformSampler, grammar)
+    rng = random.Random(1)
+    uniform, uniformTime = timeIt(lambda: [sampler.sample(rhs, rng) for i in range(numSamples)])
+    perNode = [prob_gen.processRHS(rhs) for i in range(numSamples)]
+    language, enumerateTime = timeIt(det_gen.processRHS, rhs)
+    print('uniform sampling strings=%d build=%.4fs uniform=%.0f/s enumerate=%.2fs '
+          'short share: uniform=%.3f%% per-node=%.1f%%'
+          % (len(language), buildTime, numSamples / uniformTime, enumerateTime,
+             100.0 * sum(1 for s in uniform if ' ' not in s) / numSamples,
+             100.0 * sum(1 for s in perNode if ' ' not in s) / numSamples))
+    for maxLength in (20, 40):
+        with open('Ideas.gram') as f:
+            recursive = parser.getGrammarObject(f)
+        sampler, buildTime = timeIt(prob_gen.UniformSampler, recursive, maxLength)
+        start = prob_gen.startExpression(recursive)
+        _, sampleTime = timeIt(lambda: [sampler.sample(start, rng) for i in range(10000)])
+        print('uniform sampling Ideas.gram max-length=%d strings=%d build=%.4fs sample=%.0f/s'
+              % (maxLength, sampler.count(start), buildTime, 10000 / sampleTime))
+
+
+def benchRecognizer():
+    """Times recognizing a million utterances, half of them strings of the grammar"""
+    import random
+    import JSGFAutomaton as fsa
+    import JSGFRecognizer as recognizer
+    from ProbabilisticGenerator import ProbabilisticGenerator
+    grammar = parser.getGrammarObject(StringIO(makeEntityGrammar(200, 20)))
+    numUtterances = 1000000
+    strings = ProbabilisticGenerator(grammar).sampleBatch(numUtterances // 2, seed=1)
+    rng = random.Random(1)
+    utterances = []
+    for string in strings:
+        tokens = string.split()
+        utterances.append(string)
+        # a near miss: a token dropped, repeated or replaced
+        i = rng.randrange(len(tokens))
+        tokens[i:i + 1] = rng.choice([[], [tokens[i]] * 2, ['value0_0']])
+        utterances.append(' '.join(tokens))
+
+    matcher, buildTime = timeIt(recognizer.Recognizer, grammar)
+    matches, firstTime = timeIt(matcher.matchAll, utterances)
+    matches, matchTime = timeIt(matcher.matchAll, utterances)
+    automaton = fsa.buildAutomaton(grammar)
+    accepted, automatonTime = timeIt(lambda: [utterance in automaton for utterance in utterances])
+    assert matches == accepted
+    print('recognizer utterances=%d matched=%d build=%.3fs first=%.0f/s warm=%.0f/s states=%d '
+          'automaton=%.0f/s'
+          % (numUtterances, sum(matches), buildTime, numUtterances / firstTime, numUtterances / matchTime,
+             matcher.numStates()[1], numUtterances / automatonTime))
+
+
+def benchEarley():
+    """Compares parsing sentences one by one with parsing them as a batch in a reused chart"""
+    import JSGFEarley as earley
+    from ProbabilisticGenerator import ProbabilisticGenerator
+    with open('Ideas.gram') as f:
+        recursive = parser.getGrammarObject(f)
+    grammars = [('Ideas.gram', recursive),
+                ('entities', parser.getGrammarObject(StringIO(makeEntityGrammar(200, 20))))]
+    numSentences = 20000
+    for name, grammar in grammars:
+        sentences = ProbabilisticGenerator(grammar).sampleBatch(numSentences, seed=1)
+        earleyParser, buildTime = timeIt(earley.EarleyParser, grammar)
+        single, singleTime = timeIt(lambda: [earleyParser.parse(sentence) for sentence in sentences])
+        batch, batchTime = timeIt(earleyParser.parseAll, sentences)
+        assert [str(result.tree) for result in batch] == [str(result.tree) for result in single]
+        print('earley %s sentences=%d tokens=%.1f build=%.3fs single=%.0f/s batch=%.0f/s'
+              % (name, numSentences, sum(len(sentence.split()) for sentence in sentences) / numSentences,
+                 buildTime, numSentences / singleTime, numSentences / batchTime))
+
+
+BENCHMARKS = {
+    'parser': benchParser,
+    'longrule': benchLongRule,
+    'lookup': benchRuleLookup,
+    'memory': benchMemory,
+    'compiled': benchCompiledProgram,
+    'weighted': benchWeightedChoice,
+    'batch': benchBatchSampling,
+    'streaming': benchStreaming,
+    'parallel': benchParallel,
+    'parallelsampling': benchParallelSampling,
+    'expansioncache': benchExpansionCache,
+    'automaton': benchAutomaton,
+    'uniform': benchUniformSampling,
+    'recognizer': benchRecognizer,
+    'earley': benchEarley,
+}
+
+
+def main():
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            print("Unknown benchmark: " + name + ", choose from " + ', '.join(BENCHMARKS))
+            sys.exit(1)
+        BENCHMARKS[name]()
+
+if __name__ == '__main__':
+    main()
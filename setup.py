@@ -13,7 +13,7 @@ setup(
     long_description=long_description,
     long_description_content_type="text/markdown",
     url='https://github.com/syntactic/JSGFTools',
-    py_modules=['JSGFParser', 'JSGFGrammar', 'DeterministicGenerator', 'ProbabilisticGenerator'],
+    py_modules=['JSGFParser', 'JSGFGrammar', 'JSGFCache', 'JSGFCompiler', 'JSGFAutomaton', 'JSGFAsync', 'JSGFRecognizer', 'JSGFEarley', 'DeterministicGenerator', 'ProbabilisticGenerator'],
     classifiers=[
         "Development Status :: 4 - Beta",
         "Intended Audience :: Developers",
@@ -37,6 +37,8 @@ setup(
         'console_scripts': [
             'jsgf-deterministic=DeterministicGenerator:main',
             'jsgf-probabilistic=ProbabilisticGenerator:main',
+            'jsgf-recognize=JSGFRecognizer:main',
+            'jsgf-parse=JSGFEarley:main',
         ],
     },
 )
\ No newline at end of file
@@ -7,17 +7,28 @@ This module provides comprehensive tests for all components of JSGFTools:
 - JSGFGrammar: grammar object structure and operations
 - DeterministicGenerator: exhaustive string generation
 - ProbabilisticGenerator: random string generation
+- JSGFRecognizer: recognition of the strings of a grammar
+- JSGFEarley: parse trees and probabilities of sentences
 """
 
 import pytest
 import tempfile
 import os
+import subprocess
+import sys
+import tracemalloc
 from io import StringIO
+from collections import Counter
 
 import JSGFParser as parser
 import JSGFGrammar as gram
 import DeterministicGenerator as det_gen
 import ProbabilisticGenerator as prob_gen
+import JSGFCache as cache
+import JSGFCompiler as compiler
+import JSGFAutomaton as fsa
+import JSGFRecognizer as recognizer
+import JSGFEarley as earley
 
 
 class TestJSGFParser:
@@ -96,6 +107,187 @@ class TestJSGFParser:
         assert len(grammar.publicRules) == 1
 
 
+def dumpExpression(expr):
+    """Renders a parsed expression with its Python types, for comparing engines"""
+    if isinstance(expr, list):
+        return 'L[' + ', '.join(dumpExpression(e) for e in expr) + ']'
+    if isinstance(expr, tuple):
+        return 'W(' + dumpExpression(expr[0]) + ', ' + repr(expr[1]) + ')'
+    if isinstance(expr, gram.Disjunction):
+        return 'D{' + ' | '.join(dumpExpression(e) for e in expr.disjuncts) + '}'
+    if isinstance(expr, gram.Optional):
+        return 'O[' + dumpExpression(expr.option) + ']'
+    if isinstance(expr, gram.NonTerminal):
+        return 'N' + expr.name
+    return repr(expr)
+
+
+def dumpGrammar(grammar):
+    return ([(r.lhs.name, dumpExpression(r.rhs)) for r in grammar.rules],
+            [(r.lhs.name, dumpExpression(r.rhs)) for r in grammar.publicRules])
+
+
+class TestParserEngines:
+    """Test that the fast parser engine agrees with the pyparsing engine"""
+
+    grammars = [
+        "public <a> = b;",
+        "<a> = b c <d> e;",
+        "<a> = b | c d | e;",
+        "<a> = (b | c) | d;",
+        "<a> = b | (c | d);",
+        "<a> = b | (c d);",
+        "<a> = x (b c) y;",
+        "<a> = a (b | c) | d;",
+        "<a> = [b] | c [d e] | [f | g];",
+        "<a> = [ [ b ] ];",
+        "<a> = /1/ b | /2.5/ c d | / .5 / (e | f);",
+        "<a> = /1/ b;",
+        "<a> = ( /1/ a | /2/ b ) c;",
+        "<a> = /1/ b | c;",
+        "<a> = b | ;",
+        "<a-b> = it's ok, a.b?;",
+        "<a> =\n  b\n  | c\n  ;\npublic <e> = <a>;",
+        "#JSGF V1.0;\ngrammar test;\npublic <a> = b;",
+    ]
+
+    @pytest.mark.parametrize("grammar_text", grammars)
+    def test_engines_agree(self, grammar_text):
+        """Both engines build the same grammar objects"""
+        fast = parser.getGrammarObject(StringIO(grammar_text), engine='fast')
+        slow = parser.getGrammarObject(StringIO(grammar_text), engine='pyparsing')
+
+        assert dumpGrammar(fast) == dumpGrammar(slow)
+
+    @pytest.mark.parametrize("path", ['Ideas.gram', 'IdeasNonRecursive.gram'])
+    def test_engines_agree_on_example_grammars(self, path):
+        """Both engines build the same grammar objects from the example files"""
+        with open(path, 'r') as f:
+            fast = parser.getGrammarObject(f, engine='fast')
+        with open(path, 'r') as f:
+            slow = parser.getGrammarObject(f, engine='pyparsing')
+
+        assert dumpGrammar(fast) == dumpGrammar(slow)
+
+    @pytest.mark.parametrize("engine", parser.ENGINES)
+    def test_rule_spanning_many_lines(self, engine):
+        """Test that a rule split over many lines is parsed once, as a whole"""
+        lines = ["public <city> = city0"] + ["| city%d" % i for i in range(1, 500)] + [";"]
+        grammar = parser.getGrammarObject(StringIO("\n".join(lines)), engine=engine)
+
+        assert len(grammar.rules) == 1
+        assert len(grammar.publicRules[0].rhs[0].disjuncts) == 500
+
+    @pytest.mark.parametrize("engine", parser.ENGINES)
+    def test_several_rules_on_one_line(self, engine):
+        """Test that every rule on a line is kept"""
+        grammar = parser.getGrammarObject(StringIO("<a> = b; public <c> = d;"), engine=engine)
+
+        assert [rule.lhs.name for rule in grammar.rules] == ["<a>", "<c>"]
+        assert len(grammar.publicRules) == 1
+
+    def test_statements_split_at_semicolons(self):
+        """Test that semicolons in rule names and quotes do not end a statement"""
+        lines = ['<a;b> = c', '| d;', 'e "f;g" h;', 'tail']
+        statements = list(parser.iterStatements(line + '\n' for line in lines))
+
+        assert statements == ['<a;b> = c\n| d;', '\ne "f;g" h;']
+
+    @pytest.mark.parametrize("chunkSize", [1, 7, 4096])
+    def test_iter_rules_chunk_sizes(self, chunkSize):
+        """Test that rules are read the same way whatever the chunk size"""
+        with open('IdeasNonRecursive.gram', 'r') as f:
+            expected = [(isPublic, str(rule)) for isPublic, rule in parser.iterRules(f)]
+        with open('IdeasNonRecursive.gram', 'r') as f:
+            rules = [(isPublic, str(rule)) for isPublic, rule in parser.iterRules(f, chunkSize=chunkSize)]
+
+        assert rules == expected
+        assert len(rules) == 8
+        assert rules[0][0] is True
+
+    def test_iter_rules_is_incremental(self):
+        """Test that a rule is yielded before the rest of the stream is read"""
+        class CountingStream(StringIO):
+            reads = 0
+
+            def read(self, size=-1):
+                self.reads += 1
+                return super().read(size)
+
+        lines = ["<r%d> = word%d;" % (i, i) for i in range(1000)]
+        stream = CountingStream("\n".join(lines))
+        rules = parser.iterRules(stream, chunkSize=64)
+
+        isPublic, rule = next(rules)
+        assert rule.lhs.name == "<r0>"
+        assert stream.reads == 1
+        assert sum(1 for _ in rules) == 999
+
+    def test_iter_rules_memory_is_constant(self):
+        """Test that streaming rules does not keep the rules already yielded"""
+        def peak(numRules):
+            # distinct expressions made of the same few strings, as interned
+            # strings are kept in a global table that never shrinks
+            lines = ("<r> = %s [ c ] | d;\n" % " ".join("ab"[int(bit)] for bit in format(i, "016b"))
+                     for i in range(numRules))
+            stream = StringIO()
+            stream.read = lambda size=-1: next(lines, "")
+            tracemalloc.start()
+            for _ in parser.iterRules(stream):
+                pass
+            result = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            return result
+
+        # sharing the table across the stream took about 18 MB for 20000 rules
+        small = peak(2000)
+        assert peak(20000) < 2 * small + 1000000
+
+    def test_unknown_engine(self):
+        """Test that an unknown engine name is rejected"""
+        with pytest.raises(ValueError):
+            parser.getGrammarObject(StringIO("<a> = b;"), engine='lalr')
+
+    def test_fast_engine_does_not_import_pyparsing(self):
+        """Test that pyparsing stays out of the startup path of the fast engine"""
+        code = ("import sys, io, JSGFParser; "
+                "JSGFParser.getGrammarObject(io.StringIO('<a> = b;')); "
+                "print('pyparsing' in sys.modules)")
+        output = subprocess.check_output([sys.executable, '-c', code],
+                                         cwd=os.path.dirname(os.path.abspath(__file__)))
+        assert output.strip() == b'False'
+
+    def test_unknown_attribute_does_not_import_pyparsing(self):
+        """Test that only the pyparsing rule names build the pyparsing grammar"""
+        code = ("import sys, JSGFParser; "
+                "print(hasattr(JSGFParser, 'nope'), 'pyparsing' in sys.modules, "
+                "hasattr(JSGFParser, 'StartSymbol'), 'pyparsing' in sys.modules)")
+        output = subprocess.check_output([sys.executable, '-c', code],
+                                         cwd=os.path.dirname(os.path.abspath(__file__)))
+        assert output.strip() == b'False False True True'
+
+    def test_pyparsing_rules_are_attributes(self):
+        """Test that every rule of the pyparsing grammar is a module attribute"""
+        for name in parser._buildPyparsingGrammar():
+            assert getattr(parser, name) is not None
+
+    @pytest.mark.parametrize("engine", parser.ENGINES)
+    def test_recursion_limit_left_alone(self, engine):
+        """Test that parsing does not change the interpreter recursion limit"""
+        code = ("import sys, io; limit = sys.getrecursionlimit(); import JSGFParser; "
+                "JSGFParser.getGrammarObject(io.StringIO('<a> = b | c;'), engine=%r); "
+                "print(sys.getrecursionlimit() == limit)" % engine)
+        output = subprocess.check_output([sys.executable, '-c', code],
+                                         cwd=os.path.dirname(os.path.abspath(__file__)))
+        assert output.strip() == b'True'
+
+    def test_pyparsing_rules_still_available(self):
+        """Test that the pyparsing rules are still reachable as module attributes"""
+        tokens = parser.StartSymbol.parseString("public <a> = b;")
+
+        assert tokens.identifier.name == "<a>"
+
+
 class TestJSGFGrammar:
     """Test the JSGF grammar objects"""
 
@@ -153,6 +345,91 @@ class TestJSGFGrammar:
         assert len(grammar.publicRules) == 1
 
 
+    def test_rule_lookup(self):
+        """Test looking rules up by nonterminal or by name"""
+        grammar = parser.getGrammarObject(StringIO("<a> = b; <c> = d e; public <f> = <c>;"))
+
+        assert grammar[gram.NonTerminal("<c>")] == ["d", "e"]
+        assert grammar["<f>"] == grammar.getRHS(gram.NonTerminal("<f>"))
+        assert "<a>" in grammar
+        assert gram.NonTerminal("<f>") in grammar
+        assert "<g>" not in grammar
+        with pytest.raises(ValueError):
+            grammar["<g>"]
+
+    def test_duplicate_rule(self):
+        """Test that defining a rule twice is detected"""
+        grammar = gram.Grammar()
+        grammar.addRule(gram.Rule(gram.NonTerminal("<a>"), ["b"]))
+
+        with pytest.raises(ValueError):
+            grammar.addRule(gram.Rule(gram.NonTerminal("<a>"), ["c"]))
+        with pytest.raises(ValueError):
+            parser.getGrammarObject(StringIO("<a> = b;\n<a> = c;"))
+
+    def test_replace_rule(self):
+        """Test redefining a rule, public or not"""
+        grammar = parser.getGrammarObject(StringIO("public <a> = b;\n<c> = d;"))
+        grammar.replaceRule(gram.Rule(gram.NonTerminal("<a>"), ["x"]))
+        grammar.replaceRule(gram.Rule(gram.NonTerminal("<e>"), ["f"]))
+
+        assert grammar["<a>"] == ["x"]
+        assert grammar.publicRules[0].rhs == ["x"]
+        assert [rule.lhs.name for rule in grammar.rules] == ["<a>", "<c>", "<e>"]
+        assert grammar.generation == 1
+
+    def test_vocabulary(self):
+        """Test that the parser numbers every token of the grammar"""
+        grammar = parser.getGrammarObject(StringIO("public <a> = hello <b> | hi;\n<b> = world | hello;"))
+        vocabulary = grammar.vocabulary
+
+        assert vocabulary.tokens == ["hello", "hi", "world"]
+        assert vocabulary["world"] == 2
+        assert "there" not in vocabulary
+        assert vocabulary.detokenize([1, 2]) == "hi world"
+        assert vocabulary.add("there") == 3 and len(vocabulary) == 4
+
+    def test_nodes_are_compact_and_immutable(self):
+        """Test that expression nodes have no __dict__ and cannot be modified"""
+        nodes = [gram.Disjunction(["a", "b"]), gram.Optional("a"), gram.NonTerminal("<a>")]
+        for node in nodes:
+            assert not hasattr(node, "__dict__")
+        with pytest.raises(AttributeError):
+            nodes[0].disjuncts = ()
+        with pytest.raises(AttributeError):
+            nodes[1].option = "b"
+        with pytest.raises(AttributeError):
+            nodes[2].extra = 1
+
+    def test_nodes_pickle(self):
+        """Test that immutable nodes survive a pickle round trip"""
+        import pickle
+        rhs = [gram.Disjunction([("a", 1.0), (["b", gram.Optional(gram.NonTerminal("<c>"))], 2.0)])]
+
+        assert str(pickle.loads(pickle.dumps(rhs))) == str(rhs)
+
+    def test_node_table_shares_identical_subtrees(self):
+        """Test that the hash-consing table returns one object per structure"""
+        table = gram.NodeTable()
+        first = table.optional(table.sequence([table.token("please"), table.nonTerminal("<x>")]))
+        second = table.optional(table.sequence([table.token("please"), table.nonTerminal("<x>")]))
+
+        assert first is second
+        assert table.canonical(gram.Optional(["please", gram.NonTerminal("<x>")])) is first
+        assert table.optional(table.token("thanks")) is not first
+
+    @pytest.mark.parametrize("engine", parser.ENGINES)
+    def test_parsed_subtrees_are_shared(self, engine):
+        """Test that the parser stores repeated subexpressions once"""
+        grammar = parser.getGrammarObject(StringIO(
+            "<a> = [ please ] show (me | us);\n<b> = [ please ] find (me | us);"), engine=engine)
+        a, b = grammar["<a>"], grammar["<b>"]
+
+        assert a[0] is b[0]
+        assert a[2] is b[2]
+        assert a[1] == "show" and b[1] == "find"
+
+
 class TestDeterministicGenerator:
     """Test the deterministic string generator"""
 
@@ -221,6 +498,384 @@ class TestDeterministicGenerator:
         expected = {"hello world", "hello there", "hi world", "hi there"}
         assert set(results) == expected
 
+    @pytest.mark.parametrize("limit", [1000, 3, 1])
+    def test_iter_expansions_matches_process_rhs(self, monkeypatch, limit):
+        """Test that streaming yields the same strings in the same order"""
+        monkeypatch.setattr(det_gen, "SMALL_EXPANSION_LIMIT", limit)
+        grammar_text = """
+        public <start> = [ please ] <greeting> ( <target> | nobody ) [ <target> now ];
+        <greeting> = hello | hi | hey;
+        <target> = world | there | ( my | your ) friend;
+        """
+        det_gen.grammar = parser.getGrammarObject(StringIO(grammar_text))
+        rhs = det_gen.grammar.publicRules[0].rhs
+
+        assert list(det_gen.iterExpansions(rhs)) == det_gen.processRHS(rhs)
+
+    def test_iter_expansions_is_lazy(self):
+        """Test that the first strings come out without expanding the whole rule"""
+        # 10 ** 12 strings, far too many to build
+        rules = ["<d%d> = %s;" % (i, " | ".join("w%d_%d" % (i, j) for j in range(10)))
+                 for i in range(12)]
+        rules.append("public <start> = " + " ".join("<d%d>" % i for i in range(12)) + ";")
+        det_gen.grammar = parser.getGrammarObject(StringIO("\n".join(rules)))
+        rhs = det_gen.grammar.publicRules[0].rhs
+
+        expansions = det_gen.iterExpansions(rhs)
+        first = next(expansions)
+        second = next(expansions)
+
+        assert first == " ".join("w%d_0" % i for i in range(12))
+        assert second == " ".join("w%d_0" % i for i in range(11)) + " w11_1"
+
+    def test_count_matches_generation(self):
+        """Test that counting agrees with the number of generated strings"""
+        with open('IdeasNonRecursive.gram', 'r') as f:
+            det_gen.grammar = parser.getGrammarObject(f)
+        rhs = det_gen.grammar.publicRules[0].rhs
+
+        assert det_gen.countExpansions(rhs) == len(det_gen.processRHS(rhs))
+        assert det_gen.countDistinct(rhs) == len(set(det_gen.processRHS(rhs)))
+
+    def test_count_large_language(self):
+        """Test that counting does not enumerate, and is exact past float precision"""
+        rules = ["<d%d> = %s;" % (i, " | ".join("w%d_%d" % (i, j) for j in range(10)))
+                 for i in range(30)]
+        rules.append("public <start> = [ please ] " + " ".join("<d%d>" % i for i in range(30)) + ";")
+        det_gen.grammar = parser.getGrammarObject(StringIO("\n".join(rules)))
+
+        counts = det_gen.countRules(det_gen.grammar.rules)
+
+        assert counts["<start>"] == 2 * 10 ** 30
+        assert counts["<d0>"] == 10
+
+    def test_count_recursive_rules(self):
+        """Test that rules using recursion have infinitely many strings"""
+        with open('Ideas.gram', 'r') as f:
+            det_gen.grammar = parser.getGrammarObject(f)
+
+        counts = det_gen.countRules(det_gen.grammar.rules)
+
+        assert counts["<S>"] == det_gen.INFINITY
+        assert counts["<CP>"] == det_gen.INFINITY
+        assert counts["<VP>"] != det_gen.INFINITY
+        assert det_gen.countDistinct(det_gen.grammar.publicRules[0].rhs) == det_gen.INFINITY
+
+    @pytest.mark.parametrize("limit", [1000, 1])
+    def test_expansion_at_and_resume(self, monkeypatch, limit):
+        """Test random access and resuming against the full list of strings"""
+        monkeypatch.setattr(det_gen, "SMALL_EXPANSION_LIMIT", limit)
+        grammar_text = """
+        public <start> = [ please ] <greeting> ( <target> | nobody ) [ <target> now ];
+        <greeting> = /1/ hello | /2/ hi | /1/ hey;
+        <target> = world | there | ( my | your ) friend;
+        """
+        det_gen.grammar = parser.getGrammarObject(StringIO(grammar_text))
+        rhs = det_gen.grammar.publicRules[0].rhs
+        expected = det_gen.processRHS(rhs)
+
+        assert [det_gen.expansionAt(rhs, i) for i in range(len(expected))] == expected
+        for start in range(0, len(expected) + 2, 7):
+            assert list(det_gen.iterExpansionsFrom(rhs, start)) == expected[start:]
+        with pytest.raises(IndexError):
+            det_gen.expansionAt(rhs, len(expected))
+
+    def test_expansion_at_large_index(self):
+        """Test that a string far into a huge language is found directly"""
+        rules = ["<d%d> = %s;" % (i, " | ".join("w%d_%d" % (i, j) for j in range(10)))
+                 for i in range(30)]
+        rules.append("public <start> = " + " ".join("<d%d>" % i for i in range(30)) + ";")
+        det_gen.grammar = parser.getGrammarObject(StringIO("\n".join(rules)))
+        rhs = det_gen.grammar.publicRules[0].rhs
+        index = int("9" + "0" * 28 + "7")
+
+        assert det_gen.expansionAt(rhs, index) == " ".join(
+            "w%d_%s" % (i, digit) for i, digit in enumerate(str(index).zfill(30)))
+        assert next(det_gen.iterExpansionsFrom(rhs, index)) == det_gen.expansionAt(rhs, index)
+
+    def test_expansion_at_recursive_rule(self):
+        """Test that recursive rules cannot be indexed"""
+        with open('Ideas.gram', 'r') as f:
+            det_gen.grammar = parser.getGrammarObject(f)
+
+        with pytest.raises(ValueError):
+            det_gen.expansionAt(det_gen.grammar.publicRules[0].rhs, 0)
+
+    def test_expansion_cache(self):
+        """Test that a rule referenced many times is expanded once"""
+        det_gen.grammar = parser.getGrammarObject(StringIO("""
+        public <a> = ( to | from ) <city> | near <city>;
+        public <b> = <a> or <city>;
+        <city> = paris | rome;
+        """))
+        expansionCache = det_gen.ExpansionCache()
+        expected = [det_gen.processRHS(rule.rhs) for rule in det_gen.grammar.publicRules]
+        det_gen.expansionCache = expansionCache
+        try:
+            results = [det_gen.processRHS(rule.rhs) for rule in det_gen.grammar.publicRules]
+        finally:
+            det_gen.expansionCache = det_gen.ExpansionCache()
+
+        assert results == expected
+        statistics = expansionCache.statistics()
+        assert statistics["misses"] == 2  # <city> and <a>
+        assert statistics["hits"] == 4
+        assert statistics["entries"] == 2
+
+    def test_expansion_cache_invalidation(self, monkeypatch):
+        """Test that redefining a rule drops the expansions that used it"""
+        det_gen.grammar = parser.getGrammarObject(StringIO("""
+        public <a> = to <city>;
+        <city> = paris | rome;
+        <day> = today;
+        """))
+        expansionCache = det_gen.ExpansionCache()
+        monkeypatch.setattr(det_gen, "expansionCache", expansionCache)
+        start, city, day = (gram.NonTerminal(name) for name in ("<a>", "<city>", "<day>"))
+
+        assert expansionCache.expand(start, det_gen.grammar, det_gen.processRHS) == ("to paris", "to rome")
+        expansionCache.expand(day, det_gen.grammar, det_gen.processRHS)
+        det_gen.grammar.replaceRule(gram.Rule(city, ["berlin"]))
+
+        assert expansionCache.expand(start, det_gen.grammar, det_gen.processRHS) == ("to berlin",)
+        assert expansionCache.invalidations == 2
+        assert expansionCache.expand(day, det_gen.grammar, det_gen.processRHS) == ("today",)
+        assert expansionCache.hits == 1
+
+    def test_expansion_cache_eviction(self):
+        """Test that the least recently used expansions go over the budget"""
+        det_gen.grammar = parser.getGrammarObject(StringIO("<a> = a1 | a2;\n<b> = b1 | b2;\n<c> = c1 | c2;"))
+        a, b, c = (gram.NonTerminal(name) for name in ("<a>", "<b>", "<c>"))
+        expansionCache = det_gen.ExpansionCache()
+        expansionCache.expand(a, det_gen.grammar, det_gen.processRHS)
+        expansionCache.maxSize = 2 * expansionCache.size
+
+        for nt in (b, a, c):
+            expansionCache.expand(nt, det_gen.grammar, det_gen.processRHS)
+
+        assert list(expansionCache.entries) == ["<a>", "<c>"]
+        assert expansionCache.evictions == 1
+
+    def test_deep_chain(self):
+        """Test a non-recursive grammar nested deeper than the interpreter limit"""
+        chain = "".join("<r%d> = a <r%d>;\n" % (i, i + 1) for i in range(400))
+        det_gen.grammar = parser.getGrammarObject(StringIO(chain + "<r400> = end;\npublic <s> = <r0> | x;"))
+        limit = sys.getrecursionlimit()
+
+        rhs = det_gen.grammar.publicRules[0].rhs
+        sentence = "a " * 400 + "end"
+        assert det_gen.processRHS(rhs) == [sentence, "x"]
+        assert det_gen.countExpansions(rhs) == 2
+        assert det_gen.expansionAt(rhs, 0) == sentence
+        assert sys.getrecursionlimit() == limit
+
+    def test_bounded_expansions_match_process_rhs(self):
+        """Test that a loose bound on a non-recursive grammar changes nothing"""
+        with open('IdeasNonRecursive.gram', 'r') as f:
+            det_gen.grammar = parser.getGrammarObject(f)
+        rhs = det_gen.grammar.publicRules[0].rhs
+
+        assert list(det_gen.iterBoundedExpansions(rhs, maxDepth=10)) == det_gen.processRHS(rhs)
+        assert sorted(det_gen.iterBoundedExpansions(rhs, maxLength=10, order="length")) == \
+            sorted(det_gen.processRHS(rhs))
+
+    def test_bounded_expansions_of_recursive_grammar(self):
+        """Test enumerating a recursive grammar deeper than the recursion limit"""
+        with open('Ideas.gram', 'r') as f:
+            det_gen.grammar = parser.getGrammarObject(f)
+        rhs = det_gen.grammar.publicRules[0].rhs
+
+        shallow = list(det_gen.iterBoundedExpansions(rhs, maxDepth=4))
+        maxDepth = 2 * sys.getrecursionlimit()
+        deep = list(det_gen.iterBoundedExpansions(rhs, maxDepth=maxDepth))
+        short = list(det_gen.iterBoundedExpansions(rhs, maxLength=13))
+
+        assert shallow == ["the idea will suffice", "the idea that the idea will suffice will suffice"]
+        # each <S> inside <S> adds 3 levels: <S> <NP> <CP>
+        assert len(deep) == (maxDepth - 2) // 3 + 1
+        assert short == ["the idea will suffice", "the idea that the idea will suffice will suffice"]
+        with pytest.raises(ValueError):
+            next(det_gen.iterBoundedExpansions(rhs))
+
+    def test_bounded_expansion_orders(self):
+        """Test the breadth first and length orders"""
+        det_gen.grammar = parser.getGrammarObject(StringIO("""
+        public <s> = <a> | long long long | <s> and <s>;
+        <a> = b | <c>;
+        <c> = d e;
+        """))
+        rhs = det_gen.grammar.publicRules[0].rhs
+
+        canonical = list(det_gen.iterBoundedExpansions(rhs, maxDepth=2, maxLength=3))
+        breadth = list(det_gen.iterBoundedExpansions(rhs, maxDepth=2, maxLength=3, order="breadth"))
+        length = list(det_gen.iterBoundedExpansions(rhs, maxDepth=2, maxLength=3, order="length"))
+
+        assert canonical == ["b", "d e", "long long long", "b and b"]
+        assert breadth == ["long long long", "b", "d e", "b and b"]
+        assert length == ["b", "d e", "long long long", "b and b"]
+        assert [len(s.split()) for s in length] == sorted(len(s.split()) for s in length)
+
+    def test_unique_in_memory(self):
+        """Test that duplicates are dropped and the first order kept when everything fits"""
+        statistics = {}
+        lines = ["b", "a", "b", "", "c", "a", ""]
+
+        assert list(det_gen.iterUnique(lines, statistics=statistics)) == ["b", "a", "", "c"]
+        assert statistics == {"strings": 7, "unique": 4, "duplicates": 3, "runs": 0}
+
+    @pytest.mark.parametrize("maxMergeRuns", [64, 2])
+    def test_unique_spills_to_disk(self, monkeypatch, tmp_path, maxMergeRuns):
+        """Test deduplication with a memory budget far below the input size"""
+        monkeypatch.setattr(det_gen, "MAX_MERGE_RUNS", maxMergeRuns)
+        lines = ["s%d" % (i * 7 % 50) for i in range(300)] + ["", "s3"]
+        statistics = {}
+
+        result = list(det_gen.iterUnique(lines, maxMemory=200, tempDir=str(tmp_path), statistics=statistics))
+
+        assert sorted(result) == sorted(set(lines))
+        assert statistics["unique"] == 51
+        assert statistics["duplicates"] == 251
+        assert statistics["runs"] > 2
+        assert list(tmp_path.iterdir()) == []
+
+    def test_unique_statistics_when_stopped_early(self):
+        """Test that duplicates are counted as they are read, not after the merge"""
+        lines = ["a", "a", "b", "b", "c", "d", "d", "e", "e", "f", "f", "g"]
+        statistics = {}
+        # three strings fit in memory
+        maxMemory = 3 * (sys.getsizeof("a") + det_gen.SET_ENTRY_SIZE) - 1
+
+        unique = det_gen.iterUnique(lines, maxMemory=maxMemory, statistics=statistics)
+        first = [next(unique) for i in range(5)]
+        unique.close()
+
+        assert first == ["a", "b", "c", "d", "e"]
+        assert statistics["strings"] == 12
+        # the second "f" went to another run and was not merged yet
+        assert statistics["duplicates"] == 4
+        with pytest.raises(ValueError):
+            next(det_gen.iterUnique(lines, maxMemory=0))
+
+    def test_split_expansions(self):
+        """Test that ranges cover the requested strings across public rules"""
+        det_gen.grammar = parser.getGrammarObject(StringIO("""
+        public <a> = ( x | y | z ) ( x | y | z );
+        public <b> = hello | hi;
+        """))
+
+        ranges = list(det_gen.splitExpansions(det_gen.grammar.publicRules, offset=2, limit=8, chunkSize=4))
+
+        assert ranges == [(0, 2, 6), (0, 6, 9), (1, 0, 1)]
+
+    def test_parallel_expansions_keep_order(self):
+        """Test that worker processes produce the single process output"""
+        with open('IdeasNonRecursive.gram', 'r') as f:
+            det_gen.grammar = parser.getGrammarObject(f)
+        expected = det_gen.processRHS(det_gen.grammar.publicRules[0].rhs)
+
+        blocks = list(det_gen.iterParallelExpansions(2, offset=1, limit=10, chunkSize=3))
+
+        assert len(blocks) == 4
+        assert "".join(blocks) == "".join(line + "\n" for line in expected[1:11])
+
+
+class TestDeterministicGeneratorCommandLine:
+    """Test the command line of the deterministic generator"""
+
+    grammar_text = """
+    public <a> = ( x | y | z ) [ w ];
+    public <b> = hello | hi | hello;
+    """
+
+    def run(self, monkeypatch, capsys, tmp_path, *arguments, grammar_text=None):
+        path = tmp_path / "test.gram"
+        path.write_text(grammar_text or self.grammar_text)
+        monkeypatch.setattr(sys, "argv", ["DeterministicGenerator.py", str(path), "--no-cache"] + list(arguments))
+        det_gen.main()
+        output = capsys.readouterr()
+        return output.out.splitlines(), output.err
+
+    def expected(self):
+        grammar = parser.getGrammarObject(StringIO(self.grammar_text))
+        det_gen.grammar = grammar
+        return [s for rule in grammar.publicRules for s in det_gen.processRHS(rule.rhs)]
+
+    @pytest.mark.parametrize("arguments", [[], ["--materialize"], ["--workers", "2"]])
+    @pytest.mark.parametrize("offset,limit", [(0, None), (2, 3), (5, 4), (6, 1), (9, 5)])
+    def test_offset_and_limit(self, monkeypatch, capsys, tmp_path, arguments, offset, limit):
+        """Test that every output mode slices the strings across public rules alike"""
+        expected = self.expected()
+        if offset:
+            arguments = arguments + ["--offset", str(offset)]
+        if limit is not None:
+            arguments = arguments + ["--limit", str(limit)]
+
+        lines, _ = self.run(monkeypatch, capsys, tmp_path, *arguments)
+
+        assert lines == expected[offset:None if limit is None else offset + limit]
+
+    @pytest.mark.parametrize("arguments", [[], ["--materialize"]])
+    def test_ids(self, monkeypatch, capsys, tmp_path, arguments):
+        """Test printing token numbers, sliced like the text"""
+        vocabulary = tmp_path / "vocabulary.txt"
+        expected = self.expected()
+
+        lines, _ = self.run(monkeypatch, capsys, tmp_path, "--ids", "--offset", "2", "--limit", "5",
+                            "--vocabulary", str(vocabulary), *arguments)
+
+        tokens = vocabulary.read_text().splitlines()
+        assert [" ".join(tokens[int(i)] for i in line.split()) for line in lines] == expected[2:7]
+
+    def test_unique(self, monkeypatch, capsys, tmp_path):
+        """Test that --unique drops duplicates before slicing and reports them"""
+        lines, err = self.run(monkeypatch, capsys, tmp_path, "--unique")
+        sliced, _ = self.run(monkeypatch, capsys, tmp_path, "--unique", "--offset", "5", "--limit", "2")
+
+        assert lines == self.expected()[:-1]
+        assert "strings=9 unique=8 duplicates=1 (11.1%)" in err
+        assert sliced == ["z w", "hello"]
+
+    def test_bounded(self, monkeypatch, capsys, tmp_path):
+        """Test enumerating a recursive grammar with a bound"""
+        lines, _ = self.run(monkeypatch, capsys, tmp_path, "--max-length", "8", "--order", "length",
+                            grammar_text=open("Ideas.gram").read())
+
+        assert lines == ["the idea will suffice"]
+
+    def test_automaton(self, monkeypatch, capsys, tmp_path):
+        """Test writing the language as an automaton"""
+        lines, err = self.run(monkeypatch, capsys, tmp_path, "--automaton", str(tmp_path / "test.fsa"))
+
+        assert lines == []
+        assert "strings=8" in err
+        with open(tmp_path / "test.fsa", "rb") as f:
+            automaton = fsa.readAutomaton(f)
+        assert sorted(automaton) == ["hello", "hi", "x", "x w", "y", "y w", "z", "z w"]
+
+    def test_recursive_needs_bound(self, monkeypatch, capsys, tmp_path):
+        """Test that an unbounded recursive grammar asks for a bound"""
+        with pytest.raises(SystemExit) as excinfo:
+            self.run(monkeypatch, capsys, tmp_path, grammar_text=open("Ideas.gram").read())
+
+        assert excinfo.value.code == 2
+        assert "pass --max-depth or --max-length" in capsys.readouterr().err
+
+    def test_order_needs_bound(self, monkeypatch, capsys, tmp_path):
+        """Test that --order without a bound is rejected"""
+        with pytest.raises(SystemExit) as excinfo:
+            self.run(monkeypatch, capsys, tmp_path, "--order", "length")
+
+        assert excinfo.value.code == 2
+        assert "--order needs" in capsys.readouterr().err
+
+    @pytest.mark.parametrize("mode", [[], ["--materialize"], ["--workers", "2"], ["--unique"]])
+    def test_deep_chain(self, monkeypatch, capsys, tmp_path, mode):
+        """Test enumerating a deep non-recursive grammar"""
+        chain = "".join("<r%d> = a <r%d>;\n" % (i, i + 1) for i in range(400))
+        lines, _ = self.run(monkeypatch, capsys, tmp_path, *mode,
+                            grammar_text=chain + "<r400> = end;\npublic <s> = <r0> | x;")
+
+        assert lines == ["a " * 400 + "end", "x"]
 
 class TestProbabilisticGenerator:
     """Test the probabilistic string generator"""
@@ -261,6 +916,918 @@ class TestProbabilisticGenerator:
         # With 20 iterations, we should get at least one of each (with high probability)
         # But we can't guarantee this due to randomness, so we just check validity
 
+    @pytest.mark.parametrize("weights", [[5, 1], [1, 1, 1], [0.5, 0, 3, 2, 0.25], [0, 0, 0], [7]])
+    def test_alias_table(self, weights):
+        """Test that an alias table gives every element its share of the weight"""
+        probabilities, aliases = compiler.buildAliasTable(weights)
+
+        count = len(weights)
+        shares = [0.0] * count
+        for i in range(count):
+            shares[i] += probabilities[i] / count
+            shares[aliases[i]] += (1 - probabilities[i]) / count
+        total = sum(weights) or count
+        expected = [(weight if sum(weights) else 1) / total for weight in weights]
+        assert shares == pytest.approx(expected)
+
+    def test_weight_tables_are_cached(self):
+        """Test that the alias table of a weighted disjunction is built once"""
+        prob_gen.grammar = parser.getGrammarObject(StringIO(self.weighted_grammar_text))
+        disjuncts = prob_gen.grammar.publicRules[0].rhs[0].disjuncts
+
+        assert prob_gen.weightTable(disjuncts) is prob_gen.weightTable(disjuncts)
+        assert prob_gen.weightTable(list(disjuncts)) is not prob_gen.weightTable(list(disjuncts))
+        assert prob_gen.weightedChoice([("only", 0), ("other", 0)]) in ("only", "other")
+
+
+    def test_deep_chain(self):
+        """Test sampling a grammar nested deeper than the interpreter stack"""
+        chain = "".join("<r%d> = a <r%d>;\n" % (i, i + 1) for i in range(3000))
+        prob_gen.grammar = parser.getGrammarObject(StringIO(chain + "<r3000> = end;\npublic <s> = <r0>;"))
+
+        assert prob_gen.processRHS(prob_gen.grammar.publicRules[0].rhs) == "a " * 3000 + "end"
+
+    def test_bounded_sample(self):
+        """Test that sampled strings stay within the depth and length bounds"""
+        import random
+        prob_gen.grammar = parser.getGrammarObject(StringIO("public <a> = x | <a> <a>;"))
+        rhs = prob_gen.grammar.publicRules[0].rhs
+        rng = random.Random(4)
+
+        lengths = [len(prob_gen.sample(rhs, maxLength=6, rng=rng).split()) for _ in range(200)]
+        assert max(lengths) <= 6
+        assert len(set(lengths)) > 1
+        # a depth of 2 allows at most 4 leaves
+        assert all(len(prob_gen.sample(rhs, maxDepth=2, rng=rng).split()) <= 4 for _ in range(200))
+        assert prob_gen.sampleTokens(rhs, maxDepth=0, rng=random.Random(0)) in (["x"], None)
+
+    def test_bounded_sample_gives_up(self):
+        """Test that bounds no derivation fits in are reported"""
+        prob_gen.grammar = parser.getGrammarObject(StringIO("public <a> = x <a> | x x x x;"))
+
+        with pytest.raises(ValueError):
+            prob_gen.sample(prob_gen.grammar.publicRules[0].rhs, maxLength=3, maxAttempts=50)
+
+    def test_expected_lengths(self):
+        """Test the expected lengths of rules and the detection of divergent grammars"""
+        with open('Ideas.gram', 'r') as f:
+            prob_gen.grammar = parser.getGrammarObject(f)
+        lengths = prob_gen.expectedLengths()
+        assert lengths["<S>"] == pytest.approx(5)
+        assert lengths["<NP>"] == pytest.approx(3)
+        assert prob_gen.divergentRules() == []
+
+        prob_gen.grammar = parser.getGrammarObject(StringIO(
+            "public <a> = <b> | y;\n<b> = /1/ x | /1/ <b> <b> [ z ];\npublic <c> = [ <d> ] w;\n<d> = v;"))
+        lengths = prob_gen.expectedLengths()
+        assert lengths["<b>"] == prob_gen.INFINITY
+        assert lengths["<d>"] == 1
+        assert prob_gen.divergentRules() == ["<a>"]
+
+    def test_divergence_warning(self, monkeypatch, capsys, tmp_path):
+        """Test that main warns about divergent grammars unless bounds are given"""
+        path = tmp_path / "divergent.gram"
+        path.write_text("public <a> = /1/ x | /2/ <a> <a>;")
+
+        monkeypatch.setattr(sys, "argv", ["ProbabilisticGenerator.py", str(path), "0", "--no-cache"])
+        prob_gen.main()
+        assert "expected length of <a> is infinite" in capsys.readouterr().err
+
+        monkeypatch.setattr(sys, "argv", ["ProbabilisticGenerator.py", str(path), "3", "--no-cache",
+                                          "--max-depth", "5", "--max-length", "8", "--ids"])
+        prob_gen.main()
+        captured = capsys.readouterr()
+        assert captured.err == ""
+        assert all(len(line.split()) <= 8 for line in captured.out.splitlines())
+        assert len(captured.out.splitlines()) == 3
+
+    def test_bloom_filter(self):
+        """Test that the Bloom filter grows past its capacity and keeps its error rate"""
+        bloom = prob_gen.ScalableBloomFilter(100, errorRate=0.01)
+
+        added = sum(bloom.add("sentence %d" % i) for i in range(5000))
+
+        assert added > 4900
+        assert len(bloom) == added
+        assert len(bloom.filters) > 1
+        assert all("sentence %d" % i in bloom for i in range(5000))
+        assert not bloom.add("sentence 7")
+        falsePositives = sum("other %d" % i in bloom for i in range(10000))
+        assert falsePositives < 200
+
+    def test_unique_samples(self):
+        """Test that repeated strings are dropped and the stream stops when exhausted"""
+        lines = ["a", "b", "a", "c", "b"] + ["a"] * 20 + ["d"]
+        statistics = {}
+
+        assert list(prob_gen.iterUniqueSamples(lines, patience=10, statistics=statistics)) == ["a", "b", "c"]
+        assert statistics == {"drawn": 14, "unique": 3, "duplicates": 11, "bloom": False, "exhausted": True}
+        assert list(prob_gen.iterUniqueSamples(lines, n=2)) == ["a", "b"]
+        assert list(prob_gen.iterUniqueSamples(lines, maxMemory=1, statistics=statistics)) == ["a", "b", "c", "d"]
+        assert statistics["bloom"] is True
+        assert "exhausted" not in prob_gen.formatUniqueStatistics(statistics)
+
+    def test_unique_command_line(self, monkeypatch, capsys):
+        """Test that --unique prints distinct strings and stops once the language is exhausted"""
+        monkeypatch.setattr(sys, "argv", ["ProbabilisticGenerator.py", "IdeasNonRecursive.gram", "1000",
+                                          "--unique", "--seed", "2", "--patience", "5000", "--no-cache"])
+
+        prob_gen.main()
+
+        captured = capsys.readouterr()
+        lines = captured.out.splitlines()
+        assert len(lines) == len(set(lines)) == 12
+        assert "unique=12" in captured.err
+        assert "exhausted" in captured.err
+
+    def test_sample_batch(self):
+        """Test that a batch holds strings of the language and depends only on the seed"""
+        with open('IdeasNonRecursive.gram', 'r') as f:
+            grammar = parser.getGrammarObject(f)
+        det_gen.grammar = grammar
+        language = set(det_gen.processRHS(grammar.publicRules[0].rhs))
+
+        batch = prob_gen.sampleBatch(grammar, 2000, seed=5)
+
+        assert len(batch) == 2000
+        assert set(batch) <= language
+        assert len(set(batch)) > 1
+        assert prob_gen.sampleBatch(grammar, 2000, seed=5) == batch
+        assert prob_gen.sampleBatch(grammar, 0, seed=5) == []
+
+    def test_sample_batch_distribution(self):
+        """Test that batches follow the weights and the optional coin flips"""
+        grammar = parser.getGrammarObject(StringIO("public <start> = ( /3/ a | /1/ b ) [ c ];"))
+
+        batch = prob_gen.sampleBatch(grammar, 20000, seed=1)
+
+        assert 0.72 < sum(s.startswith("a") for s in batch) / 20000 < 0.78
+        assert 0.47 < sum(s.endswith("c") for s in batch) / 20000 < 0.53
+
+    def test_command_line_batches(self, monkeypatch, capsys):
+        """Test that main prints the number of strings asked for across batches"""
+        iterations = prob_gen.SAMPLE_BATCH_SIZE + 5
+        monkeypatch.setattr(sys, "argv", ["ProbabilisticGenerator.py", "IdeasNonRecursive.gram",
+                                          str(iterations), "--no-cache"])
+
+        prob_gen.main()
+
+        lines = capsys.readouterr().out.splitlines()
+        assert len(lines) == iterations
+        assert all(line.startswith("the idea") for line in lines)
+
+    def test_seeded_workers(self):
+        """Test that a seed gives the same strings whatever the number of workers"""
+        with open('Ideas.gram', 'r') as f:
+            prob_gen.grammar = parser.getGrammarObject(f)
+
+        single = ''.join(prob_gen.iterSamples(250, 11, chunkSize=40))
+        parallel = ''.join(prob_gen.iterSamples(250, 11, workers=2, chunkSize=40))
+
+        assert parallel == single
+        assert single.count('\n') == 250
+        assert ''.join(prob_gen.iterSamples(250, 12, chunkSize=40)) != single
+
+    def test_seed_command_line(self, monkeypatch, capsys):
+        """Test that --seed prints the strings of sampleBatch with the same seed"""
+        monkeypatch.setattr(sys, "argv", ["ProbabilisticGenerator.py", "Ideas.gram", "30",
+                                          "--seed", "3", "--workers", "2", "--no-cache"])
+
+        prob_gen.main()
+
+        with open('Ideas.gram', 'r') as f:
+            expected = prob_gen.sampleBatch(parser.getGrammarObject(f), 30, seed=3)
+        assert capsys.readouterr().out.splitlines() == expected
+
+    def test_uniform_finite(self):
+        """Test that every string of a finite language is drawn equally often"""
+        import random
+        grammar = parser.getGrammarObject(StringIO(
+            "public <s> = a | b <x>;\n<x> = /9/ c | /1/ d | /1/ e | /1/ [ f ];"))
+        rhs = grammar.publicRules[0].rhs
+        sampler = prob_gen.UniformSampler(grammar)
+        det_gen.grammar = grammar
+        rng = random.Random(6)
+
+        counts = Counter(sampler.sample(rhs, rng) for _ in range(12000))
+
+        assert sampler.count(rhs) == det_gen.countExpansions(rhs) == 6
+        assert set(counts) == set(det_gen.processRHS(rhs))
+        assert all(1700 < count < 2300 for count in counts.values())
+
+    def test_uniform_bounded(self):
+        """Test that a recursive language is drawn uniformly up to a length"""
+        import random
+        grammar = parser.getGrammarObject(StringIO("public <s> = a | <s> b | x <s> y;"))
+        rhs = grammar.publicRules[0].rhs
+        sampler = prob_gen.UniformSampler(grammar, maxLength=5)
+        rng = random.Random(7)
+
+        counts = Counter(sampler.sample(rhs, rng) for _ in range(12000))
+
+        assert sampler.count(rhs) == len(counts) == 12
+        assert all(len(string.split()) <= 5 for string in counts)
+        assert all(800 < count < 1200 for count in counts.values())
+        with pytest.raises(ValueError):
+            prob_gen.UniformSampler(grammar).sample(rhs)
+        with pytest.raises(ValueError):
+            prob_gen.UniformSampler(parser.getGrammarObject(StringIO(
+                "public <s> = a | <t>;\n<t> = <s> | [ b ] <s>;")), maxLength=3)
+
+    def test_uniform_command_line(self, monkeypatch, capsys):
+        """Test that --uniform samples recursive grammars within --max-length"""
+        monkeypatch.setattr(sys, "argv", ["ProbabilisticGenerator.py", "Ideas.gram", "200", "--uniform",
+                                          "--max-length", "20", "--seed", "1", "--no-cache"])
+
+        prob_gen.main()
+
+        lines = capsys.readouterr().out.splitlines()
+        assert len(lines) == 200
+        assert all(len(line.split()) <= 20 for line in lines)
+        assert len(set(lines)) == 4
+
+
+class TestGeneratorObjects:
+    """Test the generator classes, which own their grammar, in threads and asyncio"""
+
+    greetings = "public <start> = <greeting> <target>;\n<greeting> = hello | hi;\n<target> = world | there;"
+    commands = "public <start> = [ please ] ( show | find ) <thing>;\n<thing> = /2/ songs | /1/ [ my ] files;"
+
+    def test_deterministic_generators(self):
+        """Test that generators of different grammars match the module functions"""
+        first = det_gen.DeterministicGenerator(parser.getGrammarObject(StringIO(self.greetings)))
+        second = det_gen.DeterministicGenerator(parser.getGrammarObject(StringIO(self.commands)))
+
+        for generator in (first, second):
+            det_gen.grammar = generator.grammar
+            rhs = generator.grammar.publicRules[0].rhs
+            assert generator.processRHS(rhs) == det_gen.processRHS(rhs)
+            assert list(generator.iterExpansions(rhs)) == generator.processRHS(rhs)
+            assert generator.countExpansions(rhs) == len(generator.processRHS(rhs))
+            assert generator.expansionAt(rhs, 3) == generator.processRHS(rhs)[3]
+            assert list(generator.iterExpansionsFrom(rhs, 2)) == generator.processRHS(rhs)[2:]
+        assert first.countRules() == {"<start>": 4}
+
+    def test_rule_counts_follow_replaced_rules(self):
+        """Test that the counts a generator keeps are dropped when a rule is redefined"""
+        grammar = parser.getGrammarObject(StringIO(self.greetings))
+        generator = det_gen.DeterministicGenerator(grammar)
+        rhs = grammar.publicRules[0].rhs
+        assert generator.countExpansions(rhs) == 4
+
+        grammar.replaceRule(gram.Rule(gram.NonTerminal("<target>"), [gram.Disjunction(["a", "b", "c"])]))
+
+        assert generator.countExpansions(rhs) == 6
+        assert generator.processRHS(rhs)[-1] == "hi c"
+
+    def test_threads(self):
+        """Test that generators shared by threads give the same results as in one thread"""
+        from concurrent.futures import ThreadPoolExecutor
+        generators = [det_gen.DeterministicGenerator(parser.getGrammarObject(StringIO(text)))
+                      for text in (self.greetings, self.commands)]
+
+        def work(i):
+            generator = generators[i % 2]
+            rhs = generator.grammar.publicRules[0].rhs
+            return (generator.processRHS(rhs), list(generator.iterExpansions(rhs)),
+                    [generator.expansionAt(rhs, index) for index in range(generator.countExpansions(rhs))])
+
+        expected = [work(0), work(1)]
+        with ThreadPoolExecutor(8) as pool:
+            results = list(pool.map(work, range(200)))
+
+        assert all(result == expected[i % 2] for i, result in enumerate(results))
+
+    def test_recursion_limit_in_threads(self):
+        """Test that the recursion limit is restored when the last thread leaves its block"""
+        import threading
+        saved = sys.getrecursionlimit()
+        entered = threading.Event()
+        leave = threading.Event()
+
+        def hold():
+            with parser.recursionLimit(saved + 5000):
+                entered.set()
+                leave.wait()
+
+        thread = threading.Thread(target=hold)
+        thread.start()
+        entered.wait()
+        with parser.recursionLimit(saved + 1000):
+            assert sys.getrecursionlimit() == saved + 5000
+        assert sys.getrecursionlimit() == saved + 5000
+        leave.set()
+        thread.join()
+
+        assert sys.getrecursionlimit() == saved
+
+    def test_probabilistic_generators(self):
+        """Test that a generator's strings depend on its seed and match the module functions"""
+        grammar = parser.getGrammarObject(StringIO(self.commands))
+        rhs = grammar.publicRules[0].rhs
+
+        strings = [prob_gen.ProbabilisticGenerator(grammar, seed=4).processRHS(rhs) for _ in range(2)]
+        generator = prob_gen.ProbabilisticGenerator(grammar, seed=4)
+
+        assert strings[0] == strings[1]
+        assert [generator.processRHS(rhs) for _ in range(50)] != [strings[0]] * 50
+        assert generator.sampleBatch(100, seed=8) == prob_gen.sampleBatch(grammar, 100, seed=8)
+        prob_gen.grammar = grammar
+        assert ''.join(generator.iterSamples(30, 9)) == ''.join(prob_gen.iterSamples(30, 9))
+        assert generator.divergentRules() == []
+
+    def test_probabilistic_threads(self):
+        """Test that seeded calls give the same strings from any thread"""
+        from concurrent.futures import ThreadPoolExecutor
+        generator = prob_gen.ProbabilisticGenerator(parser.getGrammarObject(StringIO(self.commands)))
+
+        def work(seed):
+            return generator.sampleBatch(500, seed), ''.join(generator.iterSamples(50, seed, uniform=True))
+
+        with ThreadPoolExecutor(4) as pool:
+            results = list(pool.map(work, [1, 2] * 20))
+
+        assert all(result == results[i % 2] for i, result in enumerate(results))
+        assert results[0] != results[1]
+
+    def test_command_lines_keep_module_grammars(self, monkeypatch, capsys):
+        """Test that the command lines use their own generators, not the module grammars"""
+        sentinel = parser.getGrammarObject(StringIO("public <a> = unchanged;"))
+        monkeypatch.setattr(det_gen, "grammar", sentinel, raising=False)
+        monkeypatch.setattr(prob_gen, "grammar", sentinel, raising=False)
+
+        monkeypatch.setattr(sys, "argv", ["DeterministicGenerator.py", "IdeasNonRecursive.gram", "--no-cache"])
+        det_gen.main()
+        monkeypatch.setattr(sys, "argv", ["ProbabilisticGenerator.py", "Ideas.gram", "5", "--seed", "1", "--no-cache"])
+        prob_gen.main()
+
+        assert len(capsys.readouterr().out.splitlines()) == 13 + 5
+        assert det_gen.grammar is sentinel and prob_gen.grammar is sentinel
+
+    def test_async_streams(self):
+        """Test that strings are streamed to asyncio consumers without blocking the event loop"""
+        import asyncio
+        deterministic = det_gen.DeterministicGenerator(parser.getGrammarObject(StringIO(self.commands)))
+        probabilistic = prob_gen.ProbabilisticGenerator(deterministic.grammar)
+        rhs = deterministic.grammar.publicRules[0].rhs
+
+        async def collect(stream, limit=None):
+            strings = []
+            async for string in stream:
+                strings.append(string)
+                if len(strings) == limit:
+                    break
+            await stream.aclose()
+            return strings
+
+        async def main():
+            ticks = 0
+            async def tick():
+                nonlocal ticks
+                while True:
+                    ticks += 1
+                    await asyncio.sleep(0)
+            ticker = asyncio.ensure_future(tick())
+            results = await asyncio.gather(
+                collect(deterministic.aiterExpansions(rhs, blockSize=2)),
+                collect(probabilistic.aiterSamples(10000, seed=3, blockSize=1000)),
+                collect(probabilistic.aiterSamples(None, seed=3, blockSize=100), limit=250))
+            ticker.cancel()
+            return results, ticks
+
+        (expansions, samples, endless), ticks = asyncio.run(main())
+
+        assert expansions == deterministic.processRHS(rhs)
+        assert samples == ''.join(probabilistic.iterSamples(10000, 3)).splitlines()
+        assert endless == samples[:250]
+        assert ticks > 10
+
+
+class TestJSGFCompiler:
+    """Test the compiled program and its explicit-stack generators"""
+
+    grammars = [
+        "public <start> = hello world;",
+        "public <start> = <greeting> <target>;\n<greeting> = hello | hi;\n<target> = world | there;",
+        "public <start> = (x | y) [z w] <b> | q;\n<b> = /1/ m | /3/ n o | /0.5/ [p];",
+        "public <start> = [ please ] <v> [ [ now ] ];\n<v> = ( show | find ) me | go;",
+    ]
+
+    @pytest.mark.parametrize("grammar_text", grammars)
+    def test_expand_matches_deterministic_generator(self, grammar_text):
+        """Test that the program enumerates the same strings in the same order"""
+        det_gen.grammar = parser.getGrammarObject(StringIO(grammar_text))
+        program = compiler.compileGrammar(det_gen.grammar)
+
+        expected = det_gen.processRHS(det_gen.grammar.publicRules[0].rhs)
+        assert program.expand(program.publicRoots[0]) == expected
+        assert list(program.iterExpand(program.publicRoots[0])) == expected
+
+    @pytest.mark.parametrize("grammar_text", grammars)
+    def test_sample_matches_probabilistic_generator(self, grammar_text):
+        """Test that the program draws the same strings from the same random state"""
+        import random
+        prob_gen.grammar = parser.getGrammarObject(StringIO(grammar_text))
+        program = compiler.compileGrammar(prob_gen.grammar)
+        rhs = prob_gen.grammar.publicRules[0].rhs
+
+        random.seed(7)
+        expected = [prob_gen.processRHS(rhs) for _ in range(200)]
+        random.seed(7)
+        assert [program.sample(program.publicRoots[0]) for _ in range(200)] == expected
+
+    def test_batch_choices_stay_in_range(self):
+        """Test that a random number rounding up to the number of alternatives picks the last one"""
+        import random
+
+        class Highest(random.Random):
+            def random(self):
+                return 1.0
+
+        grammar = parser.getGrammarObject(StringIO(
+            "public <a> = x | y <b>;\n<b> = /1/ p | /2/ q | /3/ r;"))
+        program = compiler.compileGrammar(grammar)
+
+        assert program.sampleBatch(program.publicRoots[0], 3, Highest()) == ["y r"] * 3
+
+    def test_program_layout(self):
+        """Test that the program is stored in flat arrays with shared nodes compiled once"""
+        grammar = parser.getGrammarObject(StringIO(
+            "public <a> = [ please ] show | [ please ] find;"))
+        program = compiler.compileGrammar(grammar)
+
+        assert program.kinds.typecode == 'b'
+        assert program.children.typecode == 'l'
+        assert program.kinds.tolist().count(compiler.OPTIONAL) == 1
+        assert program.tokens == ["please", "show", "find"]
+        assert program.rootOf("<a>") == program.publicRoots[0]
+
+    def test_token_ids(self):
+        """Test that sentences as token numbers detokenize to the same strings"""
+        import random
+        grammar = parser.getGrammarObject(StringIO(self.grammars[3]))
+        program = compiler.compileGrammar(grammar)
+        root = program.publicRoots[0]
+        vocabulary = grammar.vocabulary
+
+        expanded = program.expandIds(root)
+        assert all(ids.typecode == 'l' for ids in expanded)
+        assert [vocabulary.detokenize(ids) for ids in expanded] == program.expand(root)
+        assert [vocabulary.detokenize(ids) for ids in program.iterExpandIds(root)] == program.expand(root)
+        random.seed(3)
+        sampled = [vocabulary.detokenize(program.sampleIds(root)) for _ in range(50)]
+        random.seed(3)
+        assert sampled == [program.sample(root) for _ in range(50)]
+
+    def test_recursive_expression(self):
+        """Test that exhaustive expansion of a recursive rule is refused"""
+        with open('Ideas.gram', 'r') as f:
+            program = compiler.compileGrammar(parser.getGrammarObject(f))
+
+        with pytest.raises(ValueError):
+            program.expand(program.publicRoots[0])
+
+    def test_undefined_nonterminal(self):
+        """Test that expanding an undefined rule raises an error"""
+        program = compiler.compileGrammar(parser.getGrammarObject(StringIO("public <start> = <undefined>;")))
+
+        with pytest.raises(ValueError):
+            program.expand(program.publicRoots[0])
+        with pytest.raises(ValueError):
+            list(program.iterExpand(program.publicRoots[0]))
+        with pytest.raises(ValueError):
+            program.sample(program.publicRoots[0])
+
+
+class TestJSGFAutomaton:
+    """Test the minimal automaton of a grammar's language"""
+
+    grammars = TestJSGFCompiler.grammars + [
+        "public <a> = hello | hello [ there ];\npublic <b> = hello there | hi;",
+    ]
+
+    @pytest.mark.parametrize("grammar_text", grammars)
+    def test_strings_match_deterministic_generator(self, grammar_text):
+        """Test that the automaton holds the distinct strings of the public rules"""
+        det_gen.grammar = parser.getGrammarObject(StringIO(grammar_text))
+        expected = set()
+        for rule in det_gen.grammar.publicRules:
+            expected.update(det_gen.processRHS(rule.rhs))
+
+        automaton = fsa.buildAutomaton(det_gen.grammar)
+
+        strings = list(automaton)
+        assert sorted(strings) == sorted(expected)
+        assert automaton.count() == len(expected)
+        assert all(string in automaton for string in expected)
+
+    def test_automaton_is_minimal(self):
+        """Test that states with the same continuations are merged"""
+        grammar = parser.getGrammarObject(StringIO(
+            "public <a> = ( a | b ) ( c | d ) [ e ];\npublic <b> = f c | f d e;"))
+
+        automaton = fsa.buildAutomaton(grammar)
+
+        # start, {c, d}{, e}, {c, d e}, {, e}, {e} and the end
+        assert automaton.numStates() == 6
+        assert automaton.numTransitions() == 9
+
+    def test_membership(self):
+        """Test strings outside the language, including unknown tokens"""
+        grammar = parser.getGrammarObject(StringIO("public <a> = hello [ world ];"))
+        automaton = fsa.buildAutomaton(grammar)
+
+        assert "hello" in automaton
+        assert "hello  world" in automaton
+        assert "world" not in automaton
+        assert "" not in automaton
+        assert "hello there" not in automaton
+        assert automaton.acceptsIds([grammar.vocabulary["hello"], grammar.vocabulary["world"]])
+
+    def test_write_and_read(self, tmp_path):
+        """Test that a written automaton reads back to the same language"""
+        with open('IdeasNonRecursive.gram', 'r') as f:
+            automaton = fsa.buildAutomaton(parser.getGrammarObject(f))
+        path = tmp_path / "ideas.fsa"
+        with open(path, "wb") as f:
+            automaton.write(f)
+
+        with open(path, "rb") as f:
+            loaded = fsa.readAutomaton(f)
+
+        assert list(loaded) == list(automaton)
+        assert loaded.tokens == automaton.tokens
+        assert loaded.labels.itemsize == 1
+        assert path.stat().st_size < sum(len(string) + 1 for string in automaton)
+
+    def test_read_rejects_other_files(self):
+        """Test that a file without the automaton header is refused"""
+        from io import BytesIO
+        with pytest.raises(ValueError):
+            fsa.readAutomaton(BytesIO(b"public <a> = b;"))
+        with pytest.raises(ValueError):
+            fsa.readAutomaton(BytesIO(fsa.MAGIC + b"\0" * 4))
+
+    def test_recursive_grammar(self):
+        """Test that a recursive grammar is refused"""
+        with open('Ideas.gram', 'r') as f:
+            grammar = parser.getGrammarObject(f)
+
+        with pytest.raises(ValueError):
+            fsa.buildAutomaton(grammar)
+
+
+class TestJSGFRecognizer:
+    """Test the recognizer of the strings of a grammar"""
+
+    @pytest.mark.parametrize("grammar_text", TestJSGFAutomaton.grammars)
+    def test_agrees_with_automaton(self, grammar_text):
+        """Test the strings of the grammar and sentences close to them"""
+        grammar = parser.getGrammarObject(StringIO(grammar_text))
+        automaton = fsa.buildAutomaton(grammar)
+        sentences = []
+        for string in automaton:
+            tokens = string.split()
+            sentences += [string, ' '.join(tokens[:-1]), ' '.join(tokens[1:]), string + ' ' + tokens[0],
+                          ' '.join(tokens[::-1]), string.replace(tokens[-1], 'unknown')]
+
+        matcher = recognizer.Recognizer(grammar)
+
+        assert all(matcher.matches(string) for string in automaton)
+        assert matcher.matchAll(sentences) == [sentence in automaton for sentence in sentences]
+
+    def test_right_recursion(self):
+        """Test rules that use themselves at their end, against the bounded expansions"""
+        import itertools
+        grammar = parser.getGrammarObject(StringIO(
+            "public <s> = <n> and <n>;\n<n> = x | y [ <n> ] | ( z <m> );\n<m> = w [ <n> ];"))
+        generator = det_gen.DeterministicGenerator(grammar)
+        language = set(generator.iterBoundedExpansions(grammar.publicRules[0].rhs, maxLength=6))
+
+        matcher = recognizer.Recognizer(grammar)
+
+        for length in range(7):
+            for tokens in itertools.product(['x', 'y', 'z', 'w', 'and'], repeat=length):
+                assert matcher.matches(list(tokens)) == (' '.join(tokens) in language)
+        assert matcher.matches('y ' * 10000 + 'x and x')
+
+    @pytest.mark.parametrize("grammar_text", [
+        "public <l> = <l> a | b;",
+        "public <s> = ( open <t> close ) | x;\n<t> = <s> [ <s> ];",
+    ])
+    def test_rejects_other_recursion(self, grammar_text):
+        """Test that rules using themselves before their end are refused"""
+        grammar = parser.getGrammarObject(StringIO(grammar_text))
+
+        with pytest.raises(ValueError, match="before its end"):
+            recognizer.Recognizer(grammar)
+
+    def test_undefined_rule(self):
+        """Test that a rule using an undefined rule is refused"""
+        grammar = parser.getGrammarObject(StringIO("public <a> = b <c>;"))
+
+        with pytest.raises(ValueError, match="<c>"):
+            recognizer.Recognizer(grammar)
+
+    def test_state_limit(self):
+        """Test that dropping the states past maxStates keeps the answers"""
+        with open('IdeasNonRecursive.gram', 'r') as f:
+            grammar = parser.getGrammarObject(f)
+        automaton = fsa.buildAutomaton(grammar)
+        sentences = [string for string in automaton] + [' '.join(string.split()[:-1]) for string in automaton]
+
+        matcher = recognizer.Recognizer(grammar, maxStates=3)
+
+        assert matcher.matchAll(sentences) == [sentence in automaton for sentence in sentences]
+        assert matcher.numStates()[1] <= 3
+
+    def test_threads(self):
+        """Test that threads sharing a recognizer get the answers of one thread"""
+        from concurrent.futures import ThreadPoolExecutor
+        with open('IdeasNonRecursive.gram', 'r') as f:
+            grammar = parser.getGrammarObject(f)
+        automaton = fsa.buildAutomaton(grammar)
+        sentences = [string for string in automaton for i in range(20)]
+        sentences += [string + ' again' for string in sentences]
+        expected = recognizer.Recognizer(grammar).matchAll(sentences)
+
+        matcher = recognizer.Recognizer(grammar, maxStates=4)
+        with ThreadPoolExecutor(4) as executor:
+            results = list(executor.map(matcher.matchAll, [sentences] * 8))
+
+        assert results == [expected] * 8
+
+    def test_command_line(self, monkeypatch, capsys, tmp_path):
+        """Test printing and counting the matching lines of a corpus"""
+        corpus = tmp_path / "corpus.txt"
+        corpus.write_text("the idea can suffice\nthe idea suffice\n\nsuffice the idea can\n")
+
+        monkeypatch.setattr(sys, "argv", ["JSGFRecognizer.py", "IdeasNonRecursive.gram", str(corpus), "--no-cache"])
+        recognizer.main()
+        assert capsys.readouterr().out == "the idea can suffice\n"
+
+        monkeypatch.setattr(sys, "argv", ["JSGFRecognizer.py", "IdeasNonRecursive.gram", str(corpus),
+                                          "--no-cache", "--invert", "--count"])
+        recognizer.main()
+        assert capsys.readouterr().out == "3\n"
+
+
+class TestJSGFEarley:
+    """Test the Earley parser"""
+
+    def test_tree(self):
+        """Test the rules and spans of the most probable parse"""
+        with open('IdeasNonRecursive.gram', 'r') as f:
+            grammar = parser.getGrammarObject(f)
+
+        result = earley.EarleyParser(grammar).parse("the idea that the idea might suffice should suffice")
+
+        assert str(result.tree) == ("(<S> (<NP> the idea (<CP> that (<S2> (<NP2> the idea) (<VP> (<Modal> might) "
+                                    "suffice)))) (<VP> (<Modal> should) suffice))")
+        modal = result.tree.find("<Modal>")
+        assert (modal.text(), modal.start, modal.end) == ("might", 5, 6)
+        assert [node.text() for node in result.tree.findAll("<VP>")] == ["might suffice", "should suffice"]
+        assert result.tree.tokens() == "the idea that the idea might suffice should suffice".split()
+        # <NP> <VP> of two alternatives, /1/ of /6/ for <NP>, then /5/ and /15/ of /30/ for the modals
+        assert result.probability == pytest.approx(1 / 2 * 1 / 6 * 5 / 30 * 15 / 30)
+        assert result.sentenceProbability == pytest.approx(result.probability)
+
+    @pytest.mark.parametrize("grammar_text", TestJSGFCompiler.grammars + [
+        "public <a> = hello | hello [ there ];\npublic <b> = hello there | hi;",
+    ])
+    def test_probabilities_sum_to_one(self, grammar_text):
+        """Test that the sentence probabilities of a finite language add up to one"""
+        grammar = parser.getGrammarObject(StringIO(grammar_text))
+        language = set(fsa.buildAutomaton(grammar))
+
+        results = earley.EarleyParser(grammar).parseAll(language)
+
+        assert sum(result.sentenceProbability for result in results) == pytest.approx(1.0)
+        assert all(result.probability <= result.sentenceProbability * (1 + 1e-12) for result in results)
+
+    def test_ambiguity(self):
+        """Test the most probable of several derivations and the enumeration of all of them"""
+        grammar = parser.getGrammarObject(StringIO(
+            "public <s> = /3/ <a> | /1/ <b>;\n<a> = x [ y ];\n<b> = x y;"))
+        earleyParser = earley.EarleyParser(grammar)
+
+        result = earleyParser.parse("x y")
+
+        assert str(result.tree) == "(<s> (<a> x y))"
+        assert result.probability == pytest.approx(0.75 * 0.5)
+        assert result.sentenceProbability == pytest.approx(0.75 * 0.5 + 0.25)
+        assert sorted(str(tree) for tree in earleyParser.iterTrees("x y")) == ["(<s> (<a> x y))", "(<s> (<b> x y))"]
+
+    @pytest.mark.parametrize("grammar_text,sentence,tree,probability", [
+        ("public <l> = <l> a | b;", "b a a", "(<l> (<l> (<l> b) a) a)", 0.125),
+        ("public <s> = ( open <s> close ) | x;", "open open x close close",
+         "(<s> open (<s> open (<s> x) close) close)", 0.125),
+        # <s> derives x directly and through <a> and <s> again, endlessly
+        ("public <s> = <a> | x;\n<a> = <s> | [ <s> ] y;", "x", "(<s> x)", 2 / 3),
+    ])
+    def test_recursion(self, grammar_text, sentence, tree, probability):
+        """Test left, center and cyclic recursion"""
+        grammar = parser.getGrammarObject(StringIO(grammar_text))
+
+        result = earley.EarleyParser(grammar).parse(sentence)
+
+        assert str(result.tree) == tree
+        assert result.sentenceProbability == pytest.approx(probability)
+
+    def test_agrees_with_recognizer(self):
+        """Test that the parser accepts the sentences the recognizer accepts"""
+        import itertools
+        grammar = parser.getGrammarObject(StringIO(
+            "public <s> = <n> and <n>;\n<n> = x | y [ <n> ] | ( z <m> );\n<m> = w [ <n> ];"))
+        matcher = recognizer.Recognizer(grammar)
+        earleyParser = earley.EarleyParser(grammar)
+        sentences = [list(tokens) for length in range(6)
+                     for tokens in itertools.product(['x', 'y', 'z', 'w', 'and'], repeat=length)]
+
+        results = earleyParser.parseAll(sentences)
+
+        assert [result is not None for result in results] == matcher.matchAll(sentences)
+        assert [earleyParser.matches(sentence) for sentence in sentences] == matcher.matchAll(sentences)
+
+    def test_batch(self):
+        """Test that parsing in a reused chart gives the results of separate parses"""
+        with open('Ideas.gram', 'r') as f:
+            grammar = parser.getGrammarObject(f)
+        sentences = prob_gen.ProbabilisticGenerator(grammar).sampleBatch(300, seed=1)
+        sentences += [sentence + " suffice" for sentence in sentences[:50]] + ["", "the idea"]
+        earleyParser = earley.EarleyParser(grammar)
+        expected = [earleyParser.parse(sentence) for sentence in sentences]
+
+        for results in (earleyParser.parseAll(sentences), list(earleyParser.iterParses(sentences))):
+            assert [result and (str(result.tree), result.sentenceProbability) for result in results] == \
+                [result and (str(result.tree), result.sentenceProbability) for result in expected]
+        assert all(expected[:300])
+
+    def test_threads(self):
+        """Test that threads sharing a parser get the results of one thread"""
+        from concurrent.futures import ThreadPoolExecutor
+        with open('Ideas.gram', 'r') as f:
+            grammar = parser.getGrammarObject(f)
+        sentences = prob_gen.ProbabilisticGenerator(grammar).sampleBatch(200, seed=2)
+        expected = [str(result.tree) for result in earley.EarleyParser(grammar).parseAll(sentences)]
+
+        earleyParser = earley.EarleyParser(grammar)
+        with ThreadPoolExecutor(4) as executor:
+            results = list(executor.map(earleyParser.parseAll, [sentences] * 4))
+
+        assert [[str(result.tree) for result in batch] for batch in results] == [expected] * 4
+
+    def test_undefined_rule(self):
+        """Test that a rule using an undefined rule is refused"""
+        grammar = parser.getGrammarObject(StringIO("public <a> = b <c>;"))
+
+        with pytest.raises(ValueError, match="<c>"):
+            earley.EarleyParser(grammar)
+
+    def test_command_line(self, monkeypatch, capsys, tmp_path):
+        """Test printing the parse of each line of a corpus"""
+        corpus = tmp_path / "corpus.txt"
+        corpus.write_text("the idea can suffice\nthe idea suffice\n")
+        monkeypatch.setattr(sys, "argv", ["JSGFEarley.py", "IdeasNonRecursive.gram", str(corpus), "--no-cache"])
+
+        earley.main()
+
+        assert capsys.readouterr().out.splitlines() == ["(<S> (<thing> the idea can suffice))\t0.638889", "-"]
+
+
+class TestJSGFCache:
+    """Test the on-disk cache of parsed grammars"""
+
+    @pytest.fixture(autouse=True)
+    def enable_cache(self, monkeypatch):
+        """Run the tests with the cache enabled, whatever the environment"""
+        monkeypatch.delenv("JSGF_NO_CACHE", raising=False)
+
+    def write_grammar(self, tmp_path, text):
+        path = tmp_path / "test.gram"
+        path.write_text(text)
+        return str(path)
+
+    def test_second_load_skips_parsing(self, tmp_path, monkeypatch):
+        """Test that a cached grammar is loaded without parsing"""
+        path = self.write_grammar(tmp_path, "public <start> = hello | hi;")
+        cacheDir = str(tmp_path / "cache")
+        first = cache.loadGrammar(path, cacheDir=cacheDir)
+
+        def failingParser(*args, **kwargs):
+            raise AssertionError("grammar was parsed again")
+        monkeypatch.setattr(parser, "getGrammarObject", failingParser)
+        second = cache.loadGrammar(path, cacheDir=cacheDir)
+
+        assert str(second) == str(first)
+        assert second.publicRules[0].lhs.name == "<start>"
+
+    def test_changed_source_is_parsed(self, tmp_path):
+        """Test that the cache is keyed by the grammar source"""
+        path = self.write_grammar(tmp_path, "public <start> = hello;")
+        cacheDir = str(tmp_path / "cache")
+        cache.loadGrammar(path, cacheDir=cacheDir)
+        self.write_grammar(tmp_path, "public <start> = goodbye;")
+
+        grammar = cache.loadGrammar(path, cacheDir=cacheDir)
+
+        assert grammar.publicRules[0].rhs == ["goodbye"]
+        assert len(os.listdir(cacheDir)) == 2
+
+    def test_disabled_cache(self, tmp_path, monkeypatch):
+        """Test that nothing is written when the cache is disabled"""
+        path = self.write_grammar(tmp_path, "public <start> = hello;")
+        cacheDir = tmp_path / "cache"
+        cache.loadGrammar(path, useCache=False, cacheDir=str(cacheDir))
+        monkeypatch.setenv("JSGF_NO_CACHE", "1")
+        cache.loadGrammar(path, cacheDir=str(cacheDir))
+
+        assert not cacheDir.exists()
+
+    def test_least_recently_used_files_are_evicted(self, tmp_path):
+        """Test that the cache directory is kept under its size cap"""
+        cacheDir = str(tmp_path / "cache")
+        for i in range(5):
+            source = "public <start> = word%d;" % i
+            path = self.write_grammar(tmp_path, source)
+            cache.loadGrammar(path, cacheDir=cacheDir)
+            # distinct access times, oldest first
+            os.utime(os.path.join(cacheDir, cache.cacheKey(source) + cache.CACHE_SUFFIX), (i, i))
+        size = max(os.path.getsize(os.path.join(cacheDir, name)) for name in os.listdir(cacheDir))
+
+        cache.pruneCache(cacheDir, maxCacheSize=2 * size)
+
+        remaining = os.listdir(cacheDir)
+        assert len(remaining) == 2
+        assert cache.cacheKey("public <start> = word4;") + cache.CACHE_SUFFIX in remaining
+
+    def test_corrupt_file_is_rebuilt(self, tmp_path):
+        """Test that an unreadable cache file is treated as a miss"""
+        path = self.write_grammar(tmp_path, "public <start> = hello;")
+        cacheDir = tmp_path / "cache"
+        cacheDir.mkdir()
+        key = cache.cacheKey("public <start> = hello;")
+        (cacheDir / (key + cache.CACHE_SUFFIX)).write_bytes(b"not a pickle")
+
+        grammar = cache.loadGrammar(path, cacheDir=str(cacheDir))
+
+        assert grammar.publicRules[0].rhs == ["hello"]
+        assert cache.readCache(str(cacheDir), key) is not None
+
+    def test_new_cache_dir_is_private(self, tmp_path):
+        """Test that the cache directory is created readable by its owner only"""
+        path = self.write_grammar(tmp_path, "public <start> = hello;")
+        cacheDir = tmp_path / "cache"
+        cache.loadGrammar(path, cacheDir=str(cacheDir))
+
+        assert cacheDir.stat().st_mode & 0o777 == 0o700
+
+    def test_shared_cache_dir_is_not_used(self, tmp_path, monkeypatch):
+        """Test that a cache directory others can write to is neither read nor written"""
+        path = self.write_grammar(tmp_path, "public <start> = hello;")
+        cacheDir = tmp_path / "cache"
+        cache.loadGrammar(path, cacheDir=str(cacheDir))
+        cacheDir.chmod(0o777)
+
+        parses = []
+        getGrammarObject = parser.getGrammarObject
+        monkeypatch.setattr(parser, "getGrammarObject",
+                            lambda *args, **kwargs: parses.append(1) or getGrammarObject(*args, **kwargs))
+        self.write_grammar(tmp_path, "public <start> = goodbye;")
+        cache.loadGrammar(path, cacheDir=str(cacheDir))
+        self.write_grammar(tmp_path, "public <start> = hello;")
+        grammar = cache.loadGrammar(path, cacheDir=str(cacheDir))
+
+        assert grammar.publicRules[0].rhs == ["hello"]
+        assert len(parses) == 2
+        assert len(os.listdir(cacheDir)) == 1
+
+    def test_file_of_other_user_is_not_unpickled(self, tmp_path, monkeypatch):
+        """Test that a cache file owned by someone else is a miss"""
+        path = self.write_grammar(tmp_path, "public <start> = hello;")
+        cacheDir = str(tmp_path / "cache")
+        cache.loadGrammar(path, cacheDir=cacheDir)
+        key = cache.cacheKey("public <start> = hello;")
+        assert cache.readCache(cacheDir, key) is not None
+
+        uid = os.stat(cacheDir).st_uid
+        monkeypatch.setattr(os, "getuid", lambda: uid + 1, raising=False)
+
+        assert cache.readCache(cacheDir, key) is None
+
+    @pytest.mark.skipif(not hasattr(os, "O_NOFOLLOW"), reason="needs O_NOFOLLOW")
+    def test_symlinked_file_is_not_unpickled(self, tmp_path):
+        """Test that a cache file that is a symbolic link is a miss"""
+        path = self.write_grammar(tmp_path, "public <start> = hello;")
+        cacheDir = tmp_path / "cache"
+        cache.loadGrammar(path, cacheDir=str(cacheDir))
+        key = cache.cacheKey("public <start> = hello;")
+        cacheFile = cacheDir / (key + cache.CACHE_SUFFIX)
+        cacheFile.rename(tmp_path / "elsewhere")
+        cacheFile.symlink_to(tmp_path / "elsewhere")
+
+        assert cache.readCache(str(cacheDir), key) is None
+
 
 class TestIntegration:
     """Integration tests using the actual grammar files"""